@@ -0,0 +1,259 @@
+import argparse
+import csv
+import io
+import json
+import random
+import zipfile
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Generators for synthetic data to benchmark the pipeline with: projects in
+# Processing or Java, Canvas exports of submissions and typegraphs. All three
+# are generated from the same project specification, so the typegraph of a
+# generated project has roughly the shape the extractor would produce for it.
+
+NOUNS = [ "Ball", "Particle", "Boid", "Flock", "Player", "Enemy", "Wall", "Button", "Level", "Score", "Timer", "Grid",
+          "Cell", "Planet", "Rocket", "Bullet", "Item", "Shop", "Menu", "Tile", "Road", "Car", "Light", "Sensor" ]
+VERBS = [ "update", "show", "move", "check", "reset", "apply", "add", "remove", "find", "count", "draw", "handle" ]
+FIELD_TYPES = [ "float", "int", "boolean", "PVector", "String" ]
+
+@dataclass
+class MethodSpec:
+    name: str
+    # Calls to methods of other classes, as (class index, method index)
+    calls: List[Tuple[int, int]] = field(default_factory = list)
+    # Fields of the class that the method reads or writes
+    fields: List[int] = field(default_factory = list)
+
+@dataclass
+class ClassSpec:
+    name: str
+    fields: List[Tuple[str, str]]
+    methods: List[MethodSpec]
+    extends: int | None = None
+
+@dataclass
+class ProjectSpec:
+    name: str
+    classes: List[ClassSpec]
+
+def generateSpec(rand: random.Random, name: str, classes: int, methods: int) -> ProjectSpec:
+    names = rand.sample(NOUNS, min(classes, len(NOUNS)))
+    names += [ f"{rand.choice(NOUNS)}{i}" for i in range(len(names), classes) ]
+    specs = []
+    for i, className in enumerate(names):
+        fields = [ (rand.choice(FIELD_TYPES), f"f{j}") for j in range(rand.randint(1, 5)) ]
+        methodNames = [ f"{rand.choice(VERBS)}{j}" for j in range(max(1, round(rand.gauss(methods, methods / 3)))) ]
+        specs.append(ClassSpec(className, fields, [
+            MethodSpec(
+                methodName,
+                calls = [ (rand.randrange(classes), 0) for _ in range(rand.randint(0, 2)) ] if classes > 1 else [],
+                fields = rand.sample(range(len(fields)), rand.randint(0, len(fields))))
+            for methodName in methodNames ],
+            extends = rand.randrange(i) if i > 0 and rand.random() < 0.15 else None))
+    # Calls go to the first method of a class, which always exists
+    for spec in specs:
+        for method in spec.methods:
+            method.calls = [ (cls, 0) for cls, _ in method.calls ]
+    return ProjectSpec(name, specs)
+
+def fieldDefault(type: str) -> str:
+    return { "float": "0.5", "int": "1", "boolean": "false", "PVector": "new PVector(0, 0)", "String": "\"\"" }[type]
+
+def renderClass(spec: ProjectSpec, cls: ClassSpec, indent: str = "") -> List[str]:
+    extends = "" if cls.extends is None else f" extends {spec.classes[cls.extends].name}"
+    lines = [ f"{indent}class {cls.name}{extends} {{" ]
+    lines += [ f"{indent}  {type} {name} = {fieldDefault(type)};" for type, name in cls.fields ]
+    for method in cls.methods:
+        lines.append(f"{indent}  void {method.name}() {{")
+        for i in method.fields:
+            type, name = cls.fields[i]
+            lines.append(f"{indent}    {name} = {fieldDefault(type)};")
+        for target, targetMethod in method.calls:
+            other = spec.classes[target]
+            lines.append(f"{indent}    new {other.name}().{other.methods[targetMethod].name}();")
+        lines.append(f"{indent}  }}")
+    lines.append(f"{indent}}}")
+    return lines
+
+# Render a project as a Processing sketch, with the setup and draw methods in
+# the main tab and a tab per class
+def renderProcessing(spec: ProjectSpec) -> Dict[str, str]:
+    main = spec.classes[0]
+    files = { f"{spec.name}/{spec.name}.pde": "\n".join([
+        f"{main.name} root;",
+        "",
+        "void setup() {",
+        "  size(640, 360);",
+        f"  root = new {main.name}();",
+        "}",
+        "",
+        "void draw() {",
+        "  background(#202020);",
+        f"  root.{main.methods[0].name}();",
+        "}",
+        "" ]) }
+    for cls in spec.classes:
+        files[f"{spec.name}/{cls.name}.pde"] = "\n".join(renderClass(spec, cls)) + "\n"
+    return files
+
+# Render a project as plain Java, in the source folder like the projects that
+# copy_assessed.py produces
+def renderJava(spec: ProjectSpec) -> Dict[str, str]:
+    files = {}
+    for cls in spec.classes:
+        lines = [ "package game;", "", "import processing.core.PVector;", "" ] + renderClass(spec, cls)
+        lines[4] = "public " + lines[4]
+        files[f"source/game/{cls.name}.java"] = "\n".join(lines).replace("= 0.5;", "= 0.5f;") + "\n"
+    files["source/game/Main.java"] = "\n".join([
+        "package game;",
+        "",
+        "public class Main {",
+        "  public static void main(String[] args) {",
+        f"    new {spec.classes[0].name}().{spec.classes[0].methods[0].name}();",
+        "  }",
+        "}",
+        "" ])
+    return files
+
+# Generate the typegraph of a project, with the nodes and edges that the
+# extractor creates: containment, invocations, field accesses, type
+# dependencies and inheritance, annotated with the scheme of in-project
+# declarations, the location of external declarations and modifiers
+def generateTypeGraph(spec: ProjectSpec, lang: str) -> List[list]:
+    prefix = f"/{spec.name}" if lang == "processing" else "/game"
+    def classLoc(cls: ClassSpec) -> str: return f"java+class://{prefix}/{cls.name}"
+    def methodLoc(cls: ClassSpec, method: MethodSpec) -> str: return f"java+method://{prefix}/{cls.name}/{method.name}()"
+    def fieldLoc(cls: ClassSpec, name: str) -> str: return f"java+field://{prefix}/{cls.name}/{name}"
+
+    edges = set()
+    external = set()
+    if lang == "processing":
+        sketch = f"java+class:///{spec.name}"
+        applet = "java+class:///processing/core/PApplet"
+        edges.add((sketch, "extends", applet))
+        external.add(applet)
+        for method in [ "setup()", "draw()" ]:
+            edges.add((sketch, "contains", f"java+method:///{spec.name}/{method}"))
+            edges.add((f"java+method:///{spec.name}/{method}", "overrides", f"java+method:///processing/core/PApplet/{method}"))
+            external.add(f"java+method:///processing/core/PApplet/{method}")
+        for cls in spec.classes:
+            edges.add((sketch, "contains", classLoc(cls)))
+
+    for cls in spec.classes:
+        if cls.extends is not None:
+            edges.add((classLoc(cls), "extends", classLoc(spec.classes[cls.extends])))
+        for type, name in cls.fields:
+            edges.add((classLoc(cls), "contains", fieldLoc(cls, name)))
+            if type == "PVector" or type == "String":
+                typeLoc = "java+class:///processing/core/PVector" if type == "PVector" else "java+class:///java/lang/String"
+                edges.add((fieldLoc(cls, name), "dependsOn", typeLoc))
+                edges.add((classLoc(cls), "dependsOn", typeLoc))
+                external.add(typeLoc)
+        for method in cls.methods:
+            edges.add((classLoc(cls), "contains", methodLoc(cls, method)))
+            for i in method.fields:
+                edges.add((methodLoc(cls, method), "accessesField", fieldLoc(cls, cls.fields[i][1])))
+                edges.add((classLoc(cls), "accessesField", fieldLoc(cls, cls.fields[i][1])))
+            for target, targetMethod in method.calls:
+                other = spec.classes[target]
+                edges.add((methodLoc(cls, method), "invokes", methodLoc(other, other.methods[targetMethod])))
+                edges.add((classLoc(cls), "invokes", methodLoc(other, other.methods[targetMethod])))
+                edges.add((methodLoc(cls, method), "dependsOn", classLoc(other)))
+                edges.add((classLoc(cls), "dependsOn", classLoc(other)))
+
+    graph = [ [ source, edge, target ] for source, edge, target in sorted(edges) ]
+    nodes = sorted({ node for source, _, target in edges for node in [ source, target ] })
+    for node in nodes:
+        if node in external:
+            graph.append([ node, { "annotation": { "location": node } }, node ])
+        else:
+            graph.append([ node, { "annotation": { "scheme": node.split(":")[0] } }, node ])
+            if not node.startswith("java+field"):
+                graph.append([ node, { "annotation": { "modifier": "public" if node.startswith("java+method") else "default" } }, node ])
+    return graph
+
+def writeFiles(dest: Path, files: Dict[str, str]):
+    for name, content in files.items():
+        (dest / name).parent.mkdir(parents = True, exist_ok = True)
+        (dest / name).write_text(content, encoding = "utf-8")
+
+def generateSpecs(count: int, classes: Tuple[int, int], methods: Tuple[int, int], seed: int) -> List[ProjectSpec]:
+    rand = random.Random(seed)
+    return [
+        generateSpec(rand, f"Sketch{i:05}", rand.randint(*classes), rand.randint(*methods))
+        for i in range(count) ]
+
+# Write a cohort of projects to dest, with a folder per project, like the
+# target of run.py in batch mode
+def writeCohort(dest: Path, lang: str, specs: List[ProjectSpec]):
+    for spec in specs:
+        writeFiles(dest / spec.name, renderProcessing(spec) if lang == "processing" else renderJava(spec))
+
+# Write a typegraph for every project to dest, in the location where the
+# graph matcher expects it
+def writeTypeGraphs(dest: Path, lang: str, specs: List[ProjectSpec]):
+    for spec in specs:
+        graphDir = dest / spec.name / "source" / "graph"
+        graphDir.mkdir(parents = True, exist_ok = True)
+        with open(graphDir / "typegraph.json", "w") as f:
+            json.dump(generateTypeGraph(spec, lang), f)
+
+# Write a Canvas export of the projects to dest, as expected by anonymize.py:
+# submissions.zip with a zip per student, gradebook.csv and rubrics.json
+def writeCanvasExport(dest: Path, lang: str, specs: List[ProjectSpec], seed: int):
+    rand = random.Random(seed)
+    dest.mkdir(parents = True, exist_ok = True)
+    students = [
+        (f"{rand.choice(NOUNS)}son, {rand.choice(NOUNS)}", str(1000000 + i), str(100 + i), str(500 + i))
+        for i in range(len(specs)) ]
+
+    with open(dest / "gradebook.csv", "w", newline = "", encoding = "utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([ "Student", "ID", "SIS User ID" ])
+        writer.writerow([ "Points Possible", "", "" ])
+        for name, studentNumber, userId, _ in students:
+            writer.writerow([ name, userId, studentNumber ])
+
+    nodes = []
+    with zipfile.ZipFile(dest / "submissions.zip", "w", zipfile.ZIP_DEFLATED) as submissions:
+        for spec, (name, studentNumber, userId, attachmentId) in zip(specs, students):
+            files = renderProcessing(spec) if lang == "processing" else renderJava(spec)
+            inner = io.BytesIO()
+            with zipfile.ZipFile(inner, "w", zipfile.ZIP_DEFLATED) as project:
+                for file, content in files.items():
+                    project.writestr(file, f"// {name} ({studentNumber})\n" + content)
+            lastName = name.split(",")[0].lower()
+            submissions.writestr(f"{lastName}_{userId}_{attachmentId}_{spec.name}.zip", inner.getvalue())
+            nodes.append({
+                "attachments": [ { "_id": attachmentId } ],
+                "score": rand.randint(0, 10),
+                "rubricAssessmentsConnection": { "nodes": [ { "assessmentRatings": [
+                    { "_id": "1", "comments": f"Nice work {name.split(', ')[1]}", "points": rand.randint(0, 3), "criterion": { "_id": "c1" } }
+                ] } ] } })
+
+    with open(dest / "rubrics.json", "w") as f:
+        json.dump({ "data": { "assignment": {
+            "name": "Benchmark", "course": { "name": "Benchmark" }, "rubric": { "title": "Benchmark" },
+            "submissionsConnection": { "nodes": nodes } } } }, f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Generate synthetic projects, Canvas exports and typegraphs to benchmark the pipeline with")
+    parser.add_argument("kind", choices = [ "cohort", "canvas", "typegraphs" ], help = "What to generate")
+    parser.add_argument("dest", help = "Directory to write the generated data to")
+    parser.add_argument("-l", "--language", choices = [ "java", "processing" ], default = "processing", help = "Language of the generated projects")
+    parser.add_argument("-n", "--projects", type = int, default = 100, help = "Number of projects")
+    parser.add_argument("--classes", type = int, nargs = 2, default = [ 3, 12 ], metavar = ("MIN", "MAX"), help = "Range of the number of classes per project")
+    parser.add_argument("--methods", type = int, nargs = 2, default = [ 2, 8 ], metavar = ("MIN", "MAX"), help = "Range of the average number of methods per class")
+    parser.add_argument("--seed", type = int, default = 0, help = "Seed for the random generator")
+    args = parser.parse_args()
+
+    specs = generateSpecs(args.projects, tuple(args.classes), tuple(args.methods), args.seed)
+    if args.kind == "cohort":
+        writeCohort(Path(args.dest), args.language, specs)
+    elif args.kind == "canvas":
+        writeCanvasExport(Path(args.dest), args.language, specs, args.seed)
+    else:
+        writeTypeGraphs(Path(args.dest), args.language, specs)
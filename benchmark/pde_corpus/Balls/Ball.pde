@@ -0,0 +1,7 @@
+class Ball {
+  float x, y;
+  color c = color(255);
+  Ball(float x, double y) { this.x = x; this.y = (float) y; }
+  void update() { y += 0.5; }
+  void show() { fill(c); ellipse(x, y, 10, 10); }
+}
@@ -0,0 +1,25 @@
+import java.util.List;
+// A sketch with balls
+ArrayList<Ball> balls = new ArrayList<Ball>();
+color bg = #FF8800;
+float speed = 2.5, gravity = .1;
+int[] counts = { 1, 2, 3 };
+HashMap<String, Integer> names;
+
+void setup() {
+  size(640, 360, P2D);
+  smooth(4);
+  for (int i = 0; i < 10; i++) balls.add(new Ball(random(width), 1e2));
+  println(int(speed * 2.0) + " " + float("3.5") + " #123456 color");
+  println(balls.size());
+}
+
+@Override
+void draw() {
+  background(bg);
+  for (Ball b : balls) { b.update(); b.show(); }
+}
+
+color pick(float x) { return color(x, 0, 0); }
+
+public void mousePressed() { speed *= 1.5d; }
@@ -0,0 +1,36 @@
+class Boid implements Steerable {
+  PVector position, velocity, acceleration;
+  float r = 2.0;
+  float maxforce = 0.03;
+  float maxspeed = 2;
+  color tint = color(255, 255 * noise(0.5), 0);
+
+  Boid(float x, float y) {
+    acceleration = new PVector(0, 0);
+    float angle = random(TWO_PI);
+    velocity = new PVector(cos(angle), sin(angle));
+    position = new PVector(x, y);
+  }
+
+  public void applyForce(PVector force) {
+    acceleration.add(force);
+  }
+
+  void update() {
+    velocity.add(acceleration);
+    velocity.limit(maxspeed);
+    position.add(velocity);
+    acceleration.mult(0);
+  }
+
+  void render() {
+    float theta = velocity.heading() + radians(90);
+    fill(tint, 100);
+    stroke(#FFFFFF);
+    pushMatrix();
+    translate(position.x, position.y);
+    rotate(theta);
+    triangle(0, -r * 2, -r, r * 2, r, r * 2);
+    popMatrix();
+  }
+}
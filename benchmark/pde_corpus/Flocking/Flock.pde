@@ -0,0 +1,21 @@
+import java.util.function.Consumer;
+
+class Flock {
+  ArrayList<Boid> boids = new ArrayList<Boid>();
+
+  void run(PVector wind) {
+    boids.forEach(b -> {
+      b.applyForce(wind);
+      b.update();
+      b.render();
+    });
+  }
+
+  void addBoid(Boid b) {
+    boids.add(b);
+  }
+
+  int size() {
+    return boids.size();
+  }
+}
@@ -0,0 +1,26 @@
+/* Flocking, with the boids in a separate tab and an interface in a Java tab */
+Flock flock;
+final int BOIDS = 150;
+PVector wind = new PVector(0.01, -.002);
+
+void setup() {
+  fullScreen();
+  pixelDensity(displayDensity());
+  flock = new Flock();
+  for (int i = 0; i < BOIDS; i++) {
+    flock.addBoid(new Boid(width / 2, height / 2));
+  }
+}
+
+void draw() {
+  background(#1E1E1E);
+  flock.run(wind);
+}
+
+void keyPressed() {
+  if (key == 'r') {
+    flock = new Flock();
+  } else if (key == '+') {
+    flock.addBoid(new Boid(mouseX, mouseY));
+  }
+}
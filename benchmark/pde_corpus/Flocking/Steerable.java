@@ -0,0 +1,5 @@
+import processing.core.PVector;
+
+public interface Steerable {
+    void applyForce(PVector force);
+}
@@ -0,0 +1,64 @@
+import java.util.Map;
+import java.util.TreeMap;
+import static java.lang.Math.abs;
+
+enum Category { FOOD, TOOL, OTHER }
+
+Map<String, Item> items = new TreeMap<String, Item>();
+String[] lines;
+int selected = -1;
+color[] palette = { #FF0000, #00FF00, #0000FF };
+long created = 10000000000L;
+double total = 0.0d;
+
+void setup() {
+  size(400, 300);
+  lines = loadStrings("items.txt");
+  if (lines != null) {
+    for (String line : lines) {
+      String[] parts = split(line, ',');
+      items.put(parts[0], new Item(parts[0], float(parts[1]), int(parts[2])));
+    }
+  }
+  textSize(14.0);
+}
+
+void draw() {
+  background(240);
+  int y = 20;
+  for (Map.Entry<String, Item> entry : items.entrySet()) {
+    fill(palette[y / 20 % palette.length]);
+    text(entry.getKey() + ": " + nf(entry.getValue().price, 0, 2), 10, y);
+    y += 20;
+  }
+}
+
+void mouseClicked() {
+  selected = (int) (mouseY / 20.0);
+  println("Selected " + selected + ", " + char(65 + selected) + ", " + abs(-1));
+}
+
+float totalPrice() throws IllegalStateException {
+  float sum = 0;
+  for (Item item : items.values()) {
+    sum += item.price * item.count;
+  }
+  return sum;
+}
+
+class Item {
+  String name;
+  float price;
+  int count;
+  Category category = Category.OTHER;
+
+  Item(String name, float price, int count) {
+    this.name = name;
+    this.price = price;
+    this.count = count;
+  }
+
+  boolean isExpensive() {
+    return price > 1e3;
+  }
+}
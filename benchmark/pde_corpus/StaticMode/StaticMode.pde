@@ -0,0 +1,7 @@
+// Static mode: no methods, so the native preprocessor falls back to
+// processing-java
+size(200, 200);
+background(255);
+for (int i = 0; i < 10; i++) {
+  ellipse(random(width), random(height), 10.5, 10.5);
+}
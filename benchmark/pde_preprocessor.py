@@ -0,0 +1,127 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from typing import List, Set, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from pre_process import pde_preprocessor, pde_to_java
+
+CORPUS_DIR = Path(__file__).parent / "pde_corpus"
+# The Java source processing-java generated for the sketches in the corpus, a
+# folder per sketch, which tests/test_pde_preprocessor.py compares the native
+# output with
+EXPECTED_DIR = Path(__file__).parent / "pde_expected"
+
+# Normalize generated Java source for comparison: comments and whitespace are
+# dropped and the imports are compared as a set, since their order does not
+# change the meaning of the code
+def normalize(source: str) -> Tuple[Set[str], List[str]]:
+    tokens = [ text for kind, text in pde_preprocessor.tokenize(source) if kind not in [ "whitespace", "comment" ] ]
+    imports = set()
+    code = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == "import":
+            end = tokens.index(";", i)
+            imports.add(" ".join(tokens[i:end + 1]))
+            i = end + 1
+        else:
+            code.append(tokens[i])
+            i += 1
+    return imports, code
+
+# Compare the generated source folders, returning a description of the first
+# difference or None if they are equivalent
+def compareSources(expectedDir: Path, actualDir: Path) -> str | None:
+    expectedFiles = sorted(file.name for file in expectedDir.glob("*.java"))
+    actualFiles = sorted(file.name for file in actualDir.glob("*.java"))
+    if expectedFiles != actualFiles:
+        return f"files {expectedFiles} != {actualFiles}"
+    for file in expectedFiles:
+        expectedImports, expectedCode = normalize((expectedDir / file).read_text(encoding = "utf-8"))
+        actualImports, actualCode = normalize((actualDir / file).read_text(encoding = "utf-8"))
+        if expectedImports != actualImports:
+            return f"{file}: imports {sorted(expectedImports ^ actualImports)} differ"
+        for i, (expected, actual) in enumerate(zip(expectedCode, actualCode)):
+            if expected != actual:
+                return f"{file}: expected {' '.join(expectedCode[max(0, i - 5):i + 5])!r}, got {' '.join(actualCode[max(0, i - 5):i + 5])!r}"
+        if len(expectedCode) != len(actualCode):
+            return f"{file}: expected {len(expectedCode)} tokens, got {len(actualCode)}"
+    return None
+
+# Save the Java source processing-java generated for a sketch in EXPECTED_DIR
+def saveExpected(name: str, sourceDir: Path):
+    expectedDir = EXPECTED_DIR / name
+    shutil.rmtree(expectedDir, ignore_errors = True)
+    expectedDir.mkdir(parents = True)
+    for file in sourceDir.glob("*.java"):
+        shutil.copy2(file, expectedDir / file.name)
+
+def main(sketches: List[Path], save: bool = False) -> int:
+    counts = { "same": 0, "different": 0, "unsupported": 0, "failed": 0 }
+    nativeTime, processingTime = 0.0, 0.0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for sketch in sketches:
+            name = sketch.name
+            start = time.perf_counter()
+            try:
+                pde_preprocessor.preprocessSketch(str(sketch), str(Path(tmpdir, "native", name)))
+            except pde_preprocessor.UnsupportedSketch as err:
+                print(f"{name}: not supported by the native preprocessor ({err})")
+                counts["unsupported"] += 1
+                continue
+            finally:
+                nativeTime += time.perf_counter() - start
+
+            start = time.perf_counter()
+            proc = subprocess.run(
+                [ "processing-java", "--sketch=" + str(sketch.resolve()), "--output=" + str(Path(tmpdir, "processing", name)), "--force", "--build" ],
+                capture_output = True, text = True)
+            processingTime += time.perf_counter() - start
+            if proc.returncode != 0:
+                print(f"{name}: processing-java failed\n{proc.stderr}")
+                counts["failed"] += 1
+                continue
+            if save:
+                saveExpected(name, Path(tmpdir, "processing", name, "source"))
+
+            difference = compareSources(Path(tmpdir, "processing", name, "source"), Path(tmpdir, "native", name, "source"))
+            if difference is None:
+                counts["same"] += 1
+            else:
+                print(f"{name}: {difference}")
+                counts["different"] += 1
+
+    print(f"{len(sketches)} sketches: {counts['same']} equivalent, {counts['different']} different, "
+          f"{counts['unsupported']} not supported, {counts['failed']} failed with processing-java")
+    print(f"Native preprocessor: {nativeTime:.2f}s, processing-java: {processingTime:.2f}s")
+    return 0 if counts["different"] == 0 else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare the output of the native Processing preprocessor with processing-java")
+    parser.add_argument(
+        "projects",
+        nargs = "?",
+        default = str(CORPUS_DIR),
+        help = "Directory containing a folder per sketch or per project, defaults to the corpus next to this script")
+    parser.add_argument(
+        "--save-expected",
+        action = "store_true",
+        help = f"Save the output of processing-java for every sketch in {EXPECTED_DIR.name}, for the tests")
+    args = parser.parse_args()
+
+    # Projects that are not a sketch themselves are searched for their sketch,
+    # like pde_to_java.py does
+    sketches = []
+    for entry in sorted(os.scandir(args.projects), key = lambda entry: entry.name):
+        if entry.is_dir():
+            pdeRoot = pde_to_java.findPdeRoot(entry.path)
+            if pdeRoot is not None and pde_to_java.isValidProcessingProject(pdeRoot):
+                sketches.append(Path(pdeRoot))
+    sys.exit(main(sketches, args.save_expected))
@@ -0,0 +1,124 @@
+import argparse
+import random
+import re
+import sys
+import time
+
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple, Union
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from pre_process import anonymize
+
+LegacyReplacements = Dict[re.Pattern, Union[str, Callable[[re.Match[str]], str]]]
+
+SYLLABLES = [
+    "an", "ber", "ca", "dor", "el", "fen", "go", "han", "is", "jo", "ka", "li", "mar", "no", "os", "pe", "ro", "sa",
+    "ti", "vin", "wil", "bru", "cle", "dra", "fo", "gri", "hu", "ja", "kre", "lo", "mu", "nie", "pra", "qui", "ru",
+    "sto", "tre", "u", "vo", "xa", "ye", "zi" ]
+ACCENTS = { "a": "á", "e": "é", "o": "ö", "u": "ü", "i": "ï" }
+CODE = [ "public", "void", "setup", "draw", "float", "int", "Handler", "PVector", "max", "floor", "de", "van", "x", "y", "=", "+", "(", ")", "{", "}", ";", "//" ]
+
+def generateName(random: random.Random, syllables: int) -> str:
+    name = "".join(random.choice(SYLLABLES) for _ in range(syllables))
+    if random.random() < 0.2:
+        i = random.randrange(len(name))
+        name = name[:i] + ACCENTS.get(name[i], name[i]) + name[i + 1:]
+    return name.capitalize()
+
+# Generate students as (name, id) tuples with the name in "Last, First" format,
+# including short names and names with accents. When one name contains another,
+# which one is replaced depends on the order of the patterns in the per-pattern
+# replacement, while the combined regex prefers the longest. To be able to
+# compare the output, names that overlap with another name are not used.
+def generateStudents(random: random.Random, count: int) -> List[Tuple[str, str]]:
+    students = []
+    literals: List[str] = []
+    while len(students) < count:
+        last = generateName(random, random.randint(2, 4))
+        if random.random() < 0.3:
+            last = random.choice([ "de", "van", "van der" ]) + " " + last
+        first = generateName(random, random.randint(1, 3))
+        new = [ anonymize.removeAccents(n).lower() for n in [ last, first ] + last.split(" ") if n not in [ "de", "van", "der" ] ]
+        if any(a in b or b in a for a in new for b in literals):
+            continue
+        literals += new
+        students.append((f"{last}, {first}", str(random.randint(1000000, 9999999))))
+    return students
+
+# Generate code-like text with names, name parts and student numbers mixed in,
+# in varying case and with or without accents. Names are never directly next to
+# each other.
+def generateText(random: random.Random, students: List[Tuple[str, str]], size: int, nameFrequency: float) -> str:
+    tokens = []
+    length = 0
+    while length < size:
+        token = random.choice(CODE)
+        if random.random() < nameFrequency:
+            name, id = random.choice(students)
+            token += " " + random.choice([
+                id,
+                name.split(",")[0].strip(),
+                name.split(",")[1].strip(),
+                name.split(",")[0].split(" ")[-1],
+                anonymize.removeAccents(name.split(",")[1].strip()).lower(),
+                name.split(",")[1].strip().upper() + "Class",
+            ])
+        tokens.append(token)
+        length += len(token) + 1
+    return " ".join(tokens)
+
+# The replacements as they were created before the combined regex, with one
+# pattern per literal, applied one after the other
+def legacyReplacements(replacements: anonymize.Replacements) -> LegacyReplacements:
+    patterns: LegacyReplacements = {}
+    for (literal, bounded), alias in replacements.aliases.items():
+        if bounded:
+            patterns[re.compile(r"(^|[^a-zA-Z])" + re.escape(literal) + r"([^a-zA-Z]|$)", re.IGNORECASE)] = \
+                lambda match, alias=alias: match.group(1) + alias + match.group(2)
+        else:
+            patterns.setdefault(re.compile(re.escape(literal), re.IGNORECASE), alias)
+    return patterns
+
+def legacyReplaceAll(s: str, replacements: LegacyReplacements) -> str:
+    for pidPattern, replacement in replacements.items():
+        s = pidPattern.sub(replacement, s)
+    return s
+
+def main(students: int, files: int, fileSize: int, nameFrequency: float, seed: int):
+    rand = random.Random(seed)
+    cohort = generateStudents(rand, students)
+    texts = [ generateText(rand, cohort, fileSize, nameFrequency) for _ in range(files) ]
+    size = sum(len(text) for text in texts) / 1_000_000
+
+    random.seed(seed)
+    start = time.perf_counter()
+    replacements = anonymize.generatePiiReplacements(cohort)
+    combinedSetup = time.perf_counter() - start
+    legacy = legacyReplacements(replacements)
+
+    start = time.perf_counter()
+    legacyOutput = [ legacyReplaceAll(text, legacy) for text in texts ]
+    legacyTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    combinedOutput = [ anonymize.replaceAll(text, replacements) for text in texts ]
+    combinedTime = time.perf_counter() - start
+
+    different = sum(1 for a, b in zip(legacyOutput, combinedOutput) if a != b)
+    print(f"{students} students, {len(replacements.aliases)} literals, {files} files, {size:.1f} million characters")
+    print(f"Per-pattern replacement: {legacyTime:.2f}s")
+    print(f"Combined replacement:    {combinedTime:.2f}s (plus {combinedSetup:.2f}s to build the regex), {legacyTime / combinedTime:.1f}x faster")
+    print(f"Files with different output: {different}")
+    return 0 if different == 0 else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare the combined PII replacement in anonymize.py with replacing one pattern at a time")
+    parser.add_argument("--students", type = int, default = 600, help = "Number of students in the generated cohort")
+    parser.add_argument("--files", type = int, default = 50, help = "Number of generated files")
+    parser.add_argument("--file-size", type = int, default = 10000, help = "Number of characters per generated file")
+    parser.add_argument("--name-frequency", type = float, default = 0.02, help = "Fraction of tokens followed by a name or student number")
+    parser.add_argument("--seed", type = int, default = 0, help = "Seed for the random generator")
+    args = parser.parse_args()
+
+    sys.exit(main(args.students, args.files, args.file_size, args.name_frequency, args.seed))
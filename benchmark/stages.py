@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from benchmark import generate
+from pipeline import graphmatcher
+
+ROOT_DIR = Path(__file__).parent.parent
+DEFAULT_RESULTS = Path(__file__).parent / "results.jsonl"
+
+# Stages that can be benchmarked, with the tools they need on the PATH
+STAGES: Dict[str, List[str]] = {
+    "anonymize": [],
+    "build": [ "processing-java" ],
+    "build-native": [],
+    "pipeline": [ "rascal", "dotnet" ],
+    "match": [ "dotnet" ],
+}
+
+def gitRevision() -> Dict[str, str | bool]:
+    try:
+        commit = subprocess.run([ "git", "rev-parse", "HEAD" ], cwd = ROOT_DIR, capture_output = True, text = True, check = True).stdout.strip()
+        status = subprocess.run([ "git", "status", "--porcelain", "--untracked-files=no" ], cwd = ROOT_DIR, capture_output = True, text = True, check = True).stdout
+        return { "commit": commit, "dirty": status.strip() != "" }
+    except (OSError, subprocess.CalledProcessError):
+        return { "commit": "unknown", "dirty": True }
+
+# Run a command and measure its wall time, CPU time and peak resident set size.
+# The resource usage reported by wait4 includes all processes started by the
+# command that it waited for, like processing-java or the extractor JVMs.
+def measure(command: List[str], cwd: Path, log: Path) -> Dict[str, float]:
+    with open(log, "w") as logFile:
+        start = time.perf_counter()
+        proc = subprocess.Popen(command, cwd = cwd, stdout = logFile, stderr = subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "wall": wall,
+        "cpu": usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in kilobytes on Linux
+        "maxRss": usage.ru_maxrss / 1024,
+        "returncode": proc.returncode,
+    }
+
+# Generate the input of a stage in workDir and return the command to run it
+def prepareStage(stage: str, workDir: Path, lang: str, specs: List[generate.ProjectSpec], args) -> List[str]:
+    python = sys.executable
+    if stage == "anonymize":
+        generate.writeCanvasExport(workDir, lang, specs, args.seed)
+        return [ python, str(ROOT_DIR / "pre_process" / "anonymize.py"), "submissions.zip", "gradebook.csv",
+                 "--rubrics", "rubrics.json", "--jobs", str(args.jobs) ]
+    elif stage in [ "build", "build-native" ]:
+        generate.writeCohort(workDir / "projects", "processing", specs)
+        return [ python, str(ROOT_DIR / "pre_process" / "pde_to_java.py"), "projects", "--jobs", str(args.jobs) ] \
+            + ([ "--native" ] if stage == "build-native" else [])
+    elif stage == "pipeline":
+        generate.writeCohort(workDir / "projects", lang, specs)
+        return [ python, str(ROOT_DIR / "run.py"), "--language", lang, "--mode", "batch", "--criteria", args.criteria,
+                 "--target", "projects", "--output", "output", "--no-cache", "--jobs", str(args.jobs),
+                 "--extract-workers", str(args.jobs) ] + args.pipeline_args
+    elif stage == "match":
+        generate.writeTypeGraphs(workDir / "projects", lang, specs)
+        return graphmatcher.graphmatcherCommand() + [ "--criteria", args.criteria, "--targets", "projects", "run", "--output", "output" ]
+    raise ValueError(f"Unknown stage {stage}")
+
+def runBenchmarks(args) -> int:
+    revision = gitRevision()
+    if args.label is not None:
+        revision["label"] = args.label
+    failed = 0
+    with open(args.results, "a") as results:
+        for stage in args.stages:
+            missing = [ tool for tool in STAGES[stage] if shutil.which(tool) is None ]
+            if len(missing) > 0:
+                print(f"Skipping {stage}, {', '.join(missing)} not found on the PATH")
+                continue
+            for size in args.sizes:
+                specs = generate.generateSpecs(size, tuple(args.classes), tuple(args.methods), args.seed)
+                for run in range(args.repeat):
+                    with tempfile.TemporaryDirectory() as tmpdir:
+                        workDir = Path(tmpdir)
+                        command = prepareStage(stage, workDir, args.language, specs, args)
+                        measurement = measure(command, workDir, workDir / "log.txt")
+                        if measurement["returncode"] != 0:
+                            failed += 1
+                            print((workDir / "log.txt").read_text()[-2000:], file=sys.stderr)
+                    record = {
+                        **revision,
+                        "date": datetime.now(timezone.utc).isoformat(timespec = "seconds"),
+                        "stage": stage,
+                        "language": "processing" if stage.startswith("build") else args.language,
+                        "projects": size,
+                        "classes": args.classes,
+                        "methods": args.methods,
+                        "jobs": args.jobs,
+                        "run": run,
+                        **measurement,
+                    }
+                    results.write(json.dumps(record) + "\n")
+                    results.flush()
+                    print(f"{stage:>12} {size:>6} projects, run {run + 1}: {measurement['wall']:8.2f}s wall, "
+                          f"{measurement['cpu']:8.2f}s CPU, {measurement['maxRss']:8.1f} MB peak RSS"
+                          + ("" if measurement["returncode"] == 0 else f", failed with code {measurement['returncode']}"))
+    return 0 if failed == 0 else 1
+
+# The revision a record belongs to, which is its label if it has one and the
+# commit otherwise
+def recordRevision(record: dict) -> str:
+    return record.get("label") or record["commit"]
+
+# Compare the median measurements of two revisions in a results file. By
+# default, the last two revisions in the file are compared.
+def compareResults(args) -> int:
+    with open(args.results, "r") as results:
+        records = [ json.loads(line) for line in results if line.strip() != "" ]
+    revisions = list(dict.fromkeys(recordRevision(record) for record in records))
+    if len(revisions) == 0:
+        print("No results to compare")
+        return 1
+    base = next((rev for rev in revisions if rev.startswith(args.base)), None) if args.base else revisions[max(0, len(revisions) - 2)]
+    new = next((rev for rev in revisions if rev.startswith(args.new)), None) if args.new else revisions[-1]
+    if base is None or new is None:
+        print(f"Revision not found in {args.results}, available revisions: {', '.join(rev[:10] for rev in revisions)}")
+        return 1
+
+    def medians(revision: str) -> Dict[tuple, Dict[str, float]]:
+        groups: Dict[tuple, List[dict]] = {}
+        for record in records:
+            if recordRevision(record) == revision and record["returncode"] == 0:
+                groups.setdefault((record["stage"], record["language"], record["projects"], record["jobs"]), []).append(record)
+        return { key: { metric: statistics.median(r[metric] for r in group) for metric in [ "wall", "cpu", "maxRss" ] }
+                 for key, group in groups.items() }
+
+    baseMedians, newMedians = medians(base), medians(new)
+    print(f"Comparing {base[:10]} (base) with {new[:10]} (new), medians of successful runs")
+    print(f"{'stage':>12} {'language':>10} {'projects':>8} {'jobs':>4} {'wall':>22} {'CPU':>22} {'peak RSS (MB)':>22}")
+    for key in sorted(set(baseMedians) | set(newMedians)):
+        columns = []
+        for metric in [ "wall", "cpu", "maxRss" ]:
+            if key in baseMedians and key in newMedians:
+                old, current = baseMedians[key][metric], newMedians[key][metric]
+                columns.append(f"{old:8.2f} → {current:8.2f} {current / old if old > 0 else 1:4.2f}x")
+            else:
+                value = (newMedians if key in newMedians else baseMedians)[key][metric]
+                columns.append(f"{'new' if key in newMedians else 'base'} only: {value:8.2f}".rjust(22))
+        print(f"{key[0]:>12} {key[1]:>10} {key[2]:>8} {key[3]:>4} " + " ".join(columns))
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the stages of the pipeline on generated projects")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    run = subparsers.add_parser("run", help = "Run the benchmarks and append the results to the results file")
+    run.add_argument("-s", "--stages", nargs = "+", choices = list(STAGES), default = list(STAGES), help = "Stages to benchmark, defaults to all stages")
+    run.add_argument("-l", "--language", choices = [ "java", "processing" ], default = "processing", help = "Language of the generated projects")
+    run.add_argument("-n", "--sizes", type = int, nargs = "+", default = [ 10, 100 ], help = "Numbers of projects to benchmark with")
+    run.add_argument("--classes", type = int, nargs = 2, default = [ 3, 12 ], metavar = ("MIN", "MAX"), help = "Range of the number of classes per project")
+    run.add_argument("--methods", type = int, nargs = 2, default = [ 2, 8 ], metavar = ("MIN", "MAX"), help = "Range of the average number of methods per class")
+    run.add_argument("-j", "--jobs", type = int, default = 1, help = "Value for the --jobs (and --extract-workers) option of the stages")
+    run.add_argument("-r", "--repeat", type = int, default = 1, help = "Number of times to run every benchmark")
+    run.add_argument("-c", "--criteria", default = str(ROOT_DIR / "criteria" / "AiC"), help = "Criteria for the pipeline and match stages")
+    run.add_argument("--seed", type = int, default = 0, help = "Seed for the generated projects")
+    run.add_argument("--label", help = "Label to store the results under instead of the commit, for example for uncommitted changes")
+    run.add_argument("--pipeline-args", nargs = argparse.REMAINDER, default = [], help = "Extra arguments for run.py in the pipeline stage")
+
+    compare = subparsers.add_parser("compare", help = "Compare the results of two revisions")
+    compare.add_argument("--base", help = "Commit or label to compare against, defaults to the second to last revision in the results")
+    compare.add_argument("--new", help = "Commit or label to compare, defaults to the last revision in the results")
+
+    for subparser in [ run, compare ]:
+        subparser.add_argument("--results", default = str(DEFAULT_RESULTS), help = "File to store the results in, as JSON lines")
+
+    args = parser.parse_args()
+    sys.exit(runBenchmarks(args) if args.command == "run" else compareResults(args))
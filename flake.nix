@@ -24,8 +24,8 @@
         devShells.default = pkgs.mkShell {
           name = "apollopp";
           nativeBuildInputs = with pkgs; [
-            # For helper scripts
-            python3
+            # For helper scripts and their tests
+            (python3.withPackages (ps: [ ps.pytest ]))
             # For translating Processing projects
             processing
             # For running the extractors
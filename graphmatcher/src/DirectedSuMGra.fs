@@ -238,6 +238,19 @@ module Query =
     let extendWithGraph (id: string) (extension: Graph<'node, 'edge>) (query: Query<'node, 'edge>) =
         extendWithMultiGraph id (MultiGraph.extendWithGraph extension (query.Graph, query.NodeArray)) query
 
+    /// The structure of the query as the multiedges between its nodes, numbered
+    /// by their position in the matching order instead of their index. Queries
+    /// with the same canonical form find the same mappings on a target, with the
+    /// nodes at the same position mapped to the same target nodes, regardless
+    /// of the names and indices of their nodes.
+    let canonical (query: Query<'node, 'edge>) : (int * int * Set<'edge>) list =
+        let order = List.toArray query.Order
+        [ for i in 0 .. order.Length - 1 do
+            for j in 0 .. order.Length - 1 do
+                let edges = query.Graph.[order.[i], order.[j]]
+                if not (Set.isEmpty edges) then
+                    yield i, j, edges ]
+
     let encode (encodeNode: Encoder<'node>) (encodeEdge: Encoder<'edge>) : Encoder<Query<'node, 'edge>> =
         fun query -> Encode.object [
             "id", query.Id |> Encode.string
@@ -2,6 +2,10 @@ namespace PatternTree
 
 open DirectedSuMGra
 open Graph
+open System
+open System.Collections.Concurrent
+open System.Collections.Generic
+open System.Threading
 open Thoth.Json.Net
 
 type Verdict = Positive | Negative | Neutral
@@ -21,6 +25,107 @@ module Verdict =
             | _ -> Decode.fail $"Invalid verdict, expected `positive`, `negative` or `neutral`"
         )
 
+/// Memoizes the mappings of queries on a single target, so patterns that are
+/// shared between criteria and pattern trees are only searched once. Queries
+/// are identified by their canonical form (see Query.canonical) and the target
+/// nodes their first nodes are already mapped to, so identical patterns with
+/// different node names share their results as well. The cache can be used
+/// from multiple threads at the same time. Kept between changes to a criterion,
+/// only the patterns that changed, and the patterns extending them, miss the
+/// cache.
+type SearchCache<'edge when 'edge : comparison>() =
+    // Canonical forms are numbered, and the number of every query object is
+    // kept, so they only have to be computed and compared once
+    let canonicalIds = ConcurrentDictionary<(int * int * Set<'edge>) list, int>(HashIdentity.Structural)
+    let queryIds = ConcurrentDictionary<obj, int>(HashIdentity.Reference)
+    // The mappings with the generation in which they were last used
+    let results = ConcurrentDictionary<int * int list, int[] seq * int ref>(HashIdentity.Structural)
+    let mutable nextId = 0
+    let mutable generation = 0
+    let mutable hits = 0
+    let mutable misses = 0
+
+    /// Get the mappings for the key from the cache, or search and add them.
+    /// Mappings are stored as the target nodes of the query nodes in order,
+    /// and are only searched as far as they have been enumerated, so a search
+    /// that stops early does not have to find all mappings.
+    let getOrSearch key (search: unit -> int[] seq) =
+        let searched = Seq.delay search |> Seq.cache
+        let cached, used = results.GetOrAdd(key, (searched, ref generation))
+        used.Value <- generation
+        if obj.ReferenceEquals(cached, searched)
+        then Interlocked.Increment(&misses) |> ignore
+        else Interlocked.Increment(&hits) |> ignore
+        cached
+
+    let canonicalId canonical =
+        canonicalIds.GetOrAdd(canonical, fun _ -> Interlocked.Increment(&nextId))
+
+    let queryId (query: Query<'qnode, 'edge>) =
+        queryIds.GetOrAdd(query, fun _ -> canonicalId (Query.canonical query))
+
+    let toTargetNodes (order: int[]) (mapping: Map<int, int>) =
+        order |> Array.map (fun node -> mapping.[node])
+
+    let toMapping (order: int[]) (targetNodes: int[]) =
+        Seq.zip order targetNodes |> Map.ofSeq
+
+    member _.Hits = hits
+    member _.Misses = misses
+    member _.Count = results.Count
+
+    /// Remove the mappings that were not used since the last call, like those
+    /// of patterns that were changed or removed, and count hits and misses
+    /// from zero again. Should not be called while searching.
+    member _.Trim() =
+        for KeyValue (key, (_, used)) in results do
+            if used.Value < generation then
+                results.TryRemove(key) |> ignore
+        // The numbers of canonical forms without mappings left are not needed
+        // anymore, a pattern that is changed back just gets a new one
+        let usedIds = results.Keys |> Seq.map fst |> HashSet
+        for KeyValue (canonical, id) in canonicalIds do
+            if not (usedIds.Contains id) then
+                canonicalIds.TryRemove(canonical) |> ignore
+        // Queries are loaded again with every change, so the old ones would
+        // only be kept alive
+        queryIds.Clear()
+        generation <- generation + 1
+        hits <- 0
+        misses <- 0
+
+    /// Cached version of SubgraphSearch.searchExtended, with the same
+    /// assumption that the mapped nodes are the first in the query order
+    member _.SearchExtended (target: Target<'tnode, 'edge>) (query: Query<'qnode, 'edge>) (mapping: Map<int, int>) : Map<int, int> seq =
+        let order = List.toArray query.Order
+        let mapped = [ for i in 0 .. mapping.Count - 1 -> mapping.[order.[i]] ]
+        getOrSearch (queryId query, mapped) (fun () ->
+            SubgraphSearch.searchExtended target query mapping
+            |> Seq.map (toTargetNodes order)
+        )
+        |> Seq.map (toMapping order)
+
+/// Limits on the mappings collected by PatternTree.collect
+type SearchLimits =
+    { /// Verdicts of which only the number of mappings is needed, so their
+      /// mappings are counted but not kept
+      CountOnly: Set<Verdict>
+      /// The maximum number of mappings to find for a single query. A pattern
+      /// tree is no longer searched once all of its queries have reached it.
+      MaxMappings: int option }
+
+module SearchLimits =
+    let none = { CountOnly = Set.empty; MaxMappings = None }
+
+/// The mappings collected for a verdict
+type VerdictResult<'query> =
+    { /// The number of mappings, counting at most MaxMappings per query
+      Count: int
+      /// Whether a query reached MaxMappings, so there may be more mappings
+      Capped: bool
+      /// The mappings with their query, or None if the verdict is count-only
+      Mappings: ('query * Map<int, int>) array option }
+
 type PatternTree<'pattern> =
     { Verdict: Verdict
       Pattern: 'pattern
@@ -28,6 +133,13 @@ type PatternTree<'pattern> =
 
 module PatternTree =
 
+    /// The patterns of the tree, the root first
+    let rec patterns (tree: PatternTree<'pattern>) : 'pattern seq =
+        seq {
+            yield tree.Pattern
+            yield! Seq.collect patterns tree.Children
+        }
+
     let buildQueries (id: string) (tree: PatternTree<Graph<'node, 'edge>>) : PatternTree<Query<'node, 'edge>> =
         let rec buildQueries (baseQuery: Query<'node, 'edge>) i tree =
             let query = Query.extendWithGraph ($"%s{baseQuery.Id}.%d{i}") tree.Pattern baseQuery
@@ -39,16 +151,104 @@ module PatternTree =
           Pattern = query
           Children = tree.Children |> List.mapi (buildQueries query) }
 
-    let search (target: Target<'tnode, 'edge>) (tree: PatternTree<Query<'qnode, 'edge>>) : (Verdict * Query<'qnode, 'edge> * Map<int, int>) seq =
-        let rec search target mapping tree =
+    let private searchWith (searchExtended: Query<'qnode, 'edge> -> Map<int, int> -> Map<int, int> seq) (tree: PatternTree<Query<'qnode, 'edge>>) : (Verdict * Query<'qnode, 'edge> * Map<int, int>) seq =
+        let rec search mapping tree =
             seq {
-                for mapping in SubgraphSearch.searchExtended target tree.Pattern mapping do
-                    let childResults = tree.Children |> Seq.collect (search target mapping)
+                for mapping in searchExtended tree.Pattern mapping do
+                    // Cached, so the children are not searched again after
+                    // checking whether they found anything
+                    let childResults = tree.Children |> Seq.collect (search mapping) |> Seq.cache
                     if Seq.isEmpty childResults 
                     then yield tree.Verdict, tree.Pattern, mapping 
                     else yield! childResults
             }
-        search target Map.empty tree
+        search Map.empty tree
+
+    /// Search the pattern trees and collect their mappings per verdict, sorted
+    /// by verdict and leaving out verdicts without mappings. Like searchWith,
+    /// a mapping of a query is only a result if none of its children extend
+    /// it. Every child is searched once per mapping of its parent, and only as
+    /// far as needed within the limits: once a child and its descendants have
+    /// reached the maximum, only whether it matches at all is checked.
+    let private collectWith (searchExtended: Query<'qnode, 'edge> -> Map<int, int> -> Map<int, int> seq) (limits: SearchLimits) (trees: PatternTree<Query<'qnode, 'edge>> seq) : (Verdict * VerdictResult<Query<'qnode, 'edge>>) array =
+        let maxMappings = defaultArg limits.MaxMappings Int32.MaxValue
+        let counts = Dictionary<Query<'qnode, 'edge>, int>(HashIdentity.Reference)
+        let mappings = Dictionary<Verdict, ResizeArray<Query<'qnode, 'edge> * Map<int, int>>>()
+
+        let count query =
+            match counts.TryGetValue(query) with
+            | true, count -> count
+            | false, _ -> 0
+        let isFull query = count query >= maxMappings
+        let rec isSaturated tree = isFull tree.Pattern && List.forall isSaturated tree.Children
+
+        let add tree mapping =
+            counts.[tree.Pattern] <- count tree.Pattern + 1
+            if not (limits.CountOnly.Contains tree.Verdict) then
+                match mappings.TryGetValue(tree.Verdict) with
+                | true, verdictMappings -> verdictMappings.Add((tree.Pattern, mapping))
+                | false, _ -> mappings.[tree.Verdict] <- ResizeArray [ tree.Pattern, mapping ]
+
+        let rec evaluate tree mapping =
+            let mutable extended = false
+            for child in tree.Children do
+                if isSaturated child then
+                    if not extended && not (isFull tree.Pattern) then
+                        extended <- not (Seq.isEmpty (searchExtended child.Pattern mapping))
+                else
+                    use childMappings = (searchExtended child.Pattern mapping).GetEnumerator()
+                    while not (isSaturated child) && childMappings.MoveNext() do
+                        extended <- true
+                        evaluate child childMappings.Current
+            if not extended && not (isFull tree.Pattern) then
+                add tree mapping
+
+        let trees = Seq.toList trees
+        for tree in trees do
+            use rootMappings = (searchExtended tree.Pattern Map.empty).GetEnumerator()
+            while not (isSaturated tree) && rootMappings.MoveNext() do
+                evaluate tree rootMappings.Current
+
+        let rec queries tree =
+            seq {
+                yield tree.Verdict, tree.Pattern
+                yield! Seq.collect queries tree.Children
+            }
+        trees
+        |> Seq.collect queries
+        |> Seq.groupBy fst
+        |> Seq.choose (fun (verdict, queries) ->
+            let queries = Seq.map snd queries
+            match Seq.sumBy count queries with
+            | 0 -> None
+            | total ->
+                Some (verdict, {
+                    Count = total
+                    Capped = Seq.exists isFull queries
+                    Mappings =
+                        if limits.CountOnly.Contains verdict then None
+                        else Some (mappings.[verdict].ToArray())
+                })
+        )
+        |> Seq.sortBy fst
+        |> Seq.toArray
+
+    let search (target: Target<'tnode, 'edge>) (tree: PatternTree<Query<'qnode, 'edge>>) : (Verdict * Query<'qnode, 'edge> * Map<int, int>) seq =
+        searchWith (SubgraphSearch.searchExtended target) tree
+
+    /// Search like search, reusing the mappings of queries that were already
+    /// searched on the same target through the cache
+    let searchCached (cache: SearchCache<'edge>) (target: Target<'tnode, 'edge>) (tree: PatternTree<Query<'qnode, 'edge>>) : (Verdict * Query<'qnode, 'edge> * Map<int, int>) seq =
+        searchWith (cache.SearchExtended target) tree
+
+    /// Collect the mappings of the pattern trees on a target, see collectWith
+    let collect (target: Target<'tnode, 'edge>) (limits: SearchLimits) (trees: PatternTree<Query<'qnode, 'edge>> seq) : (Verdict * VerdictResult<Query<'qnode, 'edge>>) array =
+        collectWith (SubgraphSearch.searchExtended target) limits trees
+
+    /// Collect like collect, reusing the mappings of queries that were already
+    /// searched on the same target through the cache
+    let collectCached (cache: SearchCache<'edge>) (target: Target<'tnode, 'edge>) (limits: SearchLimits) (trees: PatternTree<Query<'qnode, 'edge>> seq) : (Verdict * VerdictResult<Query<'qnode, 'edge>>) array =
+        collectWith (cache.SearchExtended target) limits trees
 
     let searchSimple (targetGraph: Graph<'tnode, 'edge>) (tree: PatternTree<Graph<'qnode, 'edge>>) : (Verdict * Query<'qnode, 'edge> * Map<'qnode, 'tnode>) seq =
         let target = Target.fromGraph "target" targetGraph
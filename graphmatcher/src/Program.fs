@@ -25,6 +25,64 @@ module Task =
     let wait (t: Task<'a>) =
         t.GetAwaiter().GetResult()
 
+/// Spans of the work done for every target, recorded when --trace is given and
+/// written as Chrome trace events. Timestamps are microseconds since the Unix
+/// epoch, so run.py can merge the spans into its own trace.
+module Trace =
+    let mutable enabled = false
+
+    let private events = Collections.Concurrent.ConcurrentQueue<JsonValue>()
+    let private epoch = float (DateTimeOffset.UtcNow.ToUnixTimeMilliseconds()) * 1000.0
+    let private clock = Stopwatch.StartNew()
+
+    let now () = epoch + clock.Elapsed.TotalMicroseconds
+
+    let record (name: string) (cat: string) (start: float) (args: (string * JsonValue) list) =
+        if enabled then
+            events.Enqueue(Encode.object [
+                "name", Encode.string name
+                "cat", Encode.string cat
+                "ph", Encode.string "X"
+                "ts", Encode.float start
+                "dur", Encode.float (now () - start)
+                "pid", Encode.int Environment.ProcessId
+                "tid", Encode.int Environment.CurrentManagedThreadId
+                "args", Encode.object args
+            ])
+
+    let write (file: string) =
+        let processName = Encode.object [
+            "name", Encode.string "process_name"
+            "ph", Encode.string "M"
+            "pid", Encode.int Environment.ProcessId
+            "args", Encode.object [ "name", Encode.string "graphmatcher" ]
+        ]
+        let trace = Encode.object [ "traceEvents", Encode.seq (Seq.append [ processName ] events) ]
+        File.WriteAllText(file, Encode.toString 0 trace)
+
+/// Limits the number of targets that are indexed and matched at the same time
+/// to the number of jobs set through --jobs, which defaults to the number of
+/// processors. Matching is synchronous, so without this every task in
+/// Task.WhenAll would run on the thread that started it.
+module Jobs =
+    let mutable count = Environment.ProcessorCount
+    let mutable private limit = new Threading.SemaphoreSlim(count)
+
+    let setCount (n: int) =
+        count <- max 1 n
+        limit <- new Threading.SemaphoreSlim(count)
+
+    /// Run f on the thread pool once one of the jobs is available
+    let run (f: unit -> 'a) : Task<'a> =
+        let limit = limit
+        task {
+            do! limit.WaitAsync()
+            try
+                return! Task.Run<'a>(Func<'a> f)
+            finally
+                limit.Release() |> ignore
+        }
+
 type Criterion<'pattern> =
     { Criterion: string
       Patterns: PatternTree<'pattern> list }
@@ -45,33 +103,166 @@ module Criterion =
             { Criterion = get.Required.Field "criterion" Decode.string
               Patterns = get.Required.Field "patterns" (Decode.list (PatternTree.decode decodePattern)) }
 
-let makeTarget (id: string) typegraphFile =
+/// Targets with their indices, saved next to the typegraph when --index-cache
+/// is given, so later runs on the same projects can skip building them. The
+/// index is only used if it was built from a typegraph with the same SHA-256
+/// hash and written in the same format version.
+module TargetIndex =
+    let mutable enabled = false
+
+    let fileName = "targetindex.json"
+    /// Increment when Target, the way its indices are built or its encoding
+    /// changes, so indices written by older versions are rebuilt
+    let version = 1
+
+    let hash (typegraph: byte[]) =
+        Convert.ToHexString(Security.Cryptography.SHA256.HashData(typegraph)).ToLowerInvariant()
+
+    let private decoder (hash: string) : Decoder<Target<string, TypeGraphEdge>> =
+        Decode.field "version" Decode.int
+        |> Decode.andThen (fun v ->
+            if v <> version then Decode.fail $"Index has version %d{v} instead of %d{version}"
+            else Decode.field "hash" Decode.string)
+        |> Decode.andThen (fun h ->
+            if h <> hash then Decode.fail "Index was built from a different typegraph"
+            else Decode.field "target" (Target.decode Decode.string TypeGraphEdge.decode))
+
+    /// Load the index of the target in graphDir if it exists and matches the
+    /// typegraph with the given hash
+    let tryLoad (id: string) (graphDir: string) (hash: string) =
+        task {
+            let file = Path.Combine(graphDir, fileName)
+            if not (File.Exists file) then
+                return None
+            else
+                let start = Trace.now ()
+                let! json = File.ReadAllTextAsync file
+                let target = Decode.fromString (decoder hash) json
+                Trace.record "load index" "load" start [ "target", Encode.string id; "bytes", Encode.int json.Length ]
+                return
+                    target
+                    |> Result.map (fun target -> { target with Id = id })
+                    |> Result.toOption
+        }
+
+    /// Save the index of a target, writing to a temporary file first so a
+    /// concurrent run never reads a partial index. Failing to save is not an
+    /// error, since the index is only a cache.
+    let save (graphDir: string) (hash: string) (target: Target<string, TypeGraphEdge>) =
+        task {
+            let start = Trace.now ()
+            let json =
+                Encode.object [
+                    "version", Encode.int version
+                    "hash", Encode.string hash
+                    "target", Target.encode Encode.string TypeGraphEdge.encode target
+                ]
+                |> Encode.toString 0
+            let file = Path.Combine(graphDir, fileName)
+            let tmp = Path.Combine(graphDir, $".tmp-%d{Environment.ProcessId}-{fileName}")
+            try
+                do! File.WriteAllTextAsync(tmp, json)
+                File.Move(tmp, file, overwrite = true)
+            with e ->
+                // The target can still be used, it only has to be built again next time
+                eprintfn "Could not save the index of target %s: %s" target.Id e.Message
+            Trace.record "save index" "load" start [ "target", Encode.string target.Id; "bytes", Encode.int json.Length ]
+        }
+
+let buildTargetFromJson (id: string) (bytes: byte[]) =
+    let start = Trace.now ()
+    let graph = Decode.fromString (TypeGraph.decode Decode.string) (Text.Encoding.UTF8.GetString bytes)
+    Trace.record "parse" "load" start [ "target", Encode.string id ]
+    graph
+    |> Result.bind (fun graph -> 
+        if Set.isEmpty graph
+        then Error "Cannot build Target from an empty graph"
+        else
+            let start = Trace.now ()
+            let target = Target.fromGraph id graph
+            Trace.record "index" "load" start [
+                "target", Encode.string id
+                "nodes", Encode.int target.NodeArray.Length
+                "edges", Encode.int (Set.count graph)
+            ]
+            Ok target
+    )
+
+let buildTargetFromBinary (id: string) (bytes: byte[]) =
+    let start = Trace.now ()
+    let graph = TypeGraphBinary.decodeMultiGraph bytes
+    Trace.record "parse" "load" start [ "target", Encode.string id ]
+    graph
+    |> Result.bind (fun (graph, nodeArray) ->
+        if nodeArray.IsEmpty
+        then Error "Cannot build Target from an empty graph"
+        else
+            let start = Trace.now ()
+            let target = Target.fromMultiGraph id (graph, nodeArray)
+            Trace.record "index" "load" start [
+                "target", Encode.string id
+                "nodes", Encode.int nodeArray.Length
+                "edges", Encode.int (TypeGraphBinary.edgeCount bytes)
+            ]
+            Ok target
+    )
+
+/// Load a target from its binary typegraph.bin if the extractor wrote one, or
+/// from typegraph.json otherwise. With the index cache enabled, the saved
+/// indices are used if they are still up to date, and saved otherwise.
+let makeTarget (id: string) (graphDir: string) =
     task {
-        let! json = File.ReadAllTextAsync typegraphFile
-        return 
-            Decode.fromString (TypeGraph.decode Decode.string) json
-            |> Result.bind (fun graph -> 
-                if Set.isEmpty graph
-                then Error "Cannot build Target from an empty graph"
-                else Ok (Target.fromGraph id graph)
-            )
+        let binaryFile = Path.Combine(graphDir, "typegraph.bin")
+        let typegraphFile, build =
+            if File.Exists binaryFile
+            then binaryFile, buildTargetFromBinary
+            else Path.Combine(graphDir, "typegraph.json"), buildTargetFromJson
+        let start = Trace.now ()
+        let! bytes = File.ReadAllBytesAsync typegraphFile
+        Trace.record "read" "load" start [ "target", Encode.string id; "bytes", Encode.int bytes.Length ]
+        if not TargetIndex.enabled then
+            return! Jobs.run (fun () -> build id bytes)
+        else
+            let hash = TargetIndex.hash bytes
+            match! TargetIndex.tryLoad id graphDir hash with
+            | Some target ->
+                return Ok target
+            | None ->
+                let! target = Jobs.run (fun () -> build id bytes)
+                match target with
+                | Ok target -> do! TargetIndex.save graphDir hash target
+                | Error _ -> ()
+                return target
     }
 
+/// The project directories in targetsDir, sorted, so --skip and --limit select
+/// the same targets on every run and the results are always written in the
+/// same order
+let targetDirs (skip: int option) (limit: int option) (targetsDir: string) =
+    Directory.EnumerateDirectories targetsDir
+    |> Seq.sortWith (fun a b -> String.CompareOrdinal(a, b))
+    |> match skip with Some n -> Seq.skip n | None -> id
+    |> match limit with Some n -> Seq.truncate n | None -> id
+    |> Seq.toList
+
+let loadTarget (graphPath: string) (projectDir: string) =
+    let id = Path.GetFileName (Path.TrimEndingDirectorySeparator projectDir)
+    makeTarget id (Path.Combine(projectDir, graphPath)) |> Task.map (Result.mapError (fun err -> id, err))
+
+let printLoadError (writer: TextWriter) (id: string, err: string) =
+    fprintfn writer "Error loading target %s: %s" id err
+
+/// Load all targets at once, for configure mode, which runs every changed
+/// criterion on all of them
 let makeTargets (graphPath: string) (skip: int option) (limit: int option) (targetsDir: string) =
     task {
         let! results =
-            Directory.EnumerateDirectories targetsDir
-            |> match skip with Some n -> Seq.skip n | None -> id
-            |> match limit with Some n -> Seq.truncate n | None -> id
-            |> Seq.map (fun projectDir ->
-                let typegraphFile = Path.Combine(projectDir, graphPath, "typegraph.json")
-                let id = Path.GetFileName (Path.TrimEndingDirectorySeparator projectDir)
-                makeTarget id typegraphFile |> Task.map (Result.mapError (fun err -> id, err))
-            )
+            targetDirs skip limit targetsDir
+            |> Seq.map (loadTarget graphPath)
             |> Task.WhenAll
         return
             results
-            |> Seq.map (Result.mapError (fun (id, err) -> printfn "Error loading target %s: %s" id err))
+            |> Seq.map (Result.mapError (printLoadError Console.Out))
             |> Seq.choose Result.toOption
             |> Seq.toList
     }
@@ -114,39 +305,63 @@ let makeCriteria (criteriaDir: string) =
             |> Seq.toList
     }
 
-type RunResult = (Verdict * (Query<string, TypeGraphEdge> * Map<int, int>) array) array
+/// The number of searches that were answered from the search caches of the
+/// targets and the number that had to be searched, reported with --time
+module SearchStats =
+    let mutable private hits = 0L
+    let mutable private misses = 0L
 
-let run (criterion: Criterion<Query<string, TypeGraphEdge>>) (target: Target<string, TypeGraphEdge>) : RunResult =
-    Seq.collect (PatternTree.search target) criterion.Patterns
-    |> Seq.groupBy (fun (verdict, _, _) -> verdict)
-    |> Seq.map (fun (verdict, results) ->
-        let results =
-            results
-            |> Seq.map (fun (_, query, mapping) -> query, mapping)
-            |> Seq.toArray
-        verdict, results
-    )
-    |> Seq.sortBy fst
-    |> Seq.toArray
+    let add (cache: SearchCache<'edge>) =
+        Threading.Interlocked.Add(&hits, int64 cache.Hits) |> ignore
+        Threading.Interlocked.Add(&misses, int64 cache.Misses) |> ignore
 
-let runAllCriteria (criteria: #seq<Criterion<Query<string, TypeGraphEdge>>>) (target: Target<string, TypeGraphEdge>) =
-    criteria
-    |> Seq.map (fun criterion -> task { return criterion.Criterion, run criterion target })
-    |> Task.WhenAll
+    let reset () =
+        hits <- 0L
+        misses <- 0L
 
-let runAllTargets (targets: #seq<Target<string, TypeGraphEdge>>) (criterion: Criterion<Query<string, TypeGraphEdge>>) =
-    targets
-    |> Seq.map (fun target -> task { return target, run criterion target })
-    |> Task.WhenAll
+    let print (writer: TextWriter) =
+        fprintfn writer "Search cache: %d hits, %d misses" hits misses
 
-let runAll (targets: #seq<Target<string, TypeGraphEdge>>) (criteria: #seq<Criterion<Query<string, TypeGraphEdge>>>) =
-    targets 
-    |> Seq.map (fun target ->
-        task {
-            let! results = runAllCriteria criteria target
-            return target, results 
-        }
-    ) 
+type RunResult = (Verdict * VerdictResult<Query<string, TypeGraphEdge>>) array
+
+/// The limits on the mappings run collects, set through --count-only and
+/// --max-mappings. run and serve only need the number of neutral mappings, but
+/// configure uses them to suggest extensions.
+module Limits =
+    let mutable search = SearchLimits.none
+
+/// Run a criterion on a target. Searches are shared through the cache with the
+/// other criteria run on the same target.
+let run (cache: SearchCache<TypeGraphEdge>) (criterion: Criterion<Query<string, TypeGraphEdge>>) (target: Target<string, TypeGraphEdge>) : RunResult =
+    let start = Trace.now ()
+    let result = PatternTree.collectCached cache target Limits.search criterion.Patterns
+    Trace.record "match" "match" start [ "target", Encode.string target.Id; "criterion", Encode.string criterion.Criterion ]
+    result
+
+let runAllCriteria (criteria: #seq<Criterion<Query<string, TypeGraphEdge>>>) (target: Target<string, TypeGraphEdge>) =
+    task {
+        let cache = SearchCache<TypeGraphEdge>()
+        let! results =
+            criteria
+            |> Seq.map (fun criterion -> Jobs.run (fun () -> criterion.Criterion, run cache criterion target))
+            |> Task.WhenAll
+        SearchStats.add cache
+        return results
+    }
+
+/// Run a criterion on all targets, with the search cache of each target. The
+/// caches only keep the mappings used by this criterion afterwards, so they
+/// can be kept to run a changed version of the criterion again.
+let runAllTargets (targets: #seq<Target<string, TypeGraphEdge>>) (caches: #seq<SearchCache<TypeGraphEdge>>) (criterion: Criterion<Query<string, TypeGraphEdge>>) =
+    Seq.zip targets caches
+    |> Seq.map (fun (target, cache) ->
+        Jobs.run (fun () ->
+            let results = run cache criterion target
+            SearchStats.add cache
+            cache.Trim()
+            target, results
+        )
+    )
     |> Task.WhenAll
 
 let writeRunResult (target: Target<string, TypeGraphEdge>) (results: RunResult) (indent: int) (writer: TextWriter) =
@@ -155,13 +370,13 @@ let writeRunResult (target: Target<string, TypeGraphEdge>) (results: RunResult)
         do! writer.WriteAsync(indentation)
         do! writer.WriteLineAsync(
             results
-            |> Seq.map (fun (verdict, mappings) -> $"{verdict}: {mappings.Length}") 
+            |> Seq.map (fun (verdict, result) -> $"""{verdict}: {result.Count}{if result.Capped then "+" else ""}""")
             |> String.concat " / "
         )
 
-        for verdict, results in results do
+        for verdict, result in results do
             if verdict <> Neutral then
-                for query, mapping in results do
+                for query, mapping in Option.defaultValue [||] result.Mappings do
                     do! writer.WriteLineAsync($"{indentation}- {verdict} / {query.Id}")
                     for (KeyValue (qnode, tnode)) in mapping do
                         do! writer.WriteLineAsync($"{indentation}  - `{query.NodeArray[qnode]}` ->")
@@ -191,7 +406,7 @@ let writeCriterionResults (results: (Target<string,TypeGraphEdge> * RunResult) a
             |> Array.collect snd
             |> Array.groupBy fst
             |> Array.map (fun (verdict, results) ->
-                verdict, float (results |> Array.collect snd |> Array.length) / float targetCount
+                verdict, float (results |> Array.sumBy (fun (_, result) -> result.Count)) / float targetCount
             )
             |> Array.sortBy fst
 
@@ -200,6 +415,129 @@ let writeCriterionResults (results: (Target<string,TypeGraphEdge> * RunResult) a
             do! writer.WriteLineAsync($"{indentation}  %A{verdict}: %.1f{avg}")
     }
 
+/// Encode the results of a target as a record per criterion and verdict, with
+/// the number of mappings and the target nodes each query node is mapped to.
+/// Every verdict gets a record, also without mappings, so the number of
+/// records of a criterion and verdict is the number of targets. Like in the
+/// markdown output, the mappings of neutral verdicts are left out.
+let encodeTargetResults (target: Target<string, TypeGraphEdge>) (results: (string * RunResult) array) : JsonValue seq =
+    seq {
+        for criterion, results in results do
+            for verdict in [ Positive; Negative; Neutral ] do
+                let result =
+                    results
+                    |> Array.tryFind (fun (v, _) -> v = verdict)
+                    |> Option.map snd
+                    |> Option.defaultValue
+                        { Count = 0
+                          Capped = false
+                          Mappings = if Limits.search.CountOnly.Contains verdict then None else Some [||] }
+                Encode.object [
+                    "target", Encode.string target.Id
+                    "criterion", Encode.string criterion
+                    "verdict", Verdict.encode verdict
+                    "count", Encode.int result.Count
+                    if result.Capped then
+                        "capped", Encode.bool true
+                    match result.Mappings with
+                    | Some mappings when verdict <> Neutral ->
+                        "mappings", mappings |> Array.map (fun (query, mapping) ->
+                            Encode.object [
+                                "query", Encode.string query.Id
+                                "nodes", Encode.object [
+                                    for KeyValue (qnode, tnode) in mapping ->
+                                        query.NodeArray[qnode], Encode.string target.NodeArray[tnode]
+                                ]
+                            ]
+                        ) |> Encode.array
+                    | _ -> ()
+                ]
+    }
+
+let writeTargetRecords (target: Target<string, TypeGraphEdge>) (results: (string * RunResult) array) (writer: TextWriter) =
+    task {
+        for record in encodeTargetResults target results do
+            do! writer.WriteLineAsync(Encode.toString 0 record)
+        do! writer.FlushAsync()
+    }
+
+/// Format of the results: markdown for people to read, or newline delimited
+/// JSON with a record per target, criterion and verdict for other tools
+type ResultFormat =
+    | Markdown
+    | Ndjson
+
+/// Get a function that creates a writer for the results of a target, writing
+/// to a separate file per target in outputDir or to stdout
+let getResultWriter (format: ResultFormat) (outputDir: string option) : string -> TextWriter * (unit -> unit) =
+    let extension = match format with Markdown -> "md" | Ndjson -> "ndjson"
+    match outputDir with
+    | Some outputDir ->
+        if not (Directory.Exists outputDir) then Directory.CreateDirectory outputDir |> ignore
+        fun targetId ->
+            let path = Path.Combine(outputDir, $"{Path.GetFileName (Path.TrimEndingDirectorySeparator targetId)}.{extension}")
+            let file = File.CreateText(path)
+            file, file.Dispose
+    | None ->
+        fun targetId ->
+            if format = Markdown then
+                printfn ""
+                printfn "# %s" targetId
+            Console.Out, fun () -> ()
+
+let writeResults (format: ResultFormat) (getWriter: string -> TextWriter * (unit -> unit)) (target: Target<string, TypeGraphEdge>) (results: (string * RunResult) array) =
+    task {
+        let start = Trace.now ()
+        let writer, dispose = getWriter target.Id
+        try
+            match format with
+            | Markdown -> do! writeTargetResults target results 0 writer
+            | Ndjson -> do! writeTargetRecords target results writer
+        finally
+            dispose ()
+        Trace.record "write" "write" start [ "target", Encode.string target.Id ]
+    }
+
+/// Start a task for every item and pass the results to finish in the order of
+/// the items. At most twice the number of jobs are started ahead of the item
+/// that is finished next, so only the items in that window are kept in memory.
+let forEachOrdered (start: 'item -> Task<'result>) (finish: 'result -> Task<unit>) (items: seq<'item>) =
+    task {
+        let pending = Queue<Task<'result>>()
+        let finishNext () =
+            task {
+                let! result = pending.Dequeue()
+                do! finish result
+            }
+        for item in items do
+            pending.Enqueue(start item)
+            if pending.Count >= 2 * Jobs.count then
+                do! finishNext ()
+        while pending.Count > 0 do
+            do! finishNext ()
+    }
+
+/// Load, assess and write the targets in the project directories through the
+/// window of forEachOrdered, so a target is only loaded shortly before it is
+/// assessed and released once its results are written. Memory use depends on
+/// the number of jobs instead of the number of targets. Targets that cannot be
+/// loaded are reported to errors.
+let loadRunAndWriteAll (format: ResultFormat) (getWriter: string -> TextWriter * (unit -> unit)) (errors: TextWriter) (graphPath: string) (projectDirs: #seq<string>) (criteria: #seq<Criterion<Query<string, TypeGraphEdge>>>) =
+    projectDirs
+    |> forEachOrdered
+        (fun projectDir ->
+            task {
+                match! loadTarget graphPath projectDir with
+                | Ok target ->
+                    let! results = runAllCriteria criteria target
+                    return Ok (target, results)
+                | Error err ->
+                    return Error err
+            })
+        (function
+            | Ok (target, results) -> writeResults format getWriter target results
+            | Error err -> task { printLoadError errors err })
+
 type UniqueAsyncQueue<'t>() =
     let itemQueue = Queue<'t>()
     let requestQueue = Queue<TaskCompletionSource<'t>>()
@@ -221,7 +559,7 @@ type UniqueAsyncQueue<'t>() =
                 requestQueue.Enqueue tcs
                 tcs.Task
 
-let watchCriteria (time: bool) (run: Criterion<Query<string, TypeGraphEdge>> -> Task<unit>) (criteriaDir: string) =
+let watchCriteria (time: bool) (run: string -> Criterion<Query<string, TypeGraphEdge>> -> Task<unit>) (criteriaDir: string) =
     task {
         use watcher = new FileSystemWatcher(criteriaDir)
         watcher.IncludeSubdirectories <- true
@@ -251,7 +589,7 @@ let watchCriteria (time: bool) (run: Criterion<Query<string, TypeGraphEdge>> ->
                 stopwatch.Restart()
                 match! makeCriterion file with
                 | Ok criterion ->
-                    do! run criterion
+                    do! run file criterion
                 | Error err ->
                     printfn "Error loading criterion: %s" err
                 stopwatch.Stop()
@@ -261,7 +599,52 @@ let watchCriteria (time: bool) (run: Criterion<Query<string, TypeGraphEdge>> ->
                 printfn "Error running criterion: %s" err.Message
     }
 
-let findExtensions (results: (Target<string,TypeGraphEdge> * RunResult) array) =
+/// Keep the criteria loaded and assess targets on request. Requests are read
+/// from stdin, one per line, containing the path to a directory of target
+/// projects and optionally a tab followed by a directory to write the results
+/// to. The request `reload` reloads the criteria. Each response ends with a
+/// line starting with `>>> `, which is either `>>> done` or `>>> error`.
+let serve (graphPath: string) (time: bool) (format: ResultFormat) (defaultOutputDir: string option) (criteriaDir: string) =
+    task {
+        let! initialCriteria = makeCriteria criteriaDir
+        let criteria = ref initialCriteria
+        printfn ">>> ready"
+
+        let stopwatch = Stopwatch()
+        let mutable request = Console.ReadLine()
+        while not (isNull request) do
+            stopwatch.Restart()
+            try
+                match request.Split('\t') |> Array.toList with
+                | [] | [ "" ] ->
+                    ()
+                | [ "reload" ] ->
+                    let! reloaded = makeCriteria criteriaDir
+                    criteria.Value <- reloaded
+                | targetsDir :: outputDir ->
+                    let outputDir = List.tryHead outputDir |> Option.orElse defaultOutputDir
+                    do! loadRunAndWriteAll format (getResultWriter format outputDir) Console.Out graphPath (targetDirs None None targetsDir) criteria.Value
+                stopwatch.Stop()
+                if time
+                then printfn ">>> done in %dms" stopwatch.ElapsedMilliseconds
+                else printfn ">>> done"
+            with err ->
+                printfn ">>> error: %s" (err.Message.ReplaceLineEndings(" "))
+            Console.Out.Flush()
+            request <- Console.ReadLine()
+    }
+
+/// The extensions found for the queries of a criterion, by query id, with the
+/// query graph and the mappings they were found for
+type ExtensionCache =
+    Dictionary<string, MultiGraph<TypeGraphEdge> * (string * Map<int, int>) array * EdgeExtension<TypeGraphEdge> array * NodeExtension<string, TypeGraphEdge> array>
+
+/// Find extensions for the queries of a criterion. Extensions are only found
+/// again for queries that changed or have different mappings since the last
+/// time the cache was used, which in configure is most often only the pattern
+/// that was edited. The extensions of queries that are no longer in the
+/// criterion are removed from the cache.
+let findExtensions (cache: ExtensionCache) (criterion: Criterion<Query<string, TypeGraphEdge>>) (results: (Target<string,TypeGraphEdge> * RunResult) array) =
     let inline selectExtensions (extensions: 't seq when 't : (member Fraction : float)) =
         seq {
             let mutable highCount = 0
@@ -275,23 +658,45 @@ let findExtensions (results: (Target<string,TypeGraphEdge> * RunResult) array) =
                     yield ext
         }
 
-    results
-    |> Seq.collect (fun (target, runResults) ->
-        runResults 
-        |> Seq.collect snd
-        |> Seq.map (fun (query, mapping) -> query, target, mapping)
-    )
-    |> Seq.groupBy (fun (query, _, _) -> query)
-    |> Seq.map (fun (query, mappings) -> 
-        let mappings = Seq.map (fun (_, target, mapping) -> target, mapping) mappings |> Seq.toArray
-        let edgeExtensions = 
-            QueryBuilder.findEdgeExtensions (MultiGraph.toIntGraph query.Graph) mappings
-            |> selectExtensions
-        let nodeExtensions =
-            QueryBuilder.findNodeExtensions query.Graph mappings
-            |> selectExtensions
-        query, edgeExtensions, nodeExtensions)
-    |> Seq.sortBy (fun (query, _, _) -> query.Id)
+    let extensions =
+        results
+        |> Seq.collect (fun (target, runResults) ->
+            runResults 
+            |> Seq.collect (fun (_, result) -> Option.defaultValue [||] result.Mappings)
+            |> Seq.map (fun (query, mapping) -> query, target, mapping)
+        )
+        |> Seq.groupBy (fun (query, _, _) -> query)
+        |> Seq.map (fun (query, mappings) -> 
+            let mappings = Seq.map (fun (_, target, mapping) -> target, mapping) mappings |> Seq.toArray
+            let key = mappings |> Array.map (fun (target, mapping) -> target.Id, mapping)
+            match cache.TryGetValue(query.Id) with
+            | true, (graph, cachedKey, edgeExtensions, nodeExtensions) when graph = query.Graph && cachedKey = key ->
+                query, edgeExtensions, nodeExtensions
+            | _ ->
+                let edgeExtensions = 
+                    QueryBuilder.findEdgeExtensions (MultiGraph.toIntGraph query.Graph) mappings
+                    |> selectExtensions
+                    |> Seq.toArray
+                let nodeExtensions =
+                    QueryBuilder.findNodeExtensions query.Graph mappings
+                    |> selectExtensions
+                    |> Seq.toArray
+                cache.[query.Id] <- (query.Graph, key, edgeExtensions, nodeExtensions)
+                query, edgeExtensions, nodeExtensions)
+        |> Seq.sortBy (fun (query, _, _) -> query.Id)
+        |> Seq.toArray
+
+    // Patterns that were removed, or are now at another place in the tree,
+    // would otherwise be kept for as long as the criterion is watched
+    let queryIds =
+        criterion.Patterns
+        |> Seq.collect PatternTree.patterns
+        |> Seq.map (fun query -> query.Id)
+        |> set
+    for queryId in Seq.toArray cache.Keys do
+        if not (queryIds.Contains queryId) then
+            cache.Remove(queryId) |> ignore
+    extensions
 
 let writeExtensions (extensions: #seq<Query<string, TypeGraphEdge> * #seq<EdgeExtension<TypeGraphEdge>> * #seq<NodeExtension<string, TypeGraphEdge>>>) (indent: int) (writer: TextWriter) =
     task {
@@ -330,33 +735,57 @@ type ConfigureArgs =
 
 type RunArgs =
     | [<Unique; AltCommandLine("-o")>] Output of path: string
+    | [<Unique; AltCommandLine("-f")>] Format of ResultFormat
 
     interface IArgParserTemplate with
         member this.Usage =
             match this with
             | Output _ -> "Output directory for the results"
+            | Format _ -> "Format of the results, defaults to markdown"
+
+type ServeArgs =
+    | [<Unique; AltCommandLine("-o")>] Output of path: string
+    | [<Unique; AltCommandLine("-f")>] Format of ResultFormat
+
+    interface IArgParserTemplate with
+        member this.Usage =
+            match this with
+            | Output _ -> "Output directory for requests that do not specify one"
+            | Format _ -> "Format of the results, defaults to markdown"
 
 type Args =
     | [<CliPrefix(CliPrefix.None)>] Configure of ParseResults<ConfigureArgs>
     | [<CliPrefix(CliPrefix.None)>] Run of ParseResults<RunArgs>
+    | [<CliPrefix(CliPrefix.None)>] Serve of ParseResults<ServeArgs>
     | [<Inherit; Mandatory; Unique; AltCommandLine("-c")>] Criteria of path: string
-    | [<Inherit; Mandatory; Unique; AltCommandLine("-t")>] Targets of path: string
+    | [<Inherit; Unique; AltCommandLine("-t")>] Targets of path: string
     | [<Inherit; Unique>] Graph_Path of path: string
     | [<Inherit; Unique>] Skip of n: int
     | [<Inherit; Unique>] Limit of n: int
     | [<Inherit; Unique>] Time
+    | [<Inherit; Unique>] Trace of path: string
+    | [<Inherit; Unique>] Index_Cache
+    | [<Inherit; Unique; AltCommandLine("-j")>] Jobs of n: int
+    | [<Inherit>] Count_Only of Verdict
+    | [<Inherit; Unique>] Max_Mappings of n: int
 
     interface IArgParserTemplate with
         member this.Usage =
             match this with
             | Configure _ -> "Interactively configure patterns"
             | Run _ -> "Run patterns on targets"
+            | Serve _ -> "Keep the criteria loaded and run them on targets requested through stdin"
             | Criteria _ -> "Path to the directory containing JSON criterion files"
-            | Targets _ -> "Path to the directory containing target projects"
-            | Graph_Path _ -> "Path to the directory within a project containing JSON graph files, defaults to source/graph"
+            | Targets _ -> "Path to the directory containing target projects, required for configure and run"
+            | Graph_Path _ -> "Path to the directory within a project containing the typegraph, defaults to source/graph"
             | Skip _ -> "Skip the first n targets"
             | Limit _ -> "Limit the number of targets to n"
             | Time -> "Time the duration of operations and report the results"
+            | Trace _ -> "Write the duration of the operations per target to a file as Chrome trace events"
+            | Index_Cache -> "Save the indices of every target next to its typegraph and reuse them in later runs"
+            | Jobs _ -> "Number of targets to index and match in parallel, defaults to the number of processors"
+            | Count_Only _ -> "Only count the mappings of a verdict, without listing them (always the case for neutral in run and serve)"
+            | Max_Mappings _ -> "Stop searching a query after finding n mappings, reporting the count as n+"
 
 [<EntryPoint>]
 let main args =
@@ -370,11 +799,25 @@ let main args =
         let skip = args.TryGetResult <@ Skip @>
         let limit = args.TryGetResult <@ Limit @>
 
-        let targetsDir = args.GetResult <@ Targets @>
         let criteriaDir = args.GetResult <@ Criteria @>
 
+        let traceFile = args.TryGetResult <@ Trace @>
+        Trace.enabled <- traceFile.IsSome
+        let writeTrace () = traceFile |> Option.iter Trace.write
+
+        TargetIndex.enabled <- args.Contains <@ Index_Cache @>
+        args.TryGetResult <@ Jobs @> |> Option.iter Jobs.setCount
+        let countOnly =
+            match args.TryGetSubCommand() with
+            | Some (Run _) | Some (Serve _) -> Neutral :: args.GetResults <@ Count_Only @>
+            | _ -> args.GetResults <@ Count_Only @>
+        Limits.search <-
+            { CountOnly = set countOnly
+              MaxMappings = args.TryGetResult <@ Max_Mappings @> }
+
         match args.TryGetSubCommand() with
         | Some (Configure confArgs) ->
+            let targetsDir = args.GetResult <@ Targets @>
             Task.wait <| task {
                 printf "Reading targets... "
                 let! targets = makeTargets graphPath skip limit targetsDir
@@ -391,14 +834,26 @@ let main args =
                     | None ->
                         fun _ -> Console.Out, fun _ -> ()
                 
-                let run criterion =
+                // The search caches of the targets and the extensions found for
+                // every criterion file are kept between changes, so only the
+                // patterns that were edited are searched and analysed again
+                let searchCaches = Dictionary<string, SearchCache<TypeGraphEdge> list>()
+                let extensionCaches = Dictionary<string, ExtensionCache>()
+
+                let run file criterion =
                     task {
                         let outWriter, disposeOutWriter = getOutWriter ()
-                        let! results = runAllTargets targets criterion
+                        if not (searchCaches.ContainsKey file) then
+                            searchCaches.[file] <- targets |> List.map (fun _ -> SearchCache<TypeGraphEdge>())
+                            extensionCaches.[file] <- ExtensionCache()
+                        SearchStats.reset ()
+                        let! results = runAllTargets targets searchCaches.[file] criterion
+                        if args.Contains <@ Time @> then SearchStats.print Console.Out
                         do! writeCriterionResults results 0 outWriter
-                        let extensions = findExtensions results
+                        let extensions = findExtensions extensionCaches.[file] criterion results
                         do! writeExtensions extensions 0 outWriter
                         disposeOutWriter ()
+                        writeTrace ()
                     }
                 
                 printfn "Start watching %s." criteriaDir
@@ -406,52 +861,44 @@ let main args =
             }
             0
         | Some (Run runArgs) ->
+            let targetsDir = args.GetResult <@ Targets @>
+            let format = runArgs.GetResult(<@ RunArgs.Format @>, defaultValue = Markdown)
+            // Keep stdout for the records when writing them there as JSON,
+            // errors loading a target included
+            let status = if format = Ndjson then Console.Error else Console.Out
             Task.wait <| task {
                 let stopwatch = Stopwatch()
 
                 let printDone () =
                     stopwatch.Stop()
                     if args.Contains <@ Time @>
-                    then printfn "Done. Took %dms" stopwatch.ElapsedMilliseconds
-                    else printfn "Done."
+                    then fprintfn status "Done. Took %dms" stopwatch.ElapsedMilliseconds
+                    else fprintfn status "Done."
 
-                printf "Reading targets... "
+                fprintf status "Reading criteria... "
                 stopwatch.Start()
-                let! targets = makeTargets graphPath skip limit targetsDir
-                printDone ()
-
-                printf "Reading criteria... "
-                stopwatch.Restart()
                 let! criteria = makeCriteria criteriaDir
                 printDone ()
 
-                let getWriter: string -> TextWriter * (unit -> unit) =
-                    match runArgs.TryGetResult <@ RunArgs.Output @> with
-                    | Some outputDir ->
-                        if not (Directory.Exists outputDir) then Directory.CreateDirectory outputDir |> ignore
-                        fun targetId ->
-                            let path = Path.Combine(outputDir, $"{Path.GetFileName (Path.TrimEndingDirectorySeparator targetId)}.md")
-                            let file = File.CreateText(path)
-                            file, file.Dispose
-                    | None ->
-                        fun targetId ->
-                            printfn ""
-                            printfn "# %s" targetId
-                            Console.Out, fun () -> ()
-                
+                let getWriter = getResultWriter format (runArgs.TryGetResult <@ RunArgs.Output @>)
+
+                // Targets are loaded while the others are assessed, instead of
+                // all of them up front
+                let projectDirs = targetDirs skip limit targetsDir
                 if args.Contains <@ Time @>
-                then printf "Assessing %d projects on %d criteria... " targets.Length criteria.Length
-                else printf "Asesssing projects... "
+                then fprintf status "Assessing %d projects on %d criteria... " projectDirs.Length criteria.Length
+                else fprintf status "Asesssing projects... "
                 stopwatch.Restart()
-                let! results = runAll targets criteria
-                for targets, results in results do
-                    let writer, dispose = getWriter targets.Id
-                    try
-                        do! writeTargetResults targets results 0 writer
-                    finally
-                        dispose ()
+                do! loadRunAndWriteAll format getWriter status graphPath projectDirs criteria
                 printDone ()
+                if args.Contains <@ Time @> then SearchStats.print status
             }
+            writeTrace ()
+            0
+        | Some (Serve serveArgs) ->
+            let format = serveArgs.GetResult(<@ ServeArgs.Format @>, defaultValue = Markdown)
+            Task.wait <| serve graphPath (args.Contains <@ Time @>) format (serveArgs.TryGetResult <@ ServeArgs.Output @>) criteriaDir
+            writeTrace ()
             0
         | Some _ | None ->
             printfn "%s" (argParser.PrintUsage(message = "Please specify a subcommand"))
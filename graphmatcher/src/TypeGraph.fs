@@ -1,6 +1,13 @@
 namespace TypeGraph
 
 open Graph
+open MultiGraph
+open System
+open System.Buffers.Binary
+open System.Collections.Generic
+open System.Collections.Immutable
+open System.IO
+open System.Text
 open Thoth.Json.Net
 
 type TypeGraphAnnotation =
@@ -67,3 +74,168 @@ module TypeGraph =
         Graph.encode nodeEncoder TypeGraphEdge.encode
     let decode (nodeDecoder: Decoder<'node>) : Decoder<TypeGraph<'node>> = 
         Graph.decode nodeDecoder TypeGraphEdge.decode
+
+/// Compact binary representation of a TypeGraph with string nodes, written by
+/// the extractor to typegraph.bin with --binary. Every string is stored once
+/// and the edges are packed integers, so loading it does not parse or allocate
+/// anything per edge. All integers are little-endian uint32:
+/// - header: the magic bytes "ATGB", the version and the number of strings,
+///   labels and edges
+/// - the offset of every string in the string data, followed by the length of
+///   the string data
+/// - the string data, UTF-8 encoded and padded to a multiple of 4 bytes
+/// - per label a kind and a string index: kind 0 is an edge named by the
+///   string, 1 to 4 are the nameClass, modifier, scheme and location
+///   annotations with the string as their value
+/// - per edge the from node, the label and the to node, with nodes as indices
+///   in the strings
+module TypeGraphBinary =
+    let magic = "ATGB"B
+    let version = 1u
+
+    let private edgeNames =
+        [ "extends", Extends
+          "implements", Implements
+          "invokes", Invokes
+          "overrides", Overrides
+          "accessesField", AccessesField
+          "dependsOn", DependsOn
+          "contains", Contains ]
+
+    let private label (kind: uint32) (value: string) =
+        match kind with
+        | 0u ->
+            match List.tryFind (fun (name, _) -> name = value) edgeNames with
+            | Some (_, edge) -> Ok edge
+            | None -> Error $"Invalid edge type {value}"
+        | 1u -> Ok (Annotated (NameClass value))
+        | 2u -> Ok (Annotated (Modifier value))
+        | 3u -> Ok (Annotated (InProjectDecl value))
+        | 4u -> Ok (Annotated (ExternalDecl value))
+        | _ -> Error $"Invalid label kind {kind}"
+
+    let private kindAndValue = function
+        | Annotated (NameClass nameClass) -> 1u, nameClass
+        | Annotated (Modifier modifier) -> 2u, modifier
+        | Annotated (InProjectDecl scheme) -> 3u, scheme
+        | Annotated (ExternalDecl location) -> 4u, location
+        | edge -> 0u, edgeNames |> List.find (fun (_, e) -> e = edge) |> fst
+
+    let encode (graph: TypeGraph<string>) : byte[] =
+        let strings = Dictionary<string, int>()
+        let stringData = ResizeArray<byte[]>()
+        let intern (s: string) =
+            match strings.TryGetValue s with
+            | true, i -> i
+            | false, _ ->
+                strings[s] <- stringData.Count
+                stringData.Add(Encoding.UTF8.GetBytes s)
+                stringData.Count - 1
+
+        let labels = Dictionary<TypeGraphEdge, int>()
+        let labelData = ResizeArray<uint32 * int>()
+        let edges = ResizeArray<int>()
+        for from, edge, to' in graph do
+            let label =
+                match labels.TryGetValue edge with
+                | true, l -> l
+                | false, _ ->
+                    let kind, value = kindAndValue edge
+                    labels[edge] <- labelData.Count
+                    labelData.Add((kind, intern value))
+                    labelData.Count - 1
+            edges.Add(intern from)
+            edges.Add(label)
+            edges.Add(intern to')
+
+        use stream = new MemoryStream()
+        use writer = new BinaryWriter(stream)
+        writer.Write(magic)
+        writer.Write(version)
+        writer.Write(uint32 stringData.Count)
+        writer.Write(uint32 labelData.Count)
+        writer.Write(uint32 (edges.Count / 3))
+        let mutable offset = 0
+        for bytes in stringData do
+            writer.Write(uint32 offset)
+            offset <- offset + bytes.Length
+        writer.Write(uint32 offset)
+        for bytes in stringData do
+            writer.Write(bytes)
+        writer.Write(Array.zeroCreate<byte> ((4 - offset % 4) % 4))
+        for kind, value in labelData do
+            writer.Write(kind)
+            writer.Write(uint32 value)
+        for i in edges do
+            writer.Write(uint32 i)
+        writer.Flush()
+        stream.ToArray()
+
+    /// Decode a binary TypeGraph directly into the MultiGraph and node array
+    /// that MultiGraph.fromGraph builds from the same graph, without creating
+    /// the set of edges in between
+    let decodeMultiGraph (bytes: byte[]) : Result<MultiGraph<TypeGraphEdge> * ImmutableArray<string>, string> =
+        let readInt (offset: int) =
+            int (BinaryPrimitives.ReadUInt32LittleEndian(ReadOnlySpan(bytes, offset, 4)))
+
+        if bytes.Length < 20 || not (ReadOnlySpan(bytes, 0, 4).SequenceEqual(ReadOnlySpan magic)) then
+            Error "Not a binary TypeGraph"
+        elif readInt 4 <> int version then
+            Error $"Unsupported binary TypeGraph version {readInt 4}"
+        else
+            try
+                let stringCount, labelCount, edgeCount = readInt 8, readInt 12, readInt 16
+                let offsetsStart = 20
+                let dataStart = offsetsStart + 4 * (stringCount + 1)
+                let dataLength = readInt (offsetsStart + 4 * stringCount)
+                let labelsStart = dataStart + (dataLength + 3) / 4 * 4
+                let edgesStart = labelsStart + 8 * labelCount
+                if bytes.Length <> edgesStart + 12 * edgeCount then
+                    Error "Binary TypeGraph has an invalid length"
+                else
+                    let strings =
+                        Array.init stringCount (fun i ->
+                            let start = readInt (offsetsStart + 4 * i)
+                            Encoding.UTF8.GetString(bytes, dataStart + start, readInt (offsetsStart + 4 * (i + 1)) - start)
+                        )
+                    let labels =
+                        Array.init labelCount (fun i ->
+                            label (uint32 (readInt (labelsStart + 8 * i))) strings[readInt (labelsStart + 8 * i + 4)]
+                        )
+                    match labels |> Array.tryPick (function Error err -> Some err | Ok _ -> None) with
+                    | Some err ->
+                        Error err
+                    | None ->
+                        let labels = labels |> Array.map (function Ok label -> label | Error err -> failwith err)
+
+                        // Number the nodes in the sorted order of their names,
+                        // like MultiGraph.fromGraph does
+                        let isNode = Array.zeroCreate<bool> stringCount
+                        for e in 0 .. edgeCount - 1 do
+                            isNode[readInt (edgesStart + 12 * e)] <- true
+                            isNode[readInt (edgesStart + 12 * e + 8)] <- true
+                        let nodes =
+                            Array.init stringCount id
+                            |> Array.filter (fun i -> isNode[i])
+                            |> Array.sortWith (fun a b -> String.CompareOrdinal(strings[a], strings[b]))
+                        let nodeIndex = Array.create stringCount -1
+                        nodes |> Array.iteri (fun node i -> nodeIndex[i] <- node)
+
+                        let mg = MultiGraph.initEmpty nodes.Length
+                        for e in 0 .. edgeCount - 1 do
+                            let from = nodeIndex[readInt (edgesStart + 12 * e)]
+                            let to' = nodeIndex[readInt (edgesStart + 12 * e + 8)]
+                            mg[from, to'] <- Set.add labels[readInt (edgesStart + 12 * e + 4)] mg[from, to']
+                        Ok (mg, nodes |> Seq.map (fun i -> strings[i]) |> ImmutableArray.ToImmutableArray)
+            with
+            | :? IndexOutOfRangeException
+            | :? ArgumentOutOfRangeException ->
+                Error "Binary TypeGraph refers to strings or labels that do not exist"
+
+    /// Number of edges in a binary TypeGraph, read from its header
+    let edgeCount (bytes: byte[]) =
+        int (BinaryPrimitives.ReadUInt32LittleEndian(ReadOnlySpan(bytes, 16, 4)))
+
+    let decode (bytes: byte[]) : Result<TypeGraph<string>, string> =
+        decodeMultiGraph bytes
+        |> Result.map (fun (mg, nodeArray) -> MultiGraph.toGraph nodeArray mg)
@@ -3,6 +3,7 @@ module Test.DirectedSuMGra
 open Expecto
 open FsCheck
 open Swensen.Unquote
+open Thoth.Json.Net
 
 open DirectedSuMGra
 open Graph
@@ -29,6 +30,27 @@ let tests =
                         let extendedQuery = Query.extendWithGraph "testExtension" extension query
                         test <@ List.take (List.length query.Order) extendedQuery.Order = query.Order @>
         ]
+        testList "Target" [
+            testProperty "decode (encode target) finds the same mappings" <| fun (target: Graph<int, int>) (query: Graph<int, int>) ->
+                not (Set.isEmpty target || Set.isEmpty query) ==> lazy
+                    let target = Target.fromGraph "target" target
+                    let query = Query.fromGraph "query" query
+                    let decoded =
+                        Target.encode Encode.int Encode.int target
+                        |> Encode.toString 0
+                        |> Decode.fromString (Target.decode Decode.int Decode.int)
+                    test <@ decoded |> Result.map (fun decoded -> set (SubgraphSearch.search decoded query)) = Ok (set (SubgraphSearch.search target query)) @>
+
+            testCase "decode (encode target) keeps the nodes and indices" <| fun () ->
+                let target = Target.fromGraph "target" (set [ "t0", "class", "t0"; "t0", "contains", "t1"; "t1", "method", "t1" ])
+                let query = Query.fromGraph "query" (set [ "p0", "contains", "p1"; "p1", "method", "p1" ])
+                let decoded =
+                    Target.encode Encode.string Encode.string target
+                    |> Encode.toString 0
+                    |> Decode.fromString (Target.decode Decode.string Decode.string)
+                test <@ decoded |> Result.map (fun decoded -> List.ofSeq decoded.NodeArray) = Ok [ "t0"; "t1" ] @>
+                test <@ decoded |> Result.map (fun decoded -> List.ofSeq (SubgraphSearch.search decoded query)) = Ok [ Map.ofList [ 0, 0; 1, 1 ] ] @>
+        ]
         testList "SubgraphSearch" [
             testCase "Finds expected mappings" <| fun () ->
                 let target = set [
@@ -5,56 +5,56 @@ open Swensen.Unquote
 
 open PatternTree
 
+let private target = set [
+    ("t0", "class", "t0")
+    ("t0", "contains", "t01")
+    ("t01", "method", "t01")
+    ("t0", "contains", "t02")
+    ("t02", "method", "t02")
+    ("t02", "public", "t02")
+    ("t0", "contains", "t0a")
+    ("t0a", "field", "t0a")
+    ("t0a", "public", "t0a")
+    ("t1", "class", "t1")
+    ("t1", "contains", "t11")
+    ("t11", "method", "t11")
+    ("t1", "contains", "t1a")
+    ("t1a", "field", "t1a")
+    ("t1a", "private", "t1a")
+    ("t2", "class", "t2")
+    ("t2", "contains", "t21")
+    ("t21", "public", "t21")
+    ("t21", "method", "t21")
+    ("t2", "contains", "t22")
+    ("t22", "method", "t22")
+    ("t22", "private", "t22")
+]
+
+let private patterns =
+    { Verdict = Positive
+      Pattern = set [ 
+        (0, "class", 0) 
+      ]
+      Children = [
+        { Verdict = Negative
+          Pattern = set [
+            (1, "method", 1)
+            (1, "public", 1)
+            (0, "contains", 1)
+          ]
+          Children = [] }
+        { Verdict = Neutral
+          Pattern = set [
+            (1, "field", 1)
+            (0, "contains", 1)
+          ]
+          Children = [] }
+      ] }
+
 [<Tests>]
 let tests =
     testList "PatternTree" [
         testCase "Small test" <| fun () ->
-            let target = set [
-                ("t0", "class", "t0")
-                ("t0", "contains", "t01")
-                ("t01", "method", "t01")
-                ("t0", "contains", "t02")
-                ("t02", "method", "t02")
-                ("t02", "public", "t02")
-                ("t0", "contains", "t0a")
-                ("t0a", "field", "t0a")
-                ("t0a", "public", "t0a")
-                ("t1", "class", "t1")
-                ("t1", "contains", "t11")
-                ("t11", "method", "t11")
-                ("t1", "contains", "t1a")
-                ("t1a", "field", "t1a")
-                ("t1a", "private", "t1a")
-                ("t2", "class", "t2")
-                ("t2", "contains", "t21")
-                ("t21", "public", "t21")
-                ("t21", "method", "t21")
-                ("t2", "contains", "t22")
-                ("t22", "method", "t22")
-                ("t22", "private", "t22")
-            ]
-
-            let patterns =
-                { Verdict = Positive
-                  Pattern = set [ 
-                    (0, "class", 0) 
-                  ]
-                  Children = [
-                    { Verdict = Negative
-                      Pattern = set [
-                        (1, "method", 1)
-                        (1, "public", 1)
-                        (0, "contains", 1)
-                      ]
-                      Children = [] }
-                    { Verdict = Neutral
-                      Pattern = set [
-                        (1, "field", 1)
-                        (0, "contains", 1)
-                      ]
-                      Children = [] }
-                  ] }
-
             let results = 
                 PatternTree.searchSimple target patterns
                 |> Seq.map (fun (verdict, _, mapping) -> verdict, mapping)
@@ -68,4 +68,64 @@ let tests =
             ]
             
             test <@ results = expected @>
+
+        testCase "Search cache shares identical patterns" <| fun () ->
+            let target = DirectedSuMGra.Target.fromGraph "target" target
+            let rec rename tree =
+                { Verdict = tree.Verdict
+                  Pattern = tree.Pattern |> Set.map (fun (from, edge, to') -> $"n%d{from}", edge, $"n%d{to'}")
+                  Children = tree.Children |> List.map rename }
+            let expected =
+                PatternTree.search target (PatternTree.buildQueries "query" patterns)
+                |> Seq.map (fun (verdict, _, mapping) -> verdict, mapping)
+                |> Set.ofSeq
+
+            let cache = SearchCache()
+            let results tree =
+                PatternTree.searchCached cache target tree
+                |> Seq.map (fun (verdict, _, mapping) -> verdict, mapping)
+                |> Set.ofSeq
+
+            let original = results (PatternTree.buildQueries "query" patterns)
+            test <@ original = expected @>
+            test <@ cache.Hits = 0 @>
+            let renamed = results (PatternTree.buildQueries "renamed" (rename patterns))
+            test <@ renamed = expected @>
+            test <@ cache.Hits > 0 @>
+
+        testCase "Search cache drops removed patterns" <| fun () ->
+            let target = DirectedSuMGra.Target.fromGraph "target" target
+            let cache = SearchCache()
+            let search tree =
+                PatternTree.searchCached cache target (PatternTree.buildQueries "query" tree) |> Seq.length |> ignore
+                cache.Trim()
+
+            search patterns
+            let count = cache.Count
+            let pruned = { patterns with Children = List.take 1 patterns.Children }
+            search pruned
+            test <@ cache.Count < count @>
+            search patterns
+            test <@ cache.Count = count @>
+
+        testCase "Collect with limits" <| fun () ->
+            let target = DirectedSuMGra.Target.fromGraph "target" target
+            let queries = PatternTree.buildQueries "query" patterns
+            let expected =
+                PatternTree.search target queries
+                |> Seq.countBy (fun (verdict, _, _) -> verdict)
+                |> Map.ofSeq
+
+            let collect limits =
+                PatternTree.collect target limits [ queries ]
+                |> Array.map (fun (verdict, result) -> verdict, (result.Count, result.Capped, Option.map Array.length result.Mappings))
+                |> Map.ofArray
+
+            let all = collect SearchLimits.none
+            test <@ all = (expected |> Map.map (fun _ count -> count, false, Some count)) @>
+            let countOnly = collect { SearchLimits.none with CountOnly = set [ Neutral ] }
+            test <@ countOnly.[Neutral] = (2, false, None) @>
+            test <@ countOnly.[Negative] = (2, false, Some 2) @>
+            let capped = collect { SearchLimits.none with MaxMappings = Some 1 }
+            test <@ capped = Map.ofList [ Negative, (1, true, Some 1); Neutral, (1, true, Some 1) ] @>
     ]
@@ -0,0 +1,56 @@
+module Test.TypeGraph
+
+open Expecto
+open Swensen.Unquote
+
+open MultiGraph
+open TypeGraph
+
+/// FsCheck also generates null strings, which do not occur in typegraphs
+let private withoutNulls (graph: TypeGraph<string>) : TypeGraph<string> =
+    graph
+    |> Set.filter (fun (from, edge, to') ->
+        not (isNull from || isNull to')
+        && match edge with
+           | Annotated (NameClass value | Modifier value | InProjectDecl value | ExternalDecl value) -> not (isNull value)
+           | _ -> true
+    )
+
+[<Tests>]
+let tests =
+    testList "TypeGraph" [
+        testList "TypeGraphBinary" [
+            testProperty "decode (encode graph) yields original graph" <| fun (graph: TypeGraph<string>) ->
+                let graph = withoutNulls graph
+                test <@ TypeGraphBinary.decode (TypeGraphBinary.encode graph) = Ok graph @>
+
+            testProperty "decodeMultiGraph numbers nodes like MultiGraph.fromGraph" <| fun (graph: TypeGraph<string>) ->
+                let graph = withoutNulls graph
+                let expectedGraph, expectedNodeArray = MultiGraph.fromGraph graph
+                let result =
+                    TypeGraphBinary.decodeMultiGraph (TypeGraphBinary.encode graph)
+                    |> Result.map (fun (multiGraph, nodeArray) -> Seq.toList nodeArray, MultiGraph.toIntGraph multiGraph)
+                test <@ result = Ok (Seq.toList expectedNodeArray, MultiGraph.toIntGraph expectedGraph) @>
+
+            testCase "Strings are stored once" <| fun () ->
+                let graph = set [
+                    "java+class:///Sketch/Ball", Contains, "java+method:///Sketch/Ball/move()"
+                    "java+class:///Sketch/Ball", Contains, "java+field:///Sketch/Ball/x"
+                    "java+method:///Sketch/Ball/move()", AccessesField, "java+field:///Sketch/Ball/x"
+                    "java+class:///Sketch/Ball", Annotated (InProjectDecl "java+class"), "java+class:///Sketch/Ball"
+                ]
+                let bytes = TypeGraphBinary.encode graph
+                let occurrences (s: string) =
+                    let pattern = System.Text.Encoding.UTF8.GetBytes s
+                    Seq.windowed pattern.Length bytes |> Seq.filter (fun window -> window = pattern) |> Seq.length
+                test <@ occurrences "java+class:///Sketch/Ball" = 1 @>
+                test <@ TypeGraphBinary.edgeCount bytes = 4 @>
+
+            testCase "Rejects other files" <| fun () ->
+                test <@ TypeGraphBinary.decode (System.Text.Encoding.UTF8.GetBytes "[ [ \"a\", \"contains\", \"b\" ] ]") = Error "Not a binary TypeGraph" @>
+
+            testCase "Rejects truncated files" <| fun () ->
+                let bytes = TypeGraphBinary.encode (set [ "a", Contains, "b" ])
+                test <@ Result.isError (TypeGraphBinary.decode bytes[.. bytes.Length - 2]) @>
+        ]
+    ]
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import shutil
+import time
+
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from pipeline.graphmatcher import TARGET_INDEX_FILE
+
+# Files that determine the output of the build and extraction stages. Anything
+# else in a submission (images, sounds, build leftovers) does not influence the
+# result, so it should not invalidate the cache either.
+SOURCE_EXTENSIONS = [ ".pde", ".java", ".jar" ]
+
+# Default location of the cache, following the XDG base directory spec
+def defaultCacheDir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"), "apollopp")
+
+# Feed a file into a hash in chunks, so large .jar files are not read into
+# memory at once
+def hashFile(hash, file: Path):
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hash.update(chunk)
+
+# Hash a set of files by their path relative to root, size and content. The
+# size is included to separate the content of subsequent files.
+def hashFiles(hash, root: Path, files: Iterable[Path]):
+    for file in sorted(files, key = lambda file: file.relative_to(root).as_posix()):
+        hash.update(file.relative_to(root).as_posix().encode("utf-8") + b"\0")
+        hash.update(str(file.stat().st_size).encode("utf-8") + b"\0")
+        hashFile(hash, file)
+
+# Compute a version for the extractor of a language from its Rascal sources and
+# configuration, such that cached typegraphs are invalidated when the extractor
+# changes
+def extractorVersion(extractorDir: Path, lang: str) -> str:
+    hash = hashlib.sha256(lang.encode("utf-8") + b"\0")
+    files = list((extractorDir / "src").rglob("*.rsc")) + [ extractorDir / "pom.xml", extractorDir / "META-INF" / "RASCAL.MF" ]
+    hashFiles(hash, extractorDir, [ file for file in files if file.is_file() ])
+    # The Processing extractor also depends on the libraries that are available
+    if lang == "processing":
+        for var in [ "PROCESSING_CORELIB", "PROCESSING_LIBRARIES" ]:
+            hash.update(os.environ.get(var, "").encode("utf-8") + b"\0")
+    return hash.hexdigest()[:16]
+
+# Compute a version for the build stage of Processing projects. The native
+# preprocessor generates Java that is never compiled, so its output is kept
+# apart from the output of processing-java, and it changes with the
+# preprocessor itself.
+def preprocessorVersion(native: bool, preprocessorFile: Path) -> str:
+    if not native:
+        return "processing-java"
+    hash = hashlib.sha256()
+    hashFile(hash, preprocessorFile)
+    return "native-" + hash.hexdigest()[:16]
+
+# Key of the cache entry of a project with the given source hash (see
+# manifest.scanProject). The build version is only given for Processing
+# projects, where it separates the outputs of the two preprocessors.
+def entryKey(sourceHash: str, buildVersion: str | None = None) -> str:
+    if buildVersion is None:
+        return sourceHash
+    return hashlib.sha256(f"{sourceHash}\0{buildVersion}".encode("utf-8")).hexdigest()
+
+def directorySize(dir: Path) -> int:
+    return sum(file.stat().st_size for file in dir.rglob("*") if file.is_file())
+
+# Persistent cache of build and extraction outputs, keyed by the source hash of
+# a project and, for Processing, the preprocessor (see entryKey). Each entry is a directory containing the processing-java output in
+# build/source and the typegraph (JSON or binary, under its own file name) in
+# typegraph/<extractor version>, together with the indices the graph matcher
+# built from it. The modification time of an entry records its last use, for
+# eviction.
+class ProjectCache:
+    def __init__(self, cacheDir: Path, extractorVersion: str):
+        self.cacheDir = Path(cacheDir)
+        self.extractorVersion = extractorVersion
+        self.cacheDir.mkdir(parents = True, exist_ok = True)
+
+    def entryDir(self, key: str) -> Path:
+        return self.cacheDir / key[:2] / key
+
+    def buildDir(self, key: str) -> Path:
+        return self.entryDir(key) / "build" / "source"
+
+    def typeGraphFile(self, key: str, name: str = "typegraph.json") -> Path:
+        return self.entryDir(key) / "typegraph" / self.extractorVersion / name
+
+    # The indices the graph matcher builds from a typegraph, stored next to it
+    # so they are removed together with typegraphs of older extractor versions
+    def targetIndexFile(self, key: str) -> Path:
+        return self.typeGraphFile(key, TARGET_INDEX_FILE)
+
+    def touch(self, key: str):
+        os.utime(self.entryDir(key))
+
+    # Store a file or directory in the cache by first copying it to a temporary
+    # location and then renaming it, so concurrent runs never see half-written
+    # entries
+    def store(self, src: Path, dest: Path):
+        if dest.exists():
+            return
+        dest.parent.mkdir(parents = True, exist_ok = True)
+        tmp = dest.parent / f".tmp-{os.getpid()}-{dest.name}"
+        if src.is_dir():
+            shutil.copytree(src, tmp)
+        else:
+            shutil.copy2(src, tmp)
+        try:
+            os.rename(tmp, dest)
+        except OSError:
+            # Another run stored the same entry in the meantime
+            if tmp.is_dir(): shutil.rmtree(tmp)
+            else: tmp.unlink()
+
+    def restoreBuild(self, key: str, dest: Path) -> bool:
+        if not self.buildDir(key).is_dir():
+            return False
+        shutil.copytree(self.buildDir(key), dest)
+        self.touch(key)
+        return True
+
+    def storeBuild(self, key: str, buildSource: Path):
+        self.store(buildSource, self.buildDir(key))
+        self.touch(key)
+
+    def restoreTypeGraph(self, key: str, dest: Path) -> bool:
+        if not self.typeGraphFile(key, dest.name).is_file():
+            return False
+        dest.parent.mkdir(parents = True, exist_ok = True)
+        shutil.copy2(self.typeGraphFile(key, dest.name), dest)
+        self.touch(key)
+        return True
+
+    def storeTypeGraph(self, key: str, typeGraph: Path):
+        # Typegraphs from older extractor versions will never be used again
+        versionsDir = self.typeGraphFile(key).parent.parent
+        if versionsDir.is_dir():
+            for version in versionsDir.iterdir():
+                if version.name != self.extractorVersion:
+                    shutil.rmtree(version, ignore_errors = True)
+        self.store(typeGraph, self.typeGraphFile(key, typeGraph.name))
+        self.touch(key)
+
+    def restoreTargetIndex(self, key: str, dest: Path) -> bool:
+        if not self.targetIndexFile(key).is_file():
+            return False
+        shutil.copy2(self.targetIndexFile(key), dest)
+        return True
+
+    # Unlike other entries, the index is replaced when the graph matcher wrote
+    # a new one, which it does when the cached index was built by an older
+    # version of the graph matcher
+    def storeTargetIndex(self, key: str, index: Path):
+        dest = self.targetIndexFile(key)
+        if dest.is_file() and dest.stat().st_mtime == index.stat().st_mtime:
+            return
+        dest.parent.mkdir(parents = True, exist_ok = True)
+        tmp = dest.parent / f".tmp-{os.getpid()}-{dest.name}"
+        shutil.copy2(index, tmp)
+        os.replace(tmp, dest)
+
+    def entries(self) -> List[Tuple[Path, float, int]]:
+        return [
+            (entry, entry.stat().st_mtime, directorySize(entry))
+            for prefix in self.cacheDir.iterdir() if prefix.is_dir()
+            for entry in prefix.iterdir() if entry.is_dir() and not entry.name.startswith(".tmp-")
+        ]
+
+    # Remove entries that have not been used for maxAgeDays, and then the least
+    # recently used entries until the cache is smaller than maxSizeMb
+    def evict(self, maxSizeMb: float, maxAgeDays: float) -> int:
+        removed = 0
+        cutoff = time.time() - maxAgeDays * 24 * 60 * 60
+        entries = sorted(self.entries(), key = lambda entry: entry[1])
+        totalSize = sum(size for _, _, size in entries)
+        for entry, mtime, size in entries:
+            if mtime < cutoff or totalSize > maxSizeMb * 1024 * 1024:
+                shutil.rmtree(entry, ignore_errors = True)
+                totalSize -= size
+                removed += 1
+                if not any(entry.parent.iterdir()):
+                    entry.parent.rmdir()
+        return removed
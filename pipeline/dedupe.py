@@ -0,0 +1,175 @@
+import hashlib
+import json
+import re
+import shutil
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# How projects are compared to find duplicates:
+# - exact: the same source files with the same content, like the submissions
+#   of group members or resubmissions of an unchanged project
+# - normalized: also ignore comments and whitespace in .pde and .java files
+DEDUPE_MODES = [ "exact", "normalized" ]
+
+# Tokens of Java and Processing sources: text blocks, string and character
+# literals are kept intact, comments and whitespace are dropped, and whatever
+# is left is copied as is
+TOKEN = re.compile(r'"""[\s\S]*?"""|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|//[^\n]*|/\*[\s\S]*?\*/|\s+|[^"\'/\s]+|/')
+WORD = re.compile(r"[\w$]")
+OPERATOR = re.compile(r"[-+*/%=<>!&|^~?:]")
+
+# Remove comments and whitespace from a source file. Whitespace is only kept,
+# as a single space, between two words or two operators, where removing it
+# could join two tokens (like `int x` or `a - -b`).
+def normalizeSource(source: str) -> str:
+    parts: List[str] = []
+    space = False
+    for match in TOKEN.finditer(source):
+        token = match.group()
+        if token.isspace() or token.startswith("//") or token.startswith("/*"):
+            space = True
+            continue
+        if space and parts:
+            before, after = parts[-1][-1], token[0]
+            if (WORD.match(before) and WORD.match(after)) or (OPERATOR.match(before) and OPERATOR.match(after)):
+                parts.append(" ")
+        parts.append(token)
+        space = False
+    return "".join(parts)
+
+# Fingerprint a project from its manifest (see manifest.scanProject), such that
+# projects with the same fingerprint get the same typegraph and results. The
+# exact fingerprint is the hash of the manifest, the normalized fingerprint
+# hashes the normalized .pde and .java files instead.
+def fingerprint(projectDir: Path, manifest: dict, mode: str = "exact") -> str:
+    hash = hashlib.sha256(mode.encode("utf-8") + b"\0")
+    # A sketch in the root of a project is named after the project folder,
+    # which ends up in the names of its classes
+    if manifest["pdeRoot"] == ".":
+        hash.update(projectDir.name.encode("utf-8") + b"\0")
+    if mode == "exact":
+        hash.update(manifest["hash"].encode("utf-8"))
+        return hash.hexdigest()
+
+    hash.update(manifest["lang"].encode("utf-8") + b"\0")
+    for source in manifest["sources"]:
+        hash.update(source["path"].encode("utf-8") + b"\0")
+        if source["path"].endswith(".jar"):
+            hash.update(source["sha256"].encode("utf-8") + b"\0")
+        else:
+            with open(projectDir / source["path"], encoding = "utf-8", errors = "surrogateescape") as f:
+                normalized = normalizeSource(f.read())
+            hash.update(normalized.encode("utf-8", errors = "surrogateescape") + b"\0")
+    return hash.hexdigest()
+
+# Group projects with the same fingerprint. Returns the duplicates of every
+# project that has any, by the first project of its group in sorted order,
+# which is the one that is assessed.
+def findDuplicates(projectsDir: Path, manifests: Dict[str, dict], mode: str = "exact") -> Dict[str, List[str]]:
+    groups: Dict[str, List[str]] = {}
+    for proj in sorted(manifests):
+        groups.setdefault(fingerprint(projectsDir / proj, manifests[proj], mode), []).append(proj)
+    return { group[0]: group[1:] for group in groups.values() if len(group) > 1 }
+
+def printReport(duplicates: Dict[str, List[str]], projectCount: int):
+    duplicateCount = sum(len(members) for members in duplicates.values())
+    print(f"Found {duplicateCount} duplicates of {len(duplicates)} projects, assessing {projectCount - duplicateCount} of {projectCount} projects.")
+    for proj, members in duplicates.items():
+        print(f"- {proj}: {', '.join(members)}")
+
+def writeReport(duplicates: Dict[str, List[str]], file: str):
+    with open(file, "w", encoding = "utf-8") as f:
+        json.dump([ [ proj ] + members for proj, members in duplicates.items() ], f, indent = 2)
+
+# Replace the target of an NDJSON record, written compactly like the graph
+# matcher writes its records
+def retargetRecord(line: str, target: str) -> str:
+    if not line.startswith("{"):
+        return line
+    record = json.loads(line)
+    record["target"] = target
+    return json.dumps(record, separators = (",", ":")) + ("\n" if line.endswith("\n") else "")
+
+# Names to report a failure of a project under: the project itself and its
+# duplicates, which share its fate as they are never assessed on their own
+def failedNames(proj: str, duplicates: Dict[str, List[str]] | None) -> List[str]:
+    members = [] if duplicates is None else duplicates.get(proj, [])
+    return [ proj ] + [ f"{member} (duplicate of {proj})" for member in members ]
+
+# Copy the errors of the graph matcher about loading an assessed project, like
+# `Error loading target <target>: <error>`, to its duplicates
+def fanOutErrors(lines: List[str], duplicates: Dict[str, List[str]]) -> List[str]:
+    result: List[str] = []
+    for line in lines:
+        result.append(line)
+        if line.startswith("Error loading target "):
+            for proj, members in duplicates.items():
+                prefix = f"Error loading target {proj}: "
+                if line.startswith(prefix):
+                    result += [ f"Error loading target {member}: {line[len(prefix):]}" for member in members ]
+    return result
+
+# Split the results of the graph matcher on stdout per target: markdown results
+# start with a `# <target>` header, NDJSON records have a target field. Other
+# lines, like errors loading a target, are returned separately.
+def splitResults(output: str, resultFormat: str) -> Tuple[List[str], Dict[str, List[str]]]:
+    other: List[str] = []
+    results: Dict[str, List[str]] = {}
+    current = None
+    for line in output.splitlines(keepends = True):
+        if resultFormat == "ndjson":
+            if line.startswith("{"):
+                results.setdefault(json.loads(line)["target"], []).append(line)
+            else:
+                other.append(line)
+        elif line.startswith("# "):
+            # Every header is preceded by a blank line
+            previous = other if current is None else results[current]
+            if previous and previous[-1] == "\n":
+                previous.pop()
+            current = line[2:].rstrip("\n")
+            results[current] = []
+        elif current is not None and (line == "\n" or line.startswith(" ") or line.startswith("- ")):
+            results[current].append(line)
+        else:
+            current = None
+            other.append(line)
+    return other, results
+
+def targetResults(target: str, lines: List[str], resultFormat: str) -> str:
+    if resultFormat == "ndjson":
+        return "".join(retargetRecord(line, target) for line in lines)
+    return f"\n# {target}\n" + "".join(lines)
+
+# Copy the results of assessed projects in the output of the graph matcher on
+# stdout to their duplicates, as well as errors loading them. The results of
+# all targets are put in sorted order, as the graph matcher writes them, after
+# any other output.
+def fanOutOutput(output: str, resultFormat: str, duplicates: Dict[str, List[str]]) -> str:
+    other, results = splitResults(output, resultFormat)
+    for proj in list(results):
+        for member in duplicates.get(proj, []):
+            results[member] = results[proj]
+    return "".join(fanOutErrors(other, duplicates)) + "".join(targetResults(target, results[target], resultFormat) for target in sorted(results))
+
+# Copy the result file of an assessed project in outputDir to its duplicates
+def fanOutFiles(outputDir: Path, resultFormat: str, proj: str, members: List[str]):
+    extension = "ndjson" if resultFormat == "ndjson" else "md"
+    results = outputDir / f"{proj}.{extension}"
+    if not results.is_file():
+        return
+    for member in members:
+        if resultFormat == "ndjson":
+            with open(results, encoding = "utf-8") as src, open(outputDir / f"{member}.{extension}", "w", encoding = "utf-8") as dest:
+                for line in src:
+                    dest.write(retargetRecord(line, member))
+        else:
+            shutil.copyfile(results, outputDir / f"{member}.{extension}")
+
+# Remove the duplicates from the staged projects, so the later stages only see
+# the project that is assessed for every group
+def removeDuplicates(projectsDir: Path, duplicates: Dict[str, List[str]]):
+    for members in duplicates.values():
+        for member in members:
+            shutil.rmtree(projectsDir / member)
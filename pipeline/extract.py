@@ -0,0 +1,280 @@
+import math
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from pipeline import trace
+
+EXTRACTOR_DIR = Path(__file__).parent.parent / "extractor"
+
+# The most projects passed to a single extractor process, so their names stay
+# well within the limits on the length of a command line
+MAX_CHUNK_SIZE = 500
+
+# Read lines from a stream into a queue on a separate thread, so the reader can
+# wait for the next line with a timeout. None marks the end of the stream.
+def readLines(stream, lines: queue.Queue):
+    for line in stream:
+        lines.put(line.rstrip("\n"))
+    lines.put(None)
+
+# Kill an extractor process together with the processes it started. The rascal
+# command is a wrapper that starts the JVM, which would otherwise keep running.
+def killProcessGroup(proc: subprocess.Popen):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+# A pool of extractor processes that take chunks of projects from a shared
+# queue. Each process stays alive for a whole chunk, so the JVM startup and the
+# loading of the Rascal modules is paid once per chunk rather than once per
+# project, while the chunks still balance the load over the workers. The
+# extractor reports the result of every project as soon as its typegraph is
+# written. When a project fails, takes longer than the timeout or crashes the
+# process, the remaining projects of the chunk are put back in the queue and
+# the failing project is retried on its own.
+#
+# Projects are either extracted all at once using run, or fed to the pool
+# while it is running using start, add, close and join. In the latter case,
+# onResult is called for every project as soon as it is finished, and add
+# blocks while maxPending projects are waiting for a worker.
+#
+# With a tracer, every extractor process is recorded as a span, including its
+# peak RSS, with a span per project from the moment the process started working
+# on it until its result. The span of the first project of a process includes
+# the startup of the JVM.
+#
+# With binary set, the extractor writes typegraph.bin instead of typegraph.json.
+class ExtractorPool:
+    def __init__(self, lang: str, projectsDir: Path, workers: int = 1, chunkSize: int | None = None,
+                 timeout: float = 900, retries: int = 1, maxPending: int | None = None,
+                 onResult: Callable[[str, bool], None] | None = None, tracer: trace.Tracer | None = None,
+                 binary: bool = False):
+        self.module = "Processing" if lang == "processing" else "Java"
+        self.projectsDir = projectsDir
+        self.workers = max(1, workers)
+        self.chunkSize = chunkSize
+        self.timeout = timeout
+        self.retries = retries
+        self.maxPending = maxPending
+        self.onResult = onResult
+        self.tracer = trace.Tracer(enabled = False) if tracer is None else tracer
+        self.binary = binary
+
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.chunks: deque[List[str]] = deque()
+        self.pending: deque[str] = deque()
+        self.closed = False
+        self.cancelled = False
+        self.running = 0
+        self.threads: List[threading.Thread] = []
+        self.attempts: Dict[str, int] = {}
+        self.results: Dict[str, bool] = {}
+        self.logs: Dict[str, List[str]] = {}
+
+    def log(self, proj: str, line: str):
+        with self.lock:
+            self.logs.setdefault(proj, []).append(line)
+
+    # Take the next chunk of projects, waiting for new projects while the pool
+    # is not closed or other workers may still put projects back. Returns None
+    # when there is nothing left to do.
+    def nextChunk(self) -> List[str] | None:
+        with self.changed:
+            while len(self.chunks) == 0 and len(self.pending) == 0 and not (self.closed and self.running == 0):
+                self.changed.wait()
+            if len(self.chunks) > 0:
+                chunk = self.chunks.popleft()
+            elif len(self.pending) > 0:
+                # Without a fixed chunk size, the projects that are waiting
+                # are divided over the workers
+                chunkSize = self.chunkSize or min(MAX_CHUNK_SIZE, math.ceil(len(self.pending) / self.workers))
+                chunk = [ self.pending.popleft() for _ in range(min(chunkSize, len(self.pending))) ]
+            else:
+                return None
+            self.running += 1
+            self.changed.notify_all()
+            return chunk
+
+    def finish(self, proj: str, success: bool):
+        with self.lock:
+            self.results[proj] = success
+        if self.onResult is not None:
+            self.onResult(proj, success)
+
+    # Record a failed attempt for a project and put it back in the queue if it
+    # has retries left
+    def fail(self, proj: str, reason: str):
+        self.log(proj, reason)
+        with self.changed:
+            self.attempts[proj] = self.attempts.get(proj, 0) + 1
+            retry = self.attempts[proj] <= self.retries and not self.cancelled
+            if retry:
+                self.chunks.append([ proj ])
+                self.changed.notify_all()
+        if not retry:
+            self.finish(proj, False)
+
+    # Run a single extractor process on a chunk of projects, returning the
+    # projects that were not reached
+    def runChunk(self, chunk: List[str]) -> List[str]:
+        with self.tracer.span("extractor process", "extractor", projects = len(chunk)) as span:
+            remaining, maxRss = self.runChunkProcess(chunk)
+            span["finished"] = len(chunk) - len(remaining)
+            span["maxRssMB"] = round(maxRss, 1)
+        return remaining
+
+    # Run an extractor process on a chunk of projects, returning the projects
+    # that were not reached and the peak RSS of the process in MB
+    def runChunkProcess(self, chunk: List[str]) -> Tuple[List[str], float]:
+        proc = subprocess.Popen(
+            [ "rascal", self.module ] + ([ "--binary" ] if self.binary else []) + [ "file://" + str(self.projectsDir) ] + chunk,
+            cwd = EXTRACTOR_DIR,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE,
+            text = True,
+            start_new_session = True)
+        lines: queue.Queue = queue.Queue()
+        stderr: List[str] = []
+        threading.Thread(target = readLines, args = (proc.stdout, lines), daemon = True).start()
+        stderrReader = threading.Thread(target = lambda: stderr.extend(proc.stderr), daemon = True)
+        stderrReader.start()
+
+        remaining = list(chunk)
+        deadline = time.monotonic() + self.timeout
+        projectStart = trace.now()
+
+        # The process is waited for with wait4, so the peak RSS is that of the
+        # extractor and the JVM it started, not of all children of run.py
+        usage = None
+        def wait():
+            nonlocal usage
+            if usage is None:
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+
+        def traceProject(success: bool):
+            end = trace.now()
+            self.tracer.add("extract", "extract", projectStart, end, remaining[0], success = success)
+            return end
+
+        try:
+            while len(remaining) > 0:
+                try:
+                    line = lines.get(timeout = max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    killProcessGroup(proc)
+                    traceProject(False)
+                    self.fail(remaining.pop(0), f"Extractor timed out after {self.timeout:.0f}s")
+                    break
+                if line is None:
+                    wait()
+                    stderrReader.join()
+                    traceProject(False)
+                    self.fail(remaining.pop(0), f"Extractor exited with code {proc.returncode}\n" + "".join(stderr))
+                    break
+                elif line.startswith("Done: ") and line[len("Done: "):] == remaining[0]:
+                    projectStart = traceProject(True)
+                    self.finish(remaining.pop(0), True)
+                    deadline = time.monotonic() + self.timeout
+                elif line.startswith("Failed: " + remaining[0] + ": "):
+                    projectStart = traceProject(False)
+                    self.fail(remaining.pop(0), line)
+                    deadline = time.monotonic() + self.timeout
+                else:
+                    self.log(remaining[0], line)
+        finally:
+            # Also when the wrapper exited, the JVM may still be running
+            killProcessGroup(proc)
+            wait()
+        # ru_maxrss is in kilobytes on Linux
+        return remaining, usage.ru_maxrss / 1024
+
+    def worker(self):
+        while (chunk := self.nextChunk()) is not None:
+            remaining = self.runChunk(chunk)
+            with self.changed:
+                if len(remaining) > 0:
+                    self.chunks.appendleft(remaining)
+                self.running -= 1
+                self.changed.notify_all()
+
+    def start(self, workers: int | None = None):
+        self.threads = [ threading.Thread(target = self.worker) for _ in range(self.workers if workers is None else workers) ]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, proj: str):
+        with self.changed:
+            while not self.cancelled and self.maxPending is not None and len(self.pending) >= self.maxPending:
+                self.changed.wait()
+            if self.cancelled:
+                return
+            self.pending.append(proj)
+            self.changed.notify_all()
+
+    # Signal that no more projects will be added, so the workers stop once all
+    # projects are extracted
+    def close(self):
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    # Drop the projects that are not extracted yet and ignore projects that are
+    # added later, so the workers stop after the chunks they are running
+    def cancel(self):
+        with self.changed:
+            self.cancelled = True
+            self.closed = True
+            self.chunks.clear()
+            self.pending.clear()
+            self.changed.notify_all()
+
+    # Wait for the workers to finish, returning a dictionary indicating success
+    # per project and a dictionary with the extractor output per project
+    def join(self) -> Tuple[Dict[str, bool], Dict[str, List[str]]]:
+        for thread in self.threads:
+            thread.join()
+        return self.results, self.logs
+
+    # Extract the typegraphs for the given projects, returning a dictionary
+    # indicating success per project and a dictionary with the extractor
+    # output per project
+    def run(self, projects: List[str]) -> Tuple[Dict[str, bool], Dict[str, List[str]]]:
+        # By default, a single worker gets all projects in one go, like running
+        # the extractor on the whole directory, up to MAX_CHUNK_SIZE projects.
+        # With multiple workers, the projects are split in smaller chunks to
+        # balance the load.
+        chunkSize = self.chunkSize
+        if chunkSize is None:
+            chunkSize = len(projects) if self.workers == 1 else math.ceil(len(projects) / (self.workers * 4))
+            chunkSize = min(MAX_CHUNK_SIZE, chunkSize)
+        chunkSize = max(1, chunkSize)
+        self.chunks.extend(projects[i:i + chunkSize] for i in range(0, len(projects), chunkSize))
+        self.close()
+        self.start(min(self.workers, len(self.chunks)))
+        return self.join()
+
+# Extract typegraphs for the named projects in projectsDir, printing the
+# extractor output per project and returning the list of failed projects
+def extractProjects(lang: str, projectsDir: Path, projects: List[str], workers: int = 1, chunkSize: int | None = None,
+                    timeout: float = 900, retries: int = 1, tracer: trace.Tracer | None = None,
+                    binary: bool = False) -> List[str]:
+    results, logs = ExtractorPool(lang, projectsDir, workers, chunkSize, timeout, retries,
+                                  tracer = tracer, binary = binary).run(projects)
+    failed = []
+    for proj in projects:
+        if not results.get(proj, False):
+            failed.append(proj)
+            print("\n".join(logs.get(proj, [])), file=sys.stderr)
+    return failed
@@ -0,0 +1,140 @@
+import os
+import subprocess
+
+from pathlib import Path
+from typing import List, Tuple
+
+GRAPHMATCHER_DIR = Path(__file__).parent.parent / "graphmatcher"
+PUBLISH_DIR = GRAPHMATCHER_DIR / "publish"
+# Written next to the typegraph by the graph matcher with --index-cache
+TARGET_INDEX_FILE = "targetindex.json"
+
+# Get the command to start the graph matcher. A prebuilt executable is
+# preferred, either set through the APOLLOPP_GRAPHMATCHER environment variable
+# or published to graphmatcher/publish, because `dotnet run` checks whether
+# the project needs to be restored and built again on every start.
+def graphmatcherCommand() -> List[str]:
+    if "APOLLOPP_GRAPHMATCHER" in os.environ:
+        return [ os.environ["APOLLOPP_GRAPHMATCHER"] ]
+    for name in [ "apollopp-graphmatcher", "apollopp-graphmatcher.exe" ]:
+        if (PUBLISH_DIR / name).is_file():
+            return [ str(PUBLISH_DIR / name) ]
+    if (PUBLISH_DIR / "apollopp-graphmatcher.dll").is_file():
+        return [ "dotnet", str(PUBLISH_DIR / "apollopp-graphmatcher.dll") ]
+    return [ "dotnet", "run", "--project", str(GRAPHMATCHER_DIR / "src"), "--" ]
+
+# Run the graph matcher on the targets in targetsDir, split into shards that
+# are each run by a separate process at the same time, selected with --skip
+# and --limit. The graph matcher sorts the targets by name, so the shards
+# together cover every target once and their output, concatenated in order,
+# is the same as that of a single process. Output is written to files in
+# tmpDir, so a shard with a lot of output never waits for another to be read.
+# With traceFile set, every shard writes its trace to its own file. Returns
+# the first nonzero return code, the output on stdout and stderr and the
+# trace files.
+def runSharded(options: List[str], runArgs: List[str], targetsDir: Path, shards: int, tmpDir: Path,
+               traceFile: str | None = None, jobs: int | None = None) -> Tuple[int, str, str, List[str]]:
+    targets = sum(1 for entry in targetsDir.iterdir() if entry.is_dir())
+    shards = max(1, min(shards, targets))
+    size = -(-targets // shards)
+    # With 4 targets in 3 shards of 2 targets, the last shard would be empty
+    shards = max(1, -(-targets // size)) if targets > 0 else 1
+    if jobs is None and shards > 1:
+        # Every process would use all processors otherwise
+        jobs = max(1, (os.cpu_count() or 1) // shards)
+
+    procs = []
+    for i in range(shards):
+        shardTrace = None if traceFile is None else traceFile if shards == 1 else f"{traceFile}.{i}"
+        stdout = open(tmpDir / f"graphmatcher-{i}.out", "w+")
+        stderr = open(tmpDir / f"graphmatcher-{i}.err", "w+")
+        proc = subprocess.Popen(
+            graphmatcherCommand()
+                + options
+                + [ "--targets", str(targetsDir) ]
+                + ([] if shards == 1 else [ "--skip", str(i * size), "--limit", str(size) ])
+                + ([] if jobs is None else [ "--jobs", str(jobs) ])
+                + ([] if shardTrace is None else [ "--trace", shardTrace ])
+                + [ "run" ] + runArgs,
+            stdout = stdout,
+            stderr = stderr,
+            text = True)
+        procs.append((proc, stdout, stderr, shardTrace))
+
+    returncode = 0
+    outputs, errors, traces = [], [], []
+    for proc, stdout, stderr, shardTrace in procs:
+        code = proc.wait()
+        returncode = returncode or code
+        for file, output in [ (stdout, outputs), (stderr, errors) ]:
+            file.seek(0)
+            output.append(file.read())
+            file.close()
+        if shardTrace is not None:
+            traces.append(shardTrace)
+    return returncode, "".join(outputs), "".join(errors), traces
+
+# A graph matcher running in serve mode, which keeps the criteria loaded
+# between assessments. Requests are written to stdin, one per line, and every
+# response ends with a line starting with `>>> `. With traceFile set, the graph
+# matcher writes a trace of all requests to it when it is closed. With
+# indexCache, the indices of every target are saved next to its typegraph and
+# reused when they are still up to date. jobs is the number of targets the
+# graph matcher matches in parallel.
+class GraphmatcherServer:
+    def __init__(self, criteria: str, graphPath: str | None = None, traceFile: str | None = None,
+                 resultFormat: str = "markdown", indexCache: bool = False, jobs: int | None = None):
+        self.proc = subprocess.Popen(
+            graphmatcherCommand()
+                + [ "--criteria", criteria ]
+                + ([] if graphPath is None else [ "--graph-path", graphPath ])
+                + ([] if traceFile is None else [ "--trace", traceFile ])
+                + ([ "--index-cache" ] if indexCache else [])
+                + ([] if jobs is None else [ "--jobs", str(jobs) ])
+                + [ "serve", "--format", resultFormat ],
+            stdin = subprocess.PIPE,
+            stdout = subprocess.PIPE,
+            text = True,
+            bufsize = 1)
+        self.request(None)
+
+    # Send a request and read the output up to the response line. Raises a
+    # RuntimeError if the request failed or the graph matcher stopped.
+    def request(self, request: str | None) -> List[str]:
+        if self.proc.poll() is not None:
+            raise RuntimeError(f"Graph matcher exited with code {self.proc.returncode}")
+        if request is not None:
+            try:
+                self.proc.stdin.write(request + "\n")
+                self.proc.stdin.flush()
+            except BrokenPipeError:
+                raise RuntimeError(f"Graph matcher exited with code {self.proc.wait()}")
+        output = []
+        for line in self.proc.stdout:
+            if line.startswith(">>> error: "):
+                raise RuntimeError(line[len(">>> error: "):].rstrip("\n"))
+            elif line.startswith(">>> "):
+                return output
+            output.append(line)
+        raise RuntimeError(f"Graph matcher exited with code {self.proc.wait()}")
+
+    # Assess all projects in targetsDir, writing the results to a file per
+    # project in outputDir, or returning them if no outputDir is given
+    def assess(self, targetsDir: Path, outputDir: str | None = None) -> List[str]:
+        return self.request(str(targetsDir) if outputDir is None else f"{targetsDir}\t{outputDir}")
+
+    def reload(self):
+        self.request("reload")
+
+    def close(self) -> int:
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        return self.proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from pipeline.cache import SOURCE_EXTENSIONS
+from pre_process import pde_to_java
+
+MANIFEST_FILE = pde_to_java.MANIFEST_FILE
+# The .jar files of a Java project as a plain list of paths, which is all the
+# extractor needs from the manifest (see getProjectClassPath in Java.rsc)
+CLASSPATH_FILE = "classpath.json"
+
+# Walk a directory tree with os.scandir, yielding every folder (relative to
+# root) with the source files directly in it as (name, size) tuples. Folders
+# are visited depth-first in sorted order, with a folder before its subfolders,
+# which is the same order in which findPdeRoot searches for the .pde root.
+def walkSources(root: Path, relDir: str = "") -> Iterator[Tuple[str, List[Tuple[str, int]]]]:
+    with os.scandir(root / relDir) as it:
+        entries = sorted(it, key = lambda entry: entry.name)
+    files = [
+        (entry.name, entry.stat().st_size)
+        for entry in entries
+        if os.path.splitext(entry.name)[1] in SOURCE_EXTENSIONS and entry.is_file()
+    ]
+    yield relDir, files
+    for entry in entries:
+        if entry.is_dir(follow_symlinks = False):
+            yield from walkSources(root, entry.name if relDir == "" else f"{relDir}/{entry.name}")
+
+# Scan a project once, collecting everything the stages of the pipeline need
+# to know about it:
+# - pdeRoot and mainPde: the folder containing the sketch, relative to the
+#   project, and its main .pde file (Processing only, None if not found)
+# - sources: the .pde, .java and .jar files with their size and SHA-256 hash
+# - jars: the .jar files, used as the class path by the Java extractor
+# - hash: the cache key of the project, a hash of the language and the path,
+#   size and content of all source files
+# Every file is read once. With hashes set to False, no files are read at all
+# and the hashes are left out.
+def scanProject(projectDir: Path, lang: str, hashes: bool = True) -> dict:
+    sources = []
+    pdeRoot = None
+    for relDir, files in walkSources(projectDir):
+        sources += [ (name if relDir == "" else f"{relDir}/{name}", size) for name, size in files ]
+        if lang == "processing" and pdeRoot is None and any(name.endswith(".pde") for name, _ in files):
+            pdeRoot = relDir if relDir != "" else "."
+
+    mainPde = None
+    if pdeRoot is not None:
+        sketchName = os.path.basename(os.path.normpath(projectDir / pdeRoot)) + ".pde"
+        if (projectDir / pdeRoot / sketchName).is_file():
+            mainPde = sketchName
+        else:
+            mainPde = pde_to_java.findMainPde(projectDir / pdeRoot)
+
+    manifest = {
+        "lang": lang,
+        "pdeRoot": pdeRoot,
+        "mainPde": mainPde,
+        "sources": [ { "path": file, "size": size } for file, size in sorted(sources) ],
+        "jars": [ file for file, _ in sorted(sources) if file.endswith(".jar") ],
+    }
+
+    if hashes:
+        projectHash = hashlib.sha256(lang.encode("utf-8") + b"\0")
+        for source in manifest["sources"]:
+            projectHash.update(source["path"].encode("utf-8") + b"\0")
+            projectHash.update(str(source["size"]).encode("utf-8") + b"\0")
+            fileHash = hashlib.sha256()
+            with open(projectDir / source["path"], "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    fileHash.update(chunk)
+                    projectHash.update(chunk)
+            source["sha256"] = fileHash.hexdigest()
+        manifest["hash"] = projectHash.hexdigest()
+
+    return manifest
+
+def writeManifest(projectDir: Path, manifest: dict):
+    with open(projectDir / MANIFEST_FILE, "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent = 2)
+    if manifest["lang"] == "java":
+        with open(projectDir / CLASSPATH_FILE, "w") as classPathFile:
+            json.dump(manifest["jars"], classPathFile)
+
+# Scan all projects in projectsDir and write the manifest of each project to
+# manifest.json in the project folder, where the build picks it up, and the
+# class path of Java projects to classpath.json for the extractor. Returns the manifests by project name.
+def scanProjects(projectsDir: Path, lang: str, hashes: bool = True) -> Dict[str, dict]:
+    with os.scandir(projectsDir) as it:
+        projects = sorted(entry.name for entry in it if entry.is_dir())
+    manifests = {}
+    for proj in projects:
+        manifests[proj] = scanProject(projectsDir / proj, lang, hashes)
+        writeManifest(projectsDir / proj, manifests[proj])
+    return manifests
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import sys
+
+from typing import Dict, Iterable, Iterator, List, TextIO
+
+VERDICTS = [ "positive", "negative", "neutral" ]
+
+# Read the records from the NDJSON results of the graph matcher, written with
+# `--format ndjson`. Sources are files, directories of .ndjson files (one per
+# project, as written with --output) or - for stdin. Lines that are not a JSON
+# object, like the status messages of run.py, are skipped. Records are read one
+# line at a time, so only a single record is kept in memory.
+def readRecords(sources: Iterable[str]) -> Iterator[dict]:
+    for source in sources:
+        if source == "-":
+            yield from readLines(sys.stdin)
+        elif os.path.isdir(source):
+            with os.scandir(source) as it:
+                files = sorted(entry.path for entry in it if entry.name.endswith(".ndjson") and entry.is_file())
+            for file in files:
+                with open(file, encoding = "utf-8") as f:
+                    yield from readLines(f)
+        else:
+            with open(source, encoding = "utf-8") as f:
+                yield from readLines(f)
+
+def readLines(lines: TextIO) -> Iterator[dict]:
+    for line in lines:
+        if line.startswith("{"):
+            yield json.loads(line)
+
+# Statistics of a criterion for a single verdict, over all targets
+class VerdictStats:
+    def __init__(self):
+        self.targets = 0
+        self.matched = 0
+        self.mappings = 0
+        self.maxMappings = 0
+        # Targets where the count reached --max-mappings of the graph matcher
+        self.capped = 0
+
+    def add(self, count: int, capped: bool = False):
+        self.targets += 1
+        self.matched += 1 if count > 0 else 0
+        self.mappings += count
+        self.maxMappings = max(self.maxMappings, count)
+        self.capped += 1 if capped else 0
+
+    # Average number of mappings per target, like the averages the graph
+    # matcher prints per criterion in configure mode
+    def average(self) -> float:
+        return self.mappings / self.targets if self.targets > 0 else 0
+
+    def toDict(self) -> dict:
+        return {
+            "targets": self.targets,
+            "matched": self.matched,
+            "mappings": self.mappings,
+            "average": round(self.average(), 3),
+            "max": self.maxMappings,
+            "capped": self.capped,
+        }
+
+# Aggregate records into statistics per criterion and verdict. The memory used
+# depends on the number of criteria, not on the number of targets, since the
+# graph matcher writes a record for every verdict, even without mappings.
+def aggregate(records: Iterable[dict]) -> Dict[str, Dict[str, VerdictStats]]:
+    stats: Dict[str, Dict[str, VerdictStats]] = {}
+    for record in records:
+        criterion = stats.setdefault(record["criterion"], {})
+        criterion.setdefault(record["verdict"], VerdictStats()).add(record["count"], record.get("capped", False))
+    return stats
+
+def printStats(stats: Dict[str, Dict[str, VerdictStats]], file: TextIO = sys.stdout):
+    for criterion, verdicts in stats.items():
+        print(f"- {criterion}", file=file)
+        for verdict in VERDICTS:
+            if verdict in verdicts:
+                s = verdicts[verdict]
+                print(f"  {verdict}: {s.average():.1f} on average, max {s.maxMappings}, "
+                      f"found in {s.matched} of {s.targets} targets"
+                      + (f", capped in {s.capped}" if s.capped > 0 else ""), file=file)
+
+def main(sources: List[str], asJson: bool = False):
+    stats = aggregate(readRecords(sources))
+    if asJson:
+        json.dump({
+            criterion: { verdict: s.toDict() for verdict, s in verdicts.items() }
+            for criterion, verdicts in stats.items()
+        }, sys.stdout, indent = 2)
+        print()
+    else:
+        printStats(stats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Aggregate the NDJSON results of the graph matcher per criterion and verdict")
+
+    parser.add_argument(
+        "results",
+        nargs = "*",
+        default = [ "-" ],
+        help = "Result files, directories containing a .ndjson file per project, or - for stdin (the default)")
+
+    parser.add_argument(
+        "--json",
+        action = "store_true",
+        help = "Print the statistics as JSON")
+
+    args = parser.parse_args()
+    main(args.results, args.json)
@@ -0,0 +1,45 @@
+import os
+import shutil
+
+from pathlib import Path
+
+from pipeline.cache import SOURCE_EXTENSIONS
+
+# Staging modes for copying the target into the working directory of the
+# pipeline:
+# - copy: copy the full target, including assets and build leftovers
+# - sources: copy only the files needed by the pipeline
+# - link: like sources, but hardlink the files instead of copying them
+STAGING_MODES = [ "copy", "sources", "link" ]
+
+# Link a file instead of copying it. Hardlinks are preferred, because they
+# behave exactly like a copy as long as nobody writes to the file, which none
+# of the stages do. Hardlinks cannot cross filesystems (like a tmpfs /tmp), so
+# in that case we fall back to an absolute symlink.
+def linkFile(src: str, dest: str):
+    try:
+        os.link(src, dest)
+    except OSError:
+        os.symlink(os.path.abspath(src), dest)
+
+# Stage only the source files of a project, preserving the directory structure
+def stageSources(src: Path, dest: Path, link: bool):
+    copy = linkFile if link else shutil.copy2
+    dest.mkdir(parents = True, exist_ok = True)
+    for root, dirs, files in os.walk(src):
+        # Skip hidden folders like .git and the __MACOSX folders that zips
+        # created on macOS like to include
+        dirs[:] = [ dir for dir in dirs if not dir.startswith(".") and dir != "__MACOSX" ]
+        files = [ file for file in files if os.path.splitext(file)[1] in SOURCE_EXTENSIONS ]
+        if len(files) > 0:
+            destDir = dest / Path(root).relative_to(src)
+            destDir.mkdir(parents = True, exist_ok = True)
+            for file in files:
+                copy(os.path.join(root, file), destDir / file)
+
+# Stage a target directory in dest using one of the STAGING_MODES
+def stage(target: Path, dest: Path, mode: str):
+    if mode == "copy":
+        shutil.copytree(target, dest)
+    else:
+        stageSources(target, dest, link = mode == "link")
@@ -0,0 +1,162 @@
+import queue
+import sys
+import threading
+
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, TextIO
+
+from pipeline.cache import ProjectCache
+from pipeline.extract import ExtractorPool
+from pipeline.graphmatcher import GraphmatcherServer, TARGET_INDEX_FILE
+from pipeline.trace import Tracer
+from pipeline import dedupe, typegraph
+from pre_process import pde_to_java
+
+# Run the pipeline on the projects in projectsDir, moving every project to the
+# next stage as soon as the previous stage is done with it, instead of waiting
+# for all projects to finish a stage. Projects in extract are built (for
+# Processing) and extracted first, projects in ready already have a typegraph.
+# The stages are connected by queues of at most queueSize projects, so a slow
+# stage holds back the stages before it. The graph matcher runs in serve mode
+# and every project is moved to its own directory in matchDir to assess it on
+# its own, so the results are written per project as soon as they are ready.
+# Results without an output directory are written to resultsFile in
+# resultFormat. With a cache, the graph matcher saves the indices it builds for
+# every project, which are stored in the cache next to the typegraph. The
+# results of a project are copied to its duplicates, which were removed from
+# projectsDir before. Returns the list of projects that failed. With an enabled
+# tracer, every project is traced through the stages, including the graph
+# matcher. Raises a RuntimeError if the graph matcher cannot be started or
+# exits while projects are assessed. On any error, the other stages are
+# stopped before the error is passed on.
+def streamProjects(lang: str, projectsDir: Path, matchDir: Path, criteria: str, output: str | None,
+                   extract: List[str], ready: List[str],
+                   projectCache: ProjectCache | None = None, keys: Dict[str, str] | None = None,
+                   jobs: int = 1, extractWorkers: int = 1, extractChunkSize: int | None = None,
+                   extractTimeout: float = 900, extractRetries: int = 1, queueSize: int = 8,
+                   nativePreprocessor: bool = False, tracer: Tracer | None = None,
+                   resultFormat: str = "markdown", resultsFile: TextIO = sys.stdout,
+                   binaryTypeGraphs: bool = False, matchJobs: int | None = None,
+                   duplicates: Dict[str, List[str]] | None = None) -> List[str]:
+    tracer = Tracer(enabled = False) if tracer is None else tracer
+    failed: List[str] = []
+    matchQueue: queue.Queue = queue.Queue(max(1, queueSize))
+    stopped = threading.Event()
+
+    def extracted(proj: str, success: bool):
+        if success:
+            if projectCache is not None:
+                typeGraphName = typegraph.BINARY_FILE if binaryTypeGraphs else typegraph.JSON_FILE
+                projectCache.storeTypeGraph(keys[proj], projectsDir / proj / "source" / "graph" / typeGraphName)
+            if not stopped.is_set():
+                matchQueue.put(proj)
+        else:
+            print("\n".join(pool.logs.get(proj, [])), file=sys.stderr)
+            for name in dedupe.failedNames(proj, duplicates):
+                print(f"Extracting project {name} failed. Ignoring project.", file=sys.stderr)
+            failed.append(proj)
+
+    pool = ExtractorPool(lang, projectsDir, extractWorkers, extractChunkSize, extractTimeout, extractRetries,
+                         maxPending = max(1, queueSize), onResult = extracted, tracer = tracer,
+                         binary = binaryTypeGraphs)
+
+    def build():
+        try:
+            if lang != "processing":
+                for proj in extract:
+                    pool.add(proj)
+                return
+
+            toBuild = []
+            for proj in extract:
+                if stopped.is_set():
+                    return
+                if projectCache is not None and projectCache.restoreBuild(keys[proj], projectsDir / proj / "source"):
+                    pool.add(proj)
+                else:
+                    toBuild.append(proj)
+
+            for proj, success, log, timing in pde_to_java.buildProjects(projectsDir, jobs, toBuild, ordered = False, native = nativePreprocessor):
+                if stopped.is_set():
+                    break
+                tracer.add("build", "build", timing.pop("start"), timing.pop("end"), proj, tid = 0, success = success, **timing)
+                print(log, file=sys.stderr, end="")
+                if not success:
+                    for name in dedupe.failedNames(proj, duplicates):
+                        print(f"Building Processing project {name} failed. Ignoring project.", file=sys.stderr)
+                    failed.append(proj)
+                    continue
+                (projectsDir / proj / "build" / "source").rename(projectsDir / proj / "source")
+                if projectCache is not None:
+                    projectCache.storeBuild(keys[proj], projectsDir / proj / "source")
+                pool.add(proj)
+        finally:
+            pool.close()
+            pool.join()
+            matchQueue.put(None)
+
+    # The graph matcher is started first, so nothing is left running when it
+    # fails to start
+    traceFile = str(matchDir.parent / "graphmatcher-trace.json") if tracer.enabled else None
+    server = GraphmatcherServer(criteria, traceFile = traceFile, resultFormat = resultFormat,
+                                indexCache = projectCache is not None, jobs = matchJobs)
+
+    pool.start()
+    builder = threading.Thread(target = build)
+    builder.start()
+
+    try:
+        with server:
+            for proj in chain(ready, iter(matchQueue.get, None)):
+                target = matchDir / proj
+                target.mkdir(parents = True)
+                (projectsDir / proj).rename(target / proj)
+                graphDir = target / proj / "source" / "graph"
+                if projectCache is not None:
+                    projectCache.restoreTargetIndex(keys[proj], graphDir / TARGET_INDEX_FILE)
+                try:
+                    with tracer.span("assess", "assess", proj):
+                        results = "".join(server.assess(target, output))
+                        members = [] if duplicates is None else duplicates.get(proj, [])
+                        if output is None and len(members) > 0:
+                            results = dedupe.fanOutOutput(results, resultFormat, { proj: members })
+                        elif len(members) > 0:
+                            dedupe.fanOutFiles(Path(output), resultFormat, proj, members)
+                            results = "".join(dedupe.fanOutErrors(results.splitlines(keepends = True), { proj: members }))
+                        if resultFormat == "ndjson":
+                            # Errors loading a project go to stderr, like the
+                            # graph matcher does in run mode, so resultsFile
+                            # only contains records
+                            lines = results.splitlines(keepends = True)
+                            print("".join(line for line in lines if not line.startswith("{")), end="", file=sys.stderr)
+                            results = "".join(line for line in lines if line.startswith("{"))
+                        print(results, end="", flush=True, file=resultsFile)
+                except RuntimeError as err:
+                    # Without a graph matcher, every remaining project would
+                    # fail in the same way
+                    if server.proc.poll() is not None:
+                        raise
+                    for name in dedupe.failedNames(proj, duplicates):
+                        print(f"Matching project {name} failed: {err}", file=sys.stderr)
+                    failed.append(proj)
+                    continue
+                if projectCache is not None and (graphDir / TARGET_INDEX_FILE).is_file():
+                    projectCache.storeTargetIndex(keys[proj], graphDir / TARGET_INDEX_FILE)
+    finally:
+        # Normally the builder is done here. After an error, the stages before
+        # the graph matcher are stopped and the match queue is drained, so
+        # nothing blocks on it.
+        stopped.set()
+        pool.cancel()
+        while builder.is_alive():
+            try:
+                matchQueue.get(timeout = 0.1)
+            except queue.Empty:
+                pass
+        builder.join()
+
+    if traceFile is not None:
+        tracer.merge(traceFile)
+
+    return failed
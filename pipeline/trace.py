@@ -0,0 +1,127 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+# Categories of the spans per project, in the order of the pipeline. The
+# graph matcher records the load and match spans, run.py the others.
+PROJECT_STAGES = [ "build", "extract", "load", "match" ]
+
+# Time in microseconds since the Unix epoch, which is the clock used for the
+# trace events of both run.py and the graph matcher
+def now() -> int:
+    return time.time_ns() // 1000
+
+# CPU time in seconds of all child processes that have been waited for
+def childCpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+# Record the duration of the stages of the pipeline and of every project in a
+# stage, written to a file as Chrome trace events that can be opened in
+# chrome://tracing or Perfetto. Spans of subprocesses include the CPU time of
+# the child processes that finished during the span. When the
+# tracer is not enabled, nothing is recorded, so it can be passed around
+# unconditionally.
+class Tracer:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.events: List[dict] = [
+            { "name": "process_name", "ph": "M", "pid": self.pid, "args": { "name": "run.py" } }
+        ]
+
+    # Add a span that ran from start to end, both in microseconds from now()
+    def add(self, name: str, cat: str, start: int, end: int, project: str | None = None,
+            pid: int | None = None, tid: int | None = None, **args):
+        if not self.enabled:
+            return
+        if project is not None:
+            args["project"] = project
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start,
+            "dur": end - start,
+            "pid": self.pid if pid is None else pid,
+            "tid": threading.get_native_id() if tid is None else tid,
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    # Record the code in the with block as a span, including the CPU time of
+    # child processes. The yielded dictionary can be used to add arguments to
+    # the span.
+    @contextmanager
+    def span(self, name: str, cat: str, project: str | None = None, **args) -> Iterator[dict]:
+        if not self.enabled:
+            yield args
+            return
+        start = now()
+        cpu = childCpu()
+        try:
+            yield args
+        finally:
+            self.add(name, cat, start, now(), project, childCpu = round(childCpu() - cpu, 3), **args)
+
+    # Add the events of a trace written by the graph matcher. Its spans name
+    # the project as target.
+    def merge(self, traceFile: str):
+        if not self.enabled or not os.path.isfile(traceFile):
+            return
+        with open(traceFile) as f:
+            events = json.load(f)["traceEvents"]
+        for event in events:
+            args = event.get("args", {})
+            if "target" in args:
+                args["project"] = args.pop("target")
+        with self.lock:
+            self.events.extend(events)
+
+    def write(self, traceFile: str):
+        with self.lock:
+            events = sorted(self.events, key = lambda event: event.get("ts", 0))
+        with open(traceFile, "w") as f:
+            json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, f)
+
+    # Total duration in seconds per stage for every project, together with the
+    # node and edge counts of its typegraph if the graph matcher loaded it
+    def projectTotals(self) -> Dict[str, Dict[str, float]]:
+        totals: Dict[str, Dict[str, float]] = {}
+        with self.lock:
+            for event in self.events:
+                args = event.get("args", {})
+                if event.get("ph") != "X" or "project" not in args:
+                    continue
+                project = totals.setdefault(args["project"], {})
+                if event["cat"] in PROJECT_STAGES:
+                    project[event["cat"]] = project.get(event["cat"], 0) + event["dur"] / 1e6
+                for count in [ "nodes", "edges" ]:
+                    if count in args:
+                        project[count] = args[count]
+        return totals
+
+    # Print a table of the count slowest projects, with the time they spent in
+    # every stage
+    def printSummary(self, count: int = 10, file = sys.stderr):
+        totals = self.projectTotals()
+        slowest = sorted(totals.items(), key = lambda item: -sum(item[1].get(stage, 0) for stage in PROJECT_STAGES))
+        if len(slowest) == 0:
+            return
+        width = max(len("project"), *(len(project) for project, _ in slowest[:count]))
+        print(f"\nSlowest {min(count, len(slowest))} of {len(slowest)} projects:", file=file)
+        print(f"{'project':<{width}}" + "".join(f" {stage:>8}" for stage in PROJECT_STAGES + [ "total" ])
+              + f" {'nodes':>8} {'edges':>8}", file=file)
+        for project, stages in slowest[:count]:
+            total = sum(stages.get(stage, 0) for stage in PROJECT_STAGES)
+            print(f"{project:<{width}}" + "".join(f" {stages.get(stage, 0):>7.2f}s" for stage in PROJECT_STAGES)
+                  + f" {total:>7.2f}s"
+                  + "".join(f" {stages[key]:>8}" if key in stages else f" {'-':>8}" for key in [ "nodes", "edges" ]), file=file)
@@ -0,0 +1,171 @@
+import argparse
+import json
+import mmap
+import struct
+import sys
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+JSON_FILE = "typegraph.json"
+BINARY_FILE = "typegraph.bin"
+
+# The binary typegraph format, see TypeGraphBinary in graphmatcher/src/TypeGraph.fs.
+# All integers are little-endian uint32.
+MAGIC = b"ATGB"
+VERSION = 1
+HEADER = struct.Struct("<4s4I")
+EDGE = struct.Struct("<3I")
+
+EDGE_NAMES = [ "extends", "implements", "invokes", "overrides", "accessesField", "dependsOn", "contains" ]
+# Label kinds 1 to 4 are annotations, in the order of their key in the JSON format
+ANNOTATION_KEYS = [ "nameClass", "modifier", "scheme", "location" ]
+
+# Get the kind and string value of an edge label from the JSON format, where an
+# edge is a string or an object {"annotation": {<key>: <value>}}
+def labelKind(edge) -> Tuple[int, str]:
+    if isinstance(edge, str):
+        if edge not in EDGE_NAMES:
+            raise ValueError(f"Invalid edge type {edge}")
+        return 0, edge
+    (key, value), = edge["annotation"].items()
+    return ANNOTATION_KEYS.index(key) + 1, value
+
+def labelJson(kind: int, value: str):
+    return value if kind == 0 else { "annotation": { ANNOTATION_KEYS[kind - 1]: value } }
+
+# Encode a typegraph, given as a list of [from, edge, to] triples like in the
+# JSON format, to the binary format
+def encode(edges: List[list]) -> bytes:
+    strings: Dict[str, int] = {}
+    labels: Dict[Tuple[int, str], int] = {}
+    packed: List[int] = []
+
+    def intern(s: str) -> int:
+        return strings.setdefault(s, len(strings))
+
+    for source, edge, target in edges:
+        kind, value = labelKind(edge)
+        if (kind, value) not in labels:
+            labels[(kind, value)] = len(labels)
+            intern(value)
+        packed += [ intern(source), labels[(kind, value)], intern(target) ]
+
+    data = [ s.encode("utf-8") for s in strings ]
+    offsets = [ 0 ]
+    for encoded in data:
+        offsets.append(offsets[-1] + len(encoded))
+    stringData = b"".join(data)
+    stringData += b"\0" * (-len(stringData) % 4)
+    labelData = [ n for (kind, value) in labels for n in (kind, strings[value]) ]
+
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, len(strings), len(labels), len(packed) // 3),
+        struct.pack(f"<{len(offsets)}I", *offsets),
+        stringData,
+        struct.pack(f"<{len(labelData)}I", *labelData),
+        struct.pack(f"<{len(packed)}I", *packed),
+    ])
+
+# Read-only view of a binary typegraph in a memory-mapped file. Strings are
+# only decoded when they are accessed and the edges are read straight from the
+# mapped file, so even large typegraphs can be analysed without loading them.
+class BinaryTypeGraph:
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            raise ValueError(f"{path} is not a binary typegraph")
+        magic, version, self.stringCount, self.labelCount, self.edgeCount = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary typegraph")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported version {version}")
+
+        self.offsetsStart = HEADER.size
+        self.dataStart = self.offsetsStart + 4 * (self.stringCount + 1)
+        dataLength, = struct.unpack_from("<I", self.mmap, self.offsetsStart + 4 * self.stringCount)
+        self.labelsStart = self.dataStart + dataLength + (-dataLength % 4)
+        self.edgesStart = self.labelsStart + 8 * self.labelCount
+        if len(self.mmap) != self.edgesStart + 12 * self.edgeCount:
+            raise ValueError(f"{path} has an invalid length")
+
+    def string(self, i: int) -> str:
+        start, end = struct.unpack_from("<2I", self.mmap, self.offsetsStart + 4 * i)
+        return self.mmap[self.dataStart + start:self.dataStart + end].decode("utf-8")
+
+    # The kind and value of a label, see labelKind
+    def label(self, i: int) -> Tuple[int, str]:
+        kind, value = struct.unpack_from("<2I", self.mmap, self.labelsStart + 8 * i)
+        return kind, self.string(value)
+
+    # Iterate over the edges as (from, label, to) indices, where the nodes are
+    # indices of strings
+    def edgeIndices(self) -> Iterator[Tuple[int, int, int]]:
+        for offset in range(self.edgesStart, len(self.mmap), 12):
+            yield EDGE.unpack_from(self.mmap, offset)
+
+    # Iterate over the edges like in the JSON format
+    def edges(self) -> Iterator[list]:
+        labels = [ labelJson(*self.label(i)) for i in range(self.labelCount) ]
+        for source, label, target in self.edgeIndices():
+            yield [ self.string(source), labels[label], self.string(target) ]
+
+    def nodeCount(self) -> int:
+        nodes = set()
+        for source, _, target in self.edgeIndices():
+            nodes.add(source)
+            nodes.add(target)
+        return len(nodes)
+
+    def close(self):
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Read the edges of a typegraph in either format
+def readEdges(path: Path) -> List[list]:
+    with open(path, "rb") as f:
+        isBinary = f.read(len(MAGIC)) == MAGIC
+    if isBinary:
+        with BinaryTypeGraph(path) as graph:
+            return list(graph.edges())
+    with open(path, encoding = "utf-8") as f:
+        return json.load(f)
+
+# Convert a typegraph between the JSON and the binary format, depending on the
+# extension of dest
+def convert(src: Path, dest: Path):
+    edges = readEdges(src)
+    if dest.suffix == ".bin":
+        dest.write_bytes(encode(edges))
+    else:
+        with open(dest, "w", encoding = "utf-8") as f:
+            json.dump(edges, f)
+
+def main(command: str, paths: List[str]) -> int:
+    if command == "convert":
+        if len(paths) != 2:
+            print("convert expects a source and a destination", file=sys.stderr)
+            return 1
+        convert(Path(paths[0]), Path(paths[1]))
+    elif command == "stats":
+        for path in paths:
+            edges = readEdges(Path(path))
+            nodes = { node for source, _, target in edges for node in (source, target) }
+            print(f"{path}: {len(nodes)} nodes, {len(edges)} edges")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Convert typegraphs between the JSON and the binary format")
+    parser.add_argument(
+        "command",
+        choices = [ "convert", "stats" ],
+        help = "convert SRC DEST converts to the format of the extension of DEST (.bin or .json), stats prints the size of typegraphs")
+    parser.add_argument("paths", nargs = "+", help = "Typegraph files")
+    args = parser.parse_args()
+    sys.exit(main(args.command, args.paths))
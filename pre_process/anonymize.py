@@ -1,24 +1,60 @@
 import argparse
 import base64
 import csv
+import io
 import json
+import math
 import random
 import re
+import shutil
+import struct
 import sys
+import time
 import unicodedata
 import uuid
 import zipfile
 
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from itertools import chain, repeat
 from openpyxl import Workbook, load_workbook
+from openpyxl.worksheet.worksheet import Worksheet
 from os import path, remove
-from typing import Callable, Dict, Iterable, List, Mapping, Tuple, TypeVar, Union
+from tempfile import SpooledTemporaryFile, TemporaryDirectory
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
 from zipfile import ZipFile
 
 T = TypeVar("T")
 Key = TypeVar("Key")
 Value = TypeVar("Value")
 
-Replacements = Mapping[re.Pattern, Union[str, Callable[[re.Match[str]], str]]]
+# Nested zip files and processed text files are kept in memory up to this size
+# and moved to a temporary file when they grow larger
+SPOOL_SIZE = 64 * 1024 * 1024
+# Number of characters or bytes to read at once from a file
+CHUNK_SIZE = 1024 * 1024
+
+EMAIL_REGEX = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
+# Emails up to this length are always replaced when processing text in chunks
+EMAIL_OVERLAP = 1024
+
+# Records of a zip file, as described in the .ZIP File Format Specification
+# (APPNOTE.TXT), used to merge zip files without compressing their entries
+# again. Sizes, offsets and counts beyond the limits, which are the same as in
+# zipfile, are moved to ZIP64 records.
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+ZIP64_END_RECORD = struct.Struct("<4sQ2H2L4Q")
+ZIP64_END_LOCATOR = struct.Struct("<4sLQL")
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+ZIP64_VERSION = 45
+# Flag for entries with a data descriptor after the data, which is not needed
+# when the sizes and CRC are written in the header
+DATA_DESCRIPTOR_FLAG = 0x08
+UTF8_FLAG = 0x800
 
 # Generate a random string to replace names
 def generateRandomName() -> str:
@@ -42,25 +78,113 @@ def removeAccents(input_str: str) -> str:
     nfkd_form = unicodedata.normalize('NFKD', input_str)
     return u"".join([c for c in nfkd_form if not unicodedata.combining(c)])
 
-# Make a shuffled copy of a list
-def shuffled(l: List[T]) -> List[T]:
+# Make a shuffled copy of a list, optionally using a specific random generator
+def shuffled(l: List[T], rand: Optional[random.Random] = None) -> List[T]:
     lcopy = l.copy()
-    random.shuffle(lcopy)
+    (random if rand is None else rand).shuffle(lcopy)
     return lcopy
 
-# Replace all occurences of keys with their corresponding values
+# Key used to merge characters in the trie that are equal when ignoring case
+def caseKey(c: str) -> str:
+    return c.lower() if len(c.lower()) == 1 else c
+
+# Create a regex that matches any of the literals, structured as a trie so the
+# regex engine never has to try more than one alternative per character. At
+# every position, the longest literal that matches is preferred.
+def trieRegex(literals: Iterable[str]) -> str:
+    trie: dict = {}
+    for literal in literals:
+        node = trie
+        for c in literal:
+            node = node.setdefault(caseKey(c), {})
+        node[""] = {}
+
+    def toRegex(node: dict) -> str:
+        branches = [ re.escape(c) + toRegex(child) for c, child in sorted(node.items()) if c != "" ]
+        if len(branches) == 0:
+            return ""
+        regex = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + regex + ")?" if "" in node else regex
+
+    return toRegex(trie)
+
+# All names and identifiers to replace, combined in a single case-insensitive
+# regex so every text is scanned only once, no matter how many students there
+# are. Aliases are keyed by the literal to replace and whether it is bounded:
+# bounded literals only match if there is no letter directly before or after
+# them. If literals overlap, the match that starts first wins. At the same
+# position, literals that match anywhere are tried before bounded ones, so a
+# shorter literal that matches anywhere wins over a longer bounded one, and
+# otherwise the longest literal wins. If several literals only differ in case,
+# the first one wins.
+class Replacements:
+    def __init__(self, aliases: Dict[Tuple[str, bool], str]):
+        self.aliases = { key: alias for key, alias in aliases.items() if key[0] != "" }
+        self.maxLength = max((len(literal) for literal, _ in self.aliases), default = 0)
+        self.lookup: Dict[Tuple[str, bool], str] = {}
+        for (literal, bounded), alias in self.aliases.items():
+            self.lookup.setdefault((literal.lower(), bounded), alias)
+
+        alternatives = []
+        if any(not bounded for _, bounded in self.aliases):
+            alternatives.append("(?P<anywhere>" + trieRegex(literal for literal, bounded in self.aliases if not bounded) + ")")
+        if any(bounded for _, bounded in self.aliases):
+            alternatives.append("(?<![a-zA-Z])(?P<bounded>" + trieRegex(literal for literal, bounded in self.aliases if bounded) + ")(?![a-zA-Z])")
+        self.pattern = re.compile("|".join(alternatives) if len(alternatives) > 0 else "(?!)", re.IGNORECASE)
+
+    def replaceMatch(self, match: re.Match[str]) -> str:
+        bounded = match.lastgroup == "bounded"
+        text = match.group(0)
+        alias = self.lookup.get((text.lower(), bounded))
+        if alias is None:
+            # Case-insensitive matching does not always agree with lower() for
+            # special characters, so find the first literal that matches
+            for (literal, b), a in self.aliases.items():
+                if b == bounded and re.fullmatch(re.escape(literal), text, re.IGNORECASE):
+                    return a
+            return text
+        return alias
+
+# Replace all occurences of names and identifiers with their aliases
 def replaceAll(s: str, replacements: Replacements) -> str:
-    for pidPattern, replacement in replacements.items():
-        s = pidPattern.sub(replacement, s)
-    return s
+    return replacements.pattern.sub(replacements.replaceMatch, s)
 
 # Replace every occurence of an email with a new random email from the dictionary
 def replaceEmails(s: str) -> str:
-    return re.sub(
-        r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+", 
-        lambda _: generateRandomEmail(),
-        s
-    )
+    return EMAIL_REGEX.sub(lambda _: generateRandomEmail(), s)
+
+# Substitute all matches of a pattern in text that is read in chunks. A match is
+# only replaced once at least overlap characters follow its start, or the end
+# of the text is reached, so matches of up to overlap characters are found
+# exactly like in the full text. The character before the unprocessed text is
+# kept for lookbehinds.
+def subChunks(pattern: re.Pattern, replace: Callable[[re.Match[str]], str], chunks: Iterable[str], overlap: int) -> Iterator[str]:
+    buffer = ""
+    pos = 0
+    for chunk in chain(chunks, [ None ]):
+        if chunk is not None:
+            buffer = buffer[max(0, pos - 1):] + chunk
+            pos = min(pos, 1)
+        end = len(buffer) if chunk is None else len(buffer) - overlap
+        output = []
+        for match in pattern.finditer(buffer, pos):
+            if match.start() >= end:
+                break
+            output.append(buffer[pos:match.start()])
+            output.append(replace(match))
+            pos = match.end()
+        if pos < end:
+            output.append(buffer[pos:end])
+            pos = end
+        yield "".join(output)
+
+# Replace names, student numbers and emails in a UTF-8 encoded file, reading it
+# in chunks so large files are never fully in memory
+def replaceInFile(file: IO[bytes], replacements: Replacements) -> Iterator[str]:
+    text = io.TextIOWrapper(file, encoding = "utf-8", newline = "")
+    chunks = iter(lambda: text.read(CHUNK_SIZE), "")
+    chunks = subChunks(replacements.pattern, replacements.replaceMatch, chunks, replacements.maxLength + 1)
+    return subChunks(EMAIL_REGEX, lambda _: generateRandomEmail(), chunks, EMAIL_OVERLAP)
 
 # Replace strings nested in objects and lists, like when dealing with data from
 # a JSON structure
@@ -74,22 +198,14 @@ def replaceInObject(value: T, replacements: Replacements) -> T:
     else:
         return value
 
-# Helper to compile a case-insensitive regex
-def regexi(s: str) -> re.Pattern:
-    return re.compile(s, re.IGNORECASE)
-
-# Helper to compile a case-insensitive regex that matches the exact string
-def regexesci(s: str) -> re.Pattern:
-    return regexi(re.escape(s))
-
-# Create a map from patterns matching a name or identifier to a random alias
+# Create the replacements for names and identifiers with random aliases
 def generatePiiReplacements(students: Iterable[Tuple[str, str]]) -> Replacements:
     # Names to skip, because they are also rather important words in code
     skipNames = [ "max", "floor" ]
-    map: Replacements = {}
+    aliases: Dict[Tuple[str, bool], str] = {}
     for name, id in students:
         # Generate a random id to replace student numbers
-        map[regexesci(id)] = generateRandomId()
+        aliases[(id, False)] = generateRandomId()
 
         # First, we add the first and last name as delimited in the CSV, both in
         # normal version and in a version without accents. If the name is longer
@@ -99,14 +215,9 @@ def generatePiiReplacements(students: Iterable[Tuple[str, str]]) -> Replacements
         for n in name.split(","):
             n = n.strip()
             if not n.lower() in skipNames:
-                if len(n) > 4:
-                    map[regexesci(n)] = generateRandomName()
-                    map[regexesci(removeAccents(n))] = map[regexesci(n)]
-                else:
-                    map[regexi(r"(^|[^a-zA-Z])" + re.escape(n) + r"([^a-zA-Z]|$)")] = \
-                        lambda match: (match.group(1) + map[regexesci(n)] + match.group(2))
-                    map[regexi(r"(^|[^a-zA-Z])" + re.escape(removeAccents(n)) + r"([^a-zA-Z]|$)")] = \
-                        lambda match: (match.group(1) + map[regexesci(n)] + match.group(2))
+                bounded = len(n) <= 4
+                aliases[(n, bounded)] = generateRandomName()
+                aliases[(removeAccents(n), bounded)] = aliases[(n, bounded)]
 
         # Then we split the name by spaces, because people may not use their
         # full name. Parts with length 4 or shorter are filtered out to avoid
@@ -115,10 +226,10 @@ def generatePiiReplacements(students: Iterable[Tuple[str, str]]) -> Replacements
         # characters, it is covered in the previous step.
         for namePart in [ namePart.strip() for n in name.split(",") for namePart in n.split(" ") ]:
             if len(namePart) > 4 and namePart.lower() not in skipNames:
-                map[regexesci(namePart)] = generateRandomName()
-                map[regexesci(removeAccents(namePart))] = map[regexesci(namePart)]
+                aliases[(namePart, False)] = generateRandomName()
+                aliases[(removeAccents(namePart), False)] = aliases[(namePart, False)]
 
-    return map
+    return Replacements(aliases)
 
 # Read the students form the gradebook CSV export, returning a dictionary with
 # the Canvas user id as key and a tuple with their name and student number as
@@ -188,10 +299,32 @@ def readCanvasRubricsJson(canvasRubricsJsonPath: str) -> Tuple[dict, List[dict]]
     assessments: List[dict] = assignment["submissionsConnection"]["nodes"]
     return assignment, assessments
 
+# Open a zip file nested in another zip file. ZipFile needs to seek in the
+# nested file, which for a compressed entry means decompressing it again from
+# the start, so the nested file is copied to a buffer first.
+@contextmanager
+def openNestedZip(src: ZipFile, info: zipfile.ZipInfo) -> Iterator[ZipFile]:
+    with SpooledTemporaryFile(max_size = SPOOL_SIZE) as buffer:
+        with src.open(info, mode = "r") as file:
+            shutil.copyfileobj(file, buffer, CHUNK_SIZE)
+        buffer.seek(0)
+        with ZipFile(buffer, mode = "r") as zipFile:
+            yield zipFile
+
+# Write the contents of a file object to a new entry in a zip file, with the
+# current time and the compression of the zip file, like ZipFile.writestr
+def writeEntry(dest: ZipFile, name: str, file: IO[bytes], size: int):
+    info = zipfile.ZipInfo(name, date_time = time.localtime()[:6])
+    info.compress_type = dest.compression
+    info.external_attr = 0o600 << 16
+    with dest.open(info, mode = "w", force_zip64 = size > zipfile.ZIP64_LIMIT) as entry:
+        shutil.copyfileobj(file, entry, CHUNK_SIZE)
+
 # Copy code files from the source zip file to the destination zip file,
 # including .jars and traversing nested .zip files. Replacements are applied in
-# code files en filenames
-def copyZipContent(src: ZipFile, dest: ZipFile, basePath: str, replacements: Replacements, verbose: bool = False):
+# code files en filenames. Code files and .jars larger than maxFileSize MB and
+# nested .zip files larger than maxZipSize MB are skipped.
+def copyZipContent(src: ZipFile, dest: ZipFile, basePath: str, replacements: Replacements, verbose: bool = False, maxFileSize: Optional[float] = None, maxZipSize: Optional[float] = None):
     # Get all files from the zip, skipping those in a __MACOSX folder (who
     # thought that thing was a good idea?)
     infolist = [ info for info in src.infolist() if "__MACOSX" not in info.filename ]
@@ -200,15 +333,24 @@ def copyZipContent(src: ZipFile, dest: ZipFile, basePath: str, replacements: Rep
         newFilename = replaceAll(info.filename, replacements)
 
         try:
+            # Skip files that are too large up front, based on the size in the
+            # central directory of the zip file
+            if ext in [ ".pde", ".java", ".xml", ".jar" ] and maxFileSize is not None and info.file_size > maxFileSize * 1024 * 1024:
+                print(f"  Skipping {ext} file larger than {maxFileSize} MB...")
+            elif ext == ".zip" and maxZipSize is not None and info.file_size > maxZipSize * 1024 * 1024:
+                print(f"  Skipping .zip file larger than {maxZipSize} MB...")
+
             # Copy files with .pde, .java and .xml (for Maven projects)
-            # extensions, replacing names, student numbers and emails
-            if ext in [ ".pde", ".java", ".xml" ]:
+            # extensions, replacing names, student numbers and emails. The
+            # result is buffered, so nothing is written if decoding fails.
+            elif ext in [ ".pde", ".java", ".xml" ]:
                 if verbose: print(f"Copying {info.filename} to {path.join(basePath, newFilename)}")
-                with src.open(info, mode = "r") as file:
-                    fileText = file.read().decode("utf-8")
-                fileText = replaceAll(fileText, replacements)
-                fileText = replaceEmails(fileText)
-                dest.writestr(path.join(basePath, newFilename), fileText.encode("utf-8"))
+                with src.open(info, mode = "r") as file, SpooledTemporaryFile(max_size = SPOOL_SIZE) as buffer:
+                    for chunk in replaceInFile(file, replacements):
+                        buffer.write(chunk.encode("utf-8"))
+                    size = buffer.tell()
+                    buffer.seek(0)
+                    writeEntry(dest, path.join(basePath, newFilename), buffer, size)
 
             # Copy .jar files without replacements, because these are binary files.
             # Useful for code analysis if these are external denpendencies used in
@@ -216,18 +358,17 @@ def copyZipContent(src: ZipFile, dest: ZipFile, basePath: str, replacements: Rep
             elif ext in [ ".jar" ]:
                 if verbose: print(f"Copying {info.filename} to {path.join(basePath, newFilename)}")
                 with src.open(info, mode = "r") as file:
-                    dest.writestr(path.join(basePath, newFilename), file.read())
+                    writeEntry(dest, path.join(basePath, newFilename), file, info.file_size)
 
             # Recursively copy from nested zip files, because this apparently
             # happens...
             elif ext == ".zip":
                 if verbose: print(f"Found .zip file {info.filename}, starting recursive copy")
                 subPath = path.splitext(newFilename)[0]
-                with src.open(info, mode = "r") as file:
-                    with ZipFile(file, mode = "r") as zipFile:
-                        copyZipContent(zipFile, dest, path.join(basePath, subPath), replacements, verbose = verbose)
+                with openNestedZip(src, info) as zipFile:
+                    copyZipContent(zipFile, dest, path.join(basePath, subPath), replacements, verbose, maxFileSize, maxZipSize)
                 if verbose: print(f"Finished recursive copy of {info.filename}")
-    
+
         except UnicodeDecodeError as err:
             print(f"  Failed to decode {ext} file, skipping...")
             if verbose: print(err)
@@ -235,45 +376,163 @@ def copyZipContent(src: ZipFile, dest: ZipFile, basePath: str, replacements: Rep
             print(f"  Failed to copy {ext} file, skipping...")
             if verbose: print(err)
 
-# Copy every attachment from the Canvas export (submissions.zip) to the output zip file
-def copySubmissions(attachmentsZip: ZipFile, outputZip: ZipFile, copyAssessment: Callable[[str, str, str, ZipFile, str], None], replacements: Replacements, verbose: bool = False):
-    # Count the submissions to give a progress indicator
-    attachmentCount = len(attachmentsZip.infolist())
+# Find the user id and attachment id from the filename of a submission
+def parseAttachmentFilename(filename: str) -> Tuple[str, str]:
+    filenameParts = filename.split("_")
+    if filenameParts[1] == "LATE":
+        return filenameParts[2], filenameParts[3]
+    else:
+        return filenameParts[1], filenameParts[2]
 
-    # Loop over all submissions in randomized order
-    for i, attachmentInfo in enumerate(shuffled(attachmentsZip.infolist())):
-        print(f"Copying submission {i}/{attachmentCount}" + (f": {attachmentInfo.filename}" if verbose else ""))
+# Copy the files of a single submission to the output zip file
+def copySubmission(attachmentsZip: ZipFile, attachmentInfo: zipfile.ZipInfo, outputZip: ZipFile, basePath: str, replacements: Replacements, verbose: bool = False, maxFileSize: Optional[float] = None, maxZipSize: Optional[float] = None):
+    try:
+        # Open the inner zip file containing the submitted files
+        with openNestedZip(attachmentsZip, attachmentInfo) as attachmentZip:
+            copyZipContent(attachmentZip, outputZip, basePath, replacements, verbose, maxFileSize, maxZipSize)
+    except Exception as err:
+        print("  Failed to copy submission, skipping...")
+        if verbose: print(err)
 
-        newId = str(i).zfill(3)
-        basePath = "submissions/" + newId + "/"
+# Copy a shard of the submissions to a separate zip file in a worker process,
+# returning everything that was printed
+def copySubmissionsShard(attachmentsZipPath: str, shardZipPath: str, submissions: List[Tuple[int, str, str]], attachmentCount: int, replacements: Replacements, verbose: bool = False, maxFileSize: Optional[float] = None, maxZipSize: Optional[float] = None) -> str:
+    log = io.StringIO()
+    with redirect_stdout(log):
+        with ZipFile(attachmentsZipPath, mode = "r") as attachmentsZip, \
+             ZipFile(shardZipPath, mode = "x", compression = zipfile.ZIP_DEFLATED) as shardZip:
+            for i, filename, newId in submissions:
+                print(f"Copying submission {i}/{attachmentCount}" + (f": {filename}" if verbose else ""))
+                copySubmission(attachmentsZip, attachmentsZip.getinfo(filename), shardZip, "submissions/" + newId + "/", replacements, verbose, maxFileSize, maxZipSize)
+    return log.getvalue()
+
+# Date and time of a zip entry in MS-DOS format
+def dosDateTime(dateTime: Tuple[int, int, int, int, int, int]) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = dateTime
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+# Merge the entries of zip files into a new zip file, in order, copying their
+# compressed data as it is instead of decompressing and compressing it again.
+# zipfile has no public API for this, so the headers and the central directory
+# are written here, from the entries zipfile reads from the source files.
+def mergeZips(destPath: str, srcPaths: List[str]):
+    entries: List[Tuple[zipfile.ZipInfo, int]] = []
+    with open(destPath, "xb") as dest:
+        for srcPath in srcPaths:
+            with ZipFile(srcPath, mode = "r") as src, open(srcPath, "rb") as srcFile:
+                for info in src.infolist():
+                    # Skip the local header of the entry in the source file,
+                    # the sizes and CRC are taken from the central directory
+                    srcFile.seek(info.header_offset)
+                    header = srcFile.read(LOCAL_HEADER.size)
+                    if len(header) != LOCAL_HEADER.size or header[0:4] != b"PK\x03\x04":
+                        raise zipfile.BadZipFile(f"Bad magic number for file header of {info.filename}")
+                    _, _, _, _, _, _, _, _, _, nameLength, extraLength = LOCAL_HEADER.unpack(header)
+                    srcFile.seek(nameLength + extraLength, io.SEEK_CUR)
+
+                    offset = dest.tell()
+                    name = info.filename.encode("utf-8" if info.flag_bits & UTF8_FLAG else "cp437")
+                    dosDate, dosTime = dosDateTime(info.date_time)
+                    zip64 = info.file_size > ZIP64_LIMIT or info.compress_size > ZIP64_LIMIT
+                    extra = struct.pack("<2H2Q", 1, 16, info.file_size, info.compress_size) if zip64 else b""
+                    dest.write(LOCAL_HEADER.pack(
+                        b"PK\x03\x04", max(info.extract_version, ZIP64_VERSION if zip64 else 0),
+                        info.flag_bits & ~DATA_DESCRIPTOR_FLAG, info.compress_type, dosTime, dosDate, info.CRC,
+                        0xFFFFFFFF if zip64 else info.compress_size, 0xFFFFFFFF if zip64 else info.file_size,
+                        len(name), len(extra)))
+                    dest.write(name + extra)
+                    remaining = info.compress_size
+                    while remaining > 0:
+                        data = srcFile.read(min(remaining, CHUNK_SIZE))
+                        if len(data) == 0:
+                            raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+                        dest.write(data)
+                        remaining -= len(data)
+                    entries.append((info, offset))
+
+        centralDirOffset = dest.tell()
+        for info, offset in entries:
+            name = info.filename.encode("utf-8" if info.flag_bits & UTF8_FLAG else "cp437")
+            dosDate, dosTime = dosDateTime(info.date_time)
+            # The values that are too large are replaced by 0xFFFFFFFF and
+            # written in the ZIP64 extra field, in this order
+            zip64Values = [ value for value in [ info.file_size, info.compress_size, offset ] if value > ZIP64_LIMIT ]
+            extra = struct.pack(f"<2H{len(zip64Values)}Q", 1, 8 * len(zip64Values), *zip64Values) if len(zip64Values) > 0 else b""
+            dest.write(CENTRAL_HEADER.pack(
+                b"PK\x01\x02", info.create_system << 8 | info.create_version,
+                max(info.extract_version, ZIP64_VERSION if len(zip64Values) > 0 else 0),
+                info.flag_bits & ~DATA_DESCRIPTOR_FLAG, info.compress_type, dosTime, dosDate, info.CRC,
+                info.compress_size if info.compress_size <= ZIP64_LIMIT else 0xFFFFFFFF,
+                info.file_size if info.file_size <= ZIP64_LIMIT else 0xFFFFFFFF,
+                len(name), len(extra), len(info.comment), 0, info.internal_attr, info.external_attr,
+                offset if offset <= ZIP64_LIMIT else 0xFFFFFFFF))
+            dest.write(name + extra + info.comment)
+
+        centralDirSize = dest.tell() - centralDirOffset
+        count = len(entries)
+        if count > ZIP_FILECOUNT_LIMIT or centralDirOffset > ZIP64_LIMIT or centralDirSize > ZIP64_LIMIT:
+            zip64EndOffset = dest.tell()
+            dest.write(ZIP64_END_RECORD.pack(
+                b"PK\x06\x06", ZIP64_END_RECORD.size - 12, ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                count, count, centralDirSize, centralDirOffset))
+            dest.write(ZIP64_END_LOCATOR.pack(b"PK\x06\x07", 0, zip64EndOffset, 1))
+        dest.write(END_RECORD.pack(
+            b"PK\x05\x06", 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            centralDirSize if centralDirSize <= ZIP64_LIMIT else 0xFFFFFFFF,
+            centralDirOffset if centralDirOffset <= ZIP64_LIMIT else 0xFFFFFFFF, 0))
+
+# Copy every attachment from the Canvas export (submissions.zip) to the output
+# zip file. With multiple jobs, the submissions are copied to shards in
+# shardDir instead, and the paths of the shards are returned, which are to be
+# merged with the output zip file in order using mergeZips once it is closed.
+def copySubmissions(attachmentsZip: ZipFile, outputZip: ZipFile, copyAssessment: Callable[[str, str, str, ZipFile, str], None], replacements: Replacements, verbose: bool = False, jobs: int = 1, seed: Optional[int] = None, maxFileSize: Optional[float] = None, maxZipSize: Optional[float] = None, shardDir: Optional[str] = None) -> List[str]:
+    # Count the submissions to give a progress indicator
+    attachmentCount = len(attachmentsZip.infolist())
 
-        # Find the attachment id from the filename and look up the
-        # assessment for the submission with this attachment
-        filenameParts = attachmentInfo.filename.split("_")
-        if filenameParts[1] == "LATE":
-            userId = filenameParts[2]
-            attachmentId = filenameParts[3]
-        else:
-            userId = filenameParts[1]
-            attachmentId = filenameParts[2]
-        copyAssessment(userId, attachmentId, newId, outputZip, basePath)
+    # Fix the randomized order and the new ids of all submissions up front, so
+    # the output only depends on the seed and not on the number of jobs
+    submissions = [
+        (i, attachmentInfo, str(i).zfill(3))
+        for i, attachmentInfo in enumerate(shuffled(attachmentsZip.infolist(), random.Random(seed)))
+    ]
 
-        try:
-            # Open the inner zip file containing the submitted files
-            with attachmentsZip.open(attachmentInfo, mode = "r") as attachmentFile:
-                with ZipFile(attachmentFile, mode = "r") as attachmentZip:
-                    copyZipContent(attachmentZip, outputZip, basePath, replacements, verbose = verbose)
-        except Exception as err:
-            print("  Failed to copy submission, skipping...")
-            if verbose: print(err)
+    # Look up the assessment for every submission. These are copied in the
+    # main process, because the grading sheets are renamed in place.
+    for i, attachmentInfo, newId in submissions:
+        userId, attachmentId = parseAttachmentFilename(attachmentInfo.filename)
+        copyAssessment(userId, attachmentId, newId, outputZip, "submissions/" + newId + "/")
+
+    if jobs <= 1:
+        for i, attachmentInfo, newId in submissions:
+            print(f"Copying submission {i}/{attachmentCount}" + (f": {attachmentInfo.filename}" if verbose else ""))
+            copySubmission(attachmentsZip, attachmentInfo, outputZip, "submissions/" + newId + "/", replacements, verbose, maxFileSize, maxZipSize)
+        return []
+
+    if shardDir is None:
+        raise ValueError("A directory for the shards is needed to copy submissions with multiple jobs")
+    # Workers copy and compress the submissions into separate shards. The
+    # replacements are sent to the workers through a pipe, so they are never
+    # written to disk.
+    shardSize = max(1, math.ceil(len(submissions) / (jobs * 4)))
+    shards = [
+        [ (i, attachmentInfo.filename, newId) for i, attachmentInfo, newId in submissions[start:start + shardSize] ]
+        for start in range(0, len(submissions), shardSize)
+    ]
+    shardPaths = [ path.join(shardDir, f"shard{i}.zip") for i in range(len(shards)) ]
+    with ProcessPoolExecutor(max_workers = jobs) as executor:
+        logs = executor.map(copySubmissionsShard,
+            repeat(attachmentsZip.filename), shardPaths, shards, repeat(attachmentCount), repeat(replacements), repeat(verbose),
+            repeat(maxFileSize), repeat(maxZipSize))
+        for log in logs:
+            print(log, end = "")
+    return shardPaths
 
 # Copy rubric-based assessments related to a certain attachment from the Canvas
 # JSON export to the output zip file at the specified path
-def copyRubricAssessment(rubricAssessments: List[dict], attachmentId: str, outputZip: ZipFile, basePath: str, replacements: Replacements, verbose: bool = False):
+def copyRubricAssessment(rubricAssessmentIndex: Dict[str, List[dict]], attachmentId: str, outputZip: ZipFile, basePath: str, replacements: Replacements, verbose: bool = False):
     assessment = [ 
         { "score": s["score"], "rubrics": s["rubricAssessmentsConnection"]["nodes"] }
-        for s in rubricAssessments
-        if any([ a["_id"] == attachmentId for a in s["attachments"] ])
+        for s in rubricAssessmentIndex.get(attachmentId, [])
     ]
     try:
         outputZip.writestr(
@@ -284,20 +543,61 @@ def copyRubricAssessment(rubricAssessments: List[dict], attachmentId: str, outpu
         print("  Failed to write assessment, skipping...")
         if verbose: print(err)
 
-def renameGradingSheet(gradingWorkbook: Workbook, studentNr: str, newId: str, verbose: bool = False):
+# Index the rubric assessments by the ids of the attachments of the submission,
+# so the assessment for an attachment can be found without scanning all
+# submissions
+def indexRubricAssessments(rubricAssessments: List[dict]) -> Dict[str, List[dict]]:
+    index: Dict[str, List[dict]] = {}
+    for s in rubricAssessments:
+        for attachmentId in dict.fromkeys(a["_id"] for a in s["attachments"]):
+            index.setdefault(attachmentId, []).append(s)
+    return index
+
+# The grading sheets, the contents of the cells containing the student numbers
+# (E3 and E4) of all sheets joined by null characters, and the offset at which
+# the cells of every sheet start
+GradingSheetIndex = Tuple[List[Worksheet], str, List[int]]
+
+# Read the cells with student numbers of every grading sheet once, because
+# accessing cells through openpyxl is slow
+def indexGradingSheets(gradingWorkbook: Workbook) -> GradingSheetIndex:
+    sheets: List[Worksheet] = []
+    contents: List[str] = []
+    offsets: List[int] = []
+    offset = 0
     for sheet in gradingWorkbook:
-        if (sheet["E3"].value is not None and studentNr in sheet["E3"].value) or \
-           (sheet["E4"].value is not None and studentNr in sheet["E4"].value):
-            if sheet.title.startswith("n"):
-                newTitle = "n" + newId + ", " + sheet.title
-            else:
-                newTitle = "n" + newId + " ".join(sheet.title.split(" ")[1:])
-            if sheet.title.startswith("Resit"):
-                newTitle += " (resit)"
-            if verbose: print(f"Renaming grading sheet {sheet.title} to {newTitle}")
-            sheet.title = newTitle
-
-def main(attachmentsZipPath: str, gradebookCsvPath: str, canvasRubricsJsonPath: Union[str, None] = None, gradingSheetsPath: Union[str, None] = None, verbose: bool = False):
+        cells = "\0".join(str(sheet[cell].value) for cell in [ "E3", "E4" ] if sheet[cell].value is not None)
+        sheets.append(sheet)
+        contents.append(cells)
+        offsets.append(offset)
+        offset += len(cells) + 1
+    return sheets, "\0".join(contents), offsets
+
+# Find the grading sheets with the student number anywhere in their cells,
+# like "s1234567" or "1234567, 7654321", in the order of the workbook
+def findGradingSheets(gradingSheetIndex: GradingSheetIndex, studentNr: str) -> List[Worksheet]:
+    sheets, contents, offsets = gradingSheetIndex
+    matches = []
+    pos = contents.find(studentNr)
+    while pos >= 0:
+        i = bisect_right(offsets, pos) - 1
+        matches.append(sheets[i])
+        # Continue with the next sheet, every sheet is renamed once
+        pos = contents.find(studentNr, offsets[i + 1]) if i + 1 < len(offsets) else -1
+    return matches
+
+def renameGradingSheet(gradingSheetIndex: GradingSheetIndex, studentNr: str, newId: str, verbose: bool = False):
+    for sheet in findGradingSheets(gradingSheetIndex, studentNr):
+        if sheet.title.startswith("n"):
+            newTitle = "n" + newId + ", " + sheet.title
+        else:
+            newTitle = "n" + newId + " ".join(sheet.title.split(" ")[1:])
+        if sheet.title.startswith("Resit"):
+            newTitle += " (resit)"
+        if verbose: print(f"Renaming grading sheet {sheet.title} to {newTitle}")
+        sheet.title = newTitle
+
+def main(attachmentsZipPath: str, gradebookCsvPath: str, canvasRubricsJsonPath: Union[str, None] = None, gradingSheetsPath: Union[str, None] = None, verbose: bool = False, jobs: int = 1, seed: Union[int, None] = None, maxFileSize: Union[float, None] = 64, maxZipSize: Union[float, None] = 1024):
     # Determine the path of the output .zip file
     outputZipPath = path.splitext(attachmentsZipPath)[0] + "_cleaned.zip"
     
@@ -325,58 +625,70 @@ def main(attachmentsZipPath: str, gradebookCsvPath: str, canvasRubricsJsonPath:
     # Read rubrics and assessments from a configured location
     if canvasRubricsJsonPath is not None:
         assignment, assessments = readCanvasRubricsJson(canvasRubricsJsonPath)
+        rubricAssessmentIndex = indexRubricAssessments(assessments)
         copyAssessment = lambda userId, attachmentId, newId, outputZip, basePath: \
-            copyRubricAssessment(assessments, attachmentId, outputZip, basePath, replacements, verbose = verbose)
+            copyRubricAssessment(rubricAssessmentIndex, attachmentId, outputZip, basePath, replacements, verbose = verbose)
     elif gradingSheetsPath is not None:
         assignment = None
         print("Loading grading sheets...")
         assessments = load_workbook(filename = gradingSheetsPath)
+        gradingSheetIndex = indexGradingSheets(assessments)
         copyAssessment = lambda userId, attachmentId, newId, outputZip, basePath: \
-            renameGradingSheet(assessments, students[userId][1], newId, verbose = verbose)
+            renameGradingSheet(gradingSheetIndex, students[userId][1], newId, verbose = verbose)
     else:
         assignment, assessments = None, None
         copyAssessment = lambda userId, attachmentId, newId, outputZip, basePath: None
 
-    # Write the output .zip file
-    with ZipFile(outputZipPath, mode = "x", compression = zipfile.ZIP_DEFLATED) as outputZip:
-        if assignment is not None:
-            print("Writing assignment information and rubric...")
-            outputZip.writestr(
-                "info.json", 
-                json.dumps({ "name": assignment["name"], "courseName": assignment["course"]["name"] }, indent = 2)
-            )
-            outputZip.writestr("rubric.json", json.dumps(assignment["rubric"], indent = 2))
-
-        # Copy submissions from the source zip file
-        with ZipFile(attachmentsZipPath, mode = "r") as attachmentsZip:
-            copySubmissions(attachmentsZip, outputZip, copyAssessment, replacements, verbose = verbose)
-
-        if gradingSheetsPath is not None:
-            # Remove all grading sheets for which we don't have a matching
-            # submission (which weren't renamed)
-            for sheet in assessments:
-                if not sheet.title.startswith("n"):
-                    assessments.remove(sheet)
-
-            # Sort the grading sheets by title
-            for i, sheet in enumerate(sorted(assessments.sheetnames)):
-                assessments.move_sheet(sheet, i)
+    # Write the output .zip file. With multiple jobs, the other entries are
+    # written to a separate zip file, which is merged with the shards of
+    # submissions written by the workers at the end.
+    with TemporaryDirectory(dir = path.dirname(path.abspath(outputZipPath))) if jobs > 1 else nullcontext() as shardDir:
+        mainZipPath = outputZipPath if shardDir is None else path.join(shardDir, "main.zip")
+        shardPaths: List[str] = []
+        with ZipFile(mainZipPath, mode = "x", compression = zipfile.ZIP_DEFLATED) as outputZip:
+            if assignment is not None:
+                print("Writing assignment information and rubric...")
+                outputZip.writestr(
+                    "info.json", 
+                    json.dumps({ "name": assignment["name"], "courseName": assignment["course"]["name"] }, indent = 2)
+                )
+                outputZip.writestr("rubric.json", json.dumps(assignment["rubric"], indent = 2))
+
+            # Copy submissions from the source zip file
+            with ZipFile(attachmentsZipPath, mode = "r") as attachmentsZip:
+                shardPaths = copySubmissions(attachmentsZip, outputZip, copyAssessment, replacements, verbose = verbose, jobs = jobs, seed = seed,
+                                             maxFileSize = maxFileSize, maxZipSize = maxZipSize, shardDir = shardDir)
+
+            if gradingSheetsPath is not None:
+                # Remove all grading sheets for which we don't have a matching
+                # submission (which weren't renamed)
+                for sheet in assessments:
+                    if not sheet.title.startswith("n"):
+                        assessments.remove(sheet)
+
+                # Sort the grading sheets by title
+                for i, sheet in enumerate(sorted(assessments.sheetnames)):
+                    assessments.move_sheet(sheet, i)
             
-            # Set the first sheet as active
-            assessments.active = 0
-
-            # Clear the cells with group name and student numbers
-            for sheet in assessments:
-                sheet["E2"].value = None
-                sheet["E3"].value = None
-                sheet["E4"].value = None
-
-            print("Copying grading sheets...")
-            # Save the grading sheets and add to the output zip file
-            tmpGradingSheetsPath = path.splitext(gradingSheetsPath)[0] + "_tmp.xlsx"
-            assessments.save(tmpGradingSheetsPath)
-            outputZip.write(tmpGradingSheetsPath, "gradingSheets.xlsx")
-            remove(tmpGradingSheetsPath)
+                # Set the first sheet as active
+                assessments.active = 0
+
+                # Clear the cells with group name and student numbers
+                for sheet in assessments:
+                    sheet["E2"].value = None
+                    sheet["E3"].value = None
+                    sheet["E4"].value = None
+
+                print("Copying grading sheets...")
+                # Save the grading sheets and add to the output zip file
+                tmpGradingSheetsPath = path.splitext(gradingSheetsPath)[0] + "_tmp.xlsx"
+                assessments.save(tmpGradingSheetsPath)
+                outputZip.write(tmpGradingSheetsPath, "gradingSheets.xlsx")
+                remove(tmpGradingSheetsPath)
+
+        if shardDir is not None:
+            print("Merging submissions...")
+            mergeZips(outputZipPath, [ mainZipPath ] + shardPaths)
 
     print("Done.")
 
@@ -400,6 +712,32 @@ if __name__ == "__main__":
         help = "Path to the Excel workbook containing grading sheets in SS format."
     )
 
+    parser.add_argument(
+        "-j", "--jobs",
+        type = int,
+        default = 1,
+        help = "Number of processes to copy submissions in parallel"
+    )
+    parser.add_argument(
+        "--seed",
+        type = int,
+        help = "Seed for the order of the submissions, to get the same submission ids in the output when running again. Note: this does not affect the generated names and student numbers."
+    )
+
+    parser.add_argument(
+        "--max-file-size",
+        type = float,
+        default = 64,
+        help = "Skip code files and .jar files larger than this size in MB"
+    )
+    parser.add_argument(
+        "--max-zip-size",
+        type = float,
+        default = 1024,
+        help = "Skip nested .zip files larger than this size in MB"
+    )
+
     args = parser.parse_args()
 
-    main(args.submissions, args.gradebook, args.rubrics, args.gradingsheets, verbose = args.verbose)
+    main(args.submissions, args.gradebook, args.rubrics, args.gradingsheets, verbose = args.verbose, jobs = args.jobs, seed = args.seed,
+         maxFileSize = args.max_file_size, maxZipSize = args.max_zip_size)
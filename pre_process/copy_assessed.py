@@ -1,20 +1,155 @@
+import argparse
+import hashlib
 import json
 import os
 import shutil
-import sys
 
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from os import path
+from typing import Dict, Optional, Tuple
 
-submissionsRoot = sys.argv[1]
+# File in the destination that records the state of every submission at the
+# last sync, so unchanged submissions can be skipped
+STATE_FILE = ".copy_assessed.json"
 
-dest = path.normpath(path.join(submissionsRoot, "..", "assessed"))
-print(f"Copying assessed submissions to {dest}")
-os.mkdir(dest)
-
-for subm in os.listdir(submissionsRoot):
-    with open(path.join(submissionsRoot, subm, "assessment.json"), "r") as assessmentFile:
+def isAssessed(assessmentPath: str) -> bool:
+    with open(assessmentPath, "r") as assessmentFile:
         assessment = json.load(assessmentFile)
-    if(len(assessment) > 0 and len(assessment[0]["rubrics"]) > 0):
-        os.mkdir(path.join(dest, subm))
-        shutil.copy(path.join(submissionsRoot, subm, "assessment.json"), path.join(dest, subm))
-        shutil.copytree(path.join(submissionsRoot, subm, "build", "source"), path.join(dest, subm, "source"))
+    return len(assessment) > 0 and len(assessment[0]["rubrics"]) > 0
+
+# Compute a signature of the assessment and source files of a submission, based
+# on the size and modification time of every file, or on the contents of every
+# file if checksum is set
+def submissionSignature(submissionDir: str, checksum: bool = False) -> str:
+    hash = hashlib.sha256()
+    files = [ path.join(submissionDir, "assessment.json") ]
+    for root, dirs, filenames in os.walk(path.join(submissionDir, "build", "source")):
+        dirs.sort()
+        files += [ path.join(root, filename) for filename in sorted(filenames) ]
+    for file in files:
+        stat = os.stat(file)
+        hash.update(path.relpath(file, submissionDir).encode("utf-8") + b"\0")
+        if checksum:
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hash.update(chunk)
+        else:
+            hash.update(f"{stat.st_size}:{stat.st_mtime_ns}\0".encode("utf-8"))
+    return hash.hexdigest()
+
+# Hardlink a file, falling back to a copy if that is not possible, for example
+# because the destination is on another filesystem
+def linkOrCopy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def copySubmission(submissionDir: str, destDir: str, link: bool = False):
+    if path.exists(destDir):
+        shutil.rmtree(destDir)
+    os.mkdir(destDir)
+    copyFunction = linkOrCopy if link else shutil.copy2
+    copyFunction(path.join(submissionDir, "assessment.json"), path.join(destDir, "assessment.json"))
+    shutil.copytree(path.join(submissionDir, "build", "source"), path.join(destDir, "source"), copy_function = copyFunction)
+
+# Copy a submission if it is assessed and has changed since the previous sync,
+# returning the new state of the submission and what was done
+def syncSubmission(submissionsRoot: str, dest: str, subm: str, previous: Optional[dict], link: bool = False, checksum: bool = False) -> Tuple[str, Optional[dict], str]:
+    submissionDir = path.join(submissionsRoot, subm)
+    if not path.isdir(path.join(submissionDir, "build", "source")):
+        return subm, None, "missing"
+
+    # Only parse the assessment again if something changed
+    signature = submissionSignature(submissionDir, checksum)
+    if previous is not None and previous["signature"] == signature:
+        assessed = previous["assessed"]
+        if not assessed or path.isdir(path.join(dest, subm)):
+            return subm, previous, "unchanged"
+    else:
+        assessed = isAssessed(path.join(submissionDir, "assessment.json"))
+
+    state = { "signature": signature, "assessed": assessed }
+    if not assessed:
+        return subm, state, "unassessed"
+    copySubmission(submissionDir, path.join(dest, subm), link)
+    return subm, state, "copied"
+
+def readState(dest: str) -> Dict[str, dict]:
+    statePath = path.join(dest, STATE_FILE)
+    if not path.exists(statePath):
+        return {}
+    with open(statePath, "r") as stateFile:
+        return json.load(stateFile)
+
+def writeState(dest: str, state: Dict[str, dict]):
+    tmpPath = path.join(dest, STATE_FILE + ".tmp")
+    with open(tmpPath, "w") as stateFile:
+        json.dump(state, stateFile, indent = 2)
+    os.replace(tmpPath, path.join(dest, STATE_FILE))
+
+def main(submissionsRoot: str, dest: Optional[str] = None, jobs: int = 1, sync: bool = False, link: bool = False, checksum: bool = False):
+    if dest is None:
+        dest = path.normpath(path.join(submissionsRoot, "..", "assessed"))
+    print(f"Copying assessed submissions to {dest}")
+    if sync:
+        os.makedirs(dest, exist_ok = True)
+        previousState = readState(dest)
+    else:
+        os.mkdir(dest)
+        previousState = {}
+
+    submissions = sorted(subm for subm in os.listdir(submissionsRoot) if path.isdir(path.join(submissionsRoot, subm)))
+    with ThreadPoolExecutor(max_workers = max(1, jobs)) as executor:
+        results = list(executor.map(syncSubmission,
+            repeat(submissionsRoot), repeat(dest), submissions, [ previousState.get(subm) for subm in submissions ],
+            repeat(link), repeat(checksum)))
+
+    state = {}
+    counts: Dict[str, int] = {}
+    for subm, submState, action in results:
+        counts[action] = counts.get(action, 0) + 1
+        if submState is not None:
+            state[subm] = submState
+        if action == "missing":
+            print(f"No build/source folder for {subm}, skipping...")
+
+    # Remove submissions copied in an earlier sync that are no longer assessed
+    # or no longer exist
+    removed = 0
+    for subm in previousState:
+        if not state.get(subm, { "assessed": False })["assessed"] and path.isdir(path.join(dest, subm)):
+            shutil.rmtree(path.join(dest, subm))
+            removed += 1
+
+    writeState(dest, state)
+    print(f"Copied {counts.get('copied', 0)}, unchanged {counts.get('unchanged', 0)}, removed {removed}, "
+          f"not assessed {counts.get('unassessed', 0)}, without build {counts.get('missing', 0)}.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Copy the submissions that have been assessed in a rubric")
+    parser.add_argument("submissions", help = "Path to the folder containing the anonymized and built submissions")
+    parser.add_argument(
+        "-d", "--dest",
+        help = "Folder to copy the assessed submissions to, defaults to assessed next to the submissions folder")
+    parser.add_argument(
+        "-j", "--jobs",
+        type = int,
+        default = 1,
+        help = "Number of submissions to copy in parallel")
+    parser.add_argument(
+        "--sync",
+        action = "store_true",
+        help = "Update an existing destination, only copying submissions that changed since the previous run and removing those that are no longer assessed")
+    parser.add_argument(
+        "--link",
+        action = "store_true",
+        help = "Hardlink files instead of copying them where possible. Note: changing a linked file in the destination also changes the submission.")
+    parser.add_argument(
+        "--checksum",
+        action = "store_true",
+        help = "Detect changes by the contents of files rather than their size and modification time")
+    args = parser.parse_args()
+
+    main(args.submissions, args.dest, args.jobs, args.sync, args.link, args.checksum)
@@ -0,0 +1,329 @@
+import os
+import re
+import shutil
+
+from os import path
+from typing import List, Optional, Tuple
+
+# A native version of the Processing preprocessor, which turns the .pde files of
+# a sketch into the Java source that processing-java --build generates, without
+# starting a JVM and compiling the sketch. It only handles sketches in active
+# mode (with setup() and other methods at the top level), which is how nearly
+# all projects are written, and raises UnsupportedSketch for anything it is not
+# sure about, so the caller can fall back to processing-java.
+
+class UnsupportedSketch(Exception):
+    pass
+
+CORE_IMPORTS = [ "processing.core.*", "processing.data.*", "processing.event.*", "processing.opengl.*" ]
+DEFAULT_IMPORTS = [
+    "java.util.HashMap", "java.util.ArrayList", "java.io.File", "java.io.BufferedReader", "java.io.PrintWriter",
+    "java.io.InputStream", "java.io.OutputStream", "java.io.IOException" ]
+
+# Functions that are moved from setup() to settings()
+SETTINGS_FUNCTIONS = [ "size", "fullScreen", "smooth", "noSmooth", "pixelDensity" ]
+# Primitive types that can be used as a conversion function, like int(x)
+CONVERSION_FUNCTIONS = [ "int", "float", "char", "byte", "boolean" ]
+OPENING_BRACKETS = [ "(", "{", "[" ]
+CLOSING_BRACKETS = [ ")", "}", "]" ]
+ACCESS_MODIFIERS = [ "public", "protected", "private" ]
+# Keywords that start a statement with a block, like a method declaration does
+STATEMENT_KEYWORDS = [ "if", "for", "while", "do", "switch", "try", "catch", "finally", "synchronized", "else", "return", "new" ]
+
+TOKEN_REGEX = re.compile(r"""
+    (?P<whitespace>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<textblock>\"\"\")
+  | (?P<string>"(?:\\.|[^"\\\n])*")
+  | (?P<char>'(?:\\.|[^'\\\n])+')
+  | (?P<webcolor>\#[0-9a-fA-F]{6}(?![\w$]))
+  | (?P<number>
+        0[xX][0-9a-fA-F_]+[lL]?
+      | 0[bB][01_]+[lL]?
+      | (?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][+-]?\d[\d_]*)?[fFdDlL]?)
+  | (?P<identifier>[^\W\d]\w*|\$[\w$]*)
+  | (?P<operator>->|::|\.\.\.|[{}()\[\];,.@=<>!~?:&|+\-*/^%])
+""", re.VERBOSE | re.DOTALL)
+
+Token = Tuple[str, str]
+
+def tokenize(code: str) -> List[Token]:
+    tokens = []
+    pos = 0
+    while pos < len(code):
+        match = TOKEN_REGEX.match(code, pos)
+        if match is None:
+            raise UnsupportedSketch(f"unexpected character {code[pos]!r}")
+        if match.lastgroup == "textblock":
+            raise UnsupportedSketch("text blocks")
+        tokens.append((match.lastgroup, match.group()))
+        pos = match.end()
+    return tokens
+
+def isSignificant(token: Token) -> bool:
+    return token[0] not in [ "whitespace", "comment" ]
+
+# Split the code at the top level of the sketch into items: imports, fields,
+# methods and classes. Returns the items as lists of indices of the significant
+# tokens in the item.
+def splitItems(tokens: List[Token]) -> List[List[int]]:
+    items: List[List[int]] = []
+    item: List[int] = []
+    depth = 0
+    # Whether the item ends at the brace that closes its block, rather than
+    # at a semicolon (for fields with an array initializer or anonymous class)
+    endsAtBrace = False
+    for i, token in enumerate(tokens):
+        if not isSignificant(token):
+            continue
+        text = token[1]
+        item.append(i)
+        if text in OPENING_BRACKETS:
+            if text == "{" and depth == 0:
+                endsAtBrace = not any(tokens[j][1] == "=" for j in itemTopLevel(tokens, item))
+            depth += 1
+        elif text in CLOSING_BRACKETS:
+            depth -= 1
+            if depth < 0:
+                raise UnsupportedSketch("unbalanced brackets")
+            if text == "}" and depth == 0 and endsAtBrace:
+                items.append(item)
+                item, endsAtBrace = [], False
+        elif text == ";" and depth == 0:
+            items.append(item)
+            item, endsAtBrace = [], False
+    if depth != 0 or len(item) > 0:
+        raise UnsupportedSketch("unbalanced brackets or missing semicolon")
+    return items
+
+# Get the tokens of an item that are not nested in brackets
+def itemTopLevel(tokens: List[Token], item: List[int]) -> List[int]:
+    result = []
+    depth = 0
+    for i in item:
+        text = tokens[i][1]
+        if text in CLOSING_BRACKETS:
+            depth -= 1
+        if depth == 0:
+            result.append(i)
+        if text in OPENING_BRACKETS:
+            depth += 1
+    return result
+
+# Skip the annotations at the start of an item, returning the position of the
+# first token after them
+def skipAnnotations(tokens: List[Token], item: List[int]) -> int:
+    pos = 0
+    while pos < len(item) and tokens[item[pos]][1] == "@" and tokens[item[pos + 1]][1] != "interface":
+        pos += 2
+        while pos + 1 < len(item) and tokens[item[pos]][1] == "." and tokens[item[pos + 1]][0] == "identifier":
+            pos += 2
+        if pos < len(item) and tokens[item[pos]][1] == "(":
+            depth = 0
+            while True:
+                text = tokens[item[pos]][1]
+                depth += 1 if text in OPENING_BRACKETS else -1 if text in CLOSING_BRACKETS else 0
+                pos += 1
+                if depth == 0:
+                    break
+    return pos
+
+# Get the tokens of an item outside of brackets, after its annotations
+def itemHeader(tokens: List[Token], item: List[int]) -> List[str]:
+    return [ tokens[i][1] for i in itemTopLevel(tokens, item[skipAnnotations(tokens, item):]) ]
+
+# Classify an item as "import", "class", "method", "field" or "empty", raising
+# UnsupportedSketch for statements, which only occur in static mode
+def classifyItem(tokens: List[Token], item: List[int]) -> str:
+    texts = itemHeader(tokens, item)
+    if texts == [ ";" ]:
+        return "empty"
+    if texts[0] == "import":
+        return "import"
+    if any(text in [ "class", "interface", "enum" ] for text in texts):
+        return "class"
+
+    if texts[-1] == "}" and "(" in texts[:texts.index("{")]:
+        name = texts.index("(") - 1
+        # A method has a return type (constructors are not possible at the
+        # top level) and is not a statement with a block
+        if name >= 1 and tokens[item[0]][0] != "number" and texts[name - 1] not in [ "=", ".", "(", ",", "@" ] \
+           and not any(text in STATEMENT_KEYWORDS for text in texts[:name + 1]):
+            return "method"
+
+    if texts[-1] == ";":
+        declaration = texts[:next(i for i, text in enumerate(texts) if text in [ "=", ";" ])]
+        while len(declaration) >= 2 and declaration[-2:] == [ "[", "]" ]:
+            declaration = declaration[:-2]
+        if len(declaration) >= 2 and "(" not in declaration and re.match(r"[^\W\d]\w*$", declaration[-1]) \
+           and declaration[-2] not in [ ".", "=" ] and declaration[0] not in STATEMENT_KEYWORDS:
+            return "field"
+    raise UnsupportedSketch("statements outside of a method (static mode)")
+
+def methodName(tokens: List[Token], item: List[int]) -> str:
+    texts = itemHeader(tokens, item)
+    return texts[texts.index("(") - 1]
+
+def matchingBracket(tokens: List[Token], i: int) -> int:
+    depth = 0
+    for j in range(i, len(tokens)):
+        if not isSignificant(tokens[j]):
+            continue
+        depth += 1 if tokens[j][1] in OPENING_BRACKETS else -1 if tokens[j][1] in CLOSING_BRACKETS else 0
+        if depth == 0:
+            return j
+    raise UnsupportedSketch("unbalanced brackets")
+
+# Remove the calls to size() and similar functions at the top level of setup()
+# from the code, returning the removed calls
+def extractSettings(tokens: List[Token], setup: List[int]) -> List[str]:
+    bodyStart = next(i for i in setup if tokens[i][1] == "{")
+    bodyEnd = setup[-1]
+    calls = []
+    depth = 0
+    statementStart = True
+    i = bodyStart + 1
+    while i < bodyEnd:
+        kind, text = tokens[i]
+        if not isSignificant(tokens[i]):
+            i += 1
+            continue
+        if kind == "identifier" and text in SETTINGS_FUNCTIONS and nextSignificant(tokens, i) == "(" \
+           and previousSignificant(tokens, i) != ".":
+            if depth > 0 or not statementStart:
+                raise UnsupportedSketch(f"{text}() nested in setup()")
+            end = next(j for j in range(matchingBracket(tokens, nextSignificantIndex(tokens, i)) + 1, bodyEnd + 1) if isSignificant(tokens[j]))
+            if tokens[end][1] != ";":
+                raise UnsupportedSketch(f"{text}() used in an expression")
+            calls.append("".join(token[1] for token in tokens[i:end + 1] if token[0] != "comment"))
+            for j in range(i, end + 1):
+                tokens[j] = ("whitespace", "")
+            i = end + 1
+            statementStart = True
+            continue
+        if text in OPENING_BRACKETS:
+            depth += 1
+        elif text in CLOSING_BRACKETS:
+            depth -= 1
+        statementStart = depth == 0 and text in [ ";", "{", "}" ]
+        i += 1
+    return calls
+
+def nextSignificantIndex(tokens: List[Token], i: int) -> int:
+    for j in range(i + 1, len(tokens)):
+        if isSignificant(tokens[j]):
+            return j
+    return len(tokens)
+
+def nextSignificant(tokens: List[Token], i: int) -> Optional[str]:
+    j = nextSignificantIndex(tokens, i)
+    return tokens[j][1] if j < len(tokens) else None
+
+def previousSignificant(tokens: List[Token], i: int) -> Optional[str]:
+    for j in range(i - 1, -1, -1):
+        if isSignificant(tokens[j]):
+            return tokens[j][1]
+    return None
+
+# Apply the rewrites of the Processing language to the tokens: the color type
+# becomes int, web colors become hexadecimal ints, decimal literals become
+# floats and conversion functions like int(x) become PApplet.parseInt(x).
+def rewriteTokens(tokens: List[Token]):
+    for i, (kind, text) in enumerate(tokens):
+        if kind == "identifier" and text == "color" and nextSignificant(tokens, i) != "(":
+            if previousSignificant(tokens, i) == ".":
+                raise UnsupportedSketch("color used as a name")
+            tokens[i] = (kind, "int")
+        elif kind == "identifier" and text in CONVERSION_FUNCTIONS and nextSignificant(tokens, i) == "(":
+            if previousSignificant(tokens, i) == ".":
+                raise UnsupportedSketch(f"{text} used as a name")
+            tokens[i] = (kind, "PApplet.parse" + text.capitalize())
+        elif kind == "webcolor":
+            tokens[i] = (kind, "0xff" + text[1:])
+        elif kind == "number" and not text.lower().startswith(("0x", "0b")) \
+             and re.search(r"[.eE]", text) and text[-1] not in "fFdD":
+            tokens[i] = (kind, text + "f")
+
+# Preprocess the code of all tabs of a sketch into the Java source of the
+# sketch class
+def preprocessCode(sketchName: str, code: str) -> str:
+    tokens = tokenize(code)
+    items = splitItems(tokens)
+    kinds = [ classifyItem(tokens, item) for item in items ]
+    if "method" not in kinds:
+        raise UnsupportedSketch("no methods (static mode)")
+
+    for item, kind in zip(items, kinds):
+        texts = [ tokens[i][1] for i in item ]
+        if kind == "class" and "extends" in texts and texts[texts.index("extends") + 1] == "PApplet":
+            raise UnsupportedSketch("sketch class extending PApplet (Java mode)")
+
+    # Imports are moved to the top of the file
+    imports = []
+    for item, kind in zip(items, kinds):
+        if kind == "import":
+            texts = [ tokens[i][1] for i in item[1:-1] ]
+            imports.append("static " + "".join(texts[1:]) if texts[0] == "static" else "".join(texts))
+            for i in range(item[0], item[-1] + 1):
+                tokens[i] = ("whitespace", "")
+
+    rewriteTokens(tokens)
+
+    methods = { methodName(tokens, item): item for item, kind in zip(items, kinds) if kind == "method" }
+    settings = []
+    if "settings" not in methods and "setup" in methods:
+        settings = extractSettings(tokens, methods["setup"])
+
+    # Methods without an access modifier are made public, so they can override
+    # the methods of PApplet
+    for item, kind in zip(items, kinds):
+        if kind == "method":
+            start = skipAnnotations(tokens, item)
+            header = [ tokens[i][1] for i in item[start:] ]
+            if not any(modifier in header[:header.index("(")] for modifier in ACCESS_MODIFIERS):
+                tokens[item[start]] = (tokens[item[start]][0], "public " + tokens[item[start]][1])
+
+    lines = [ f"import {name};" for name in CORE_IMPORTS ] + [ "" ]
+    if len(imports) > 0:
+        lines += [ f"import {name};" for name in imports ] + [ "" ]
+    lines += [ f"import {name};" for name in DEFAULT_IMPORTS ] + [ "" ]
+    lines += [ f"public class {sketchName} extends PApplet {{", "", "".join(token[1] for token in tokens), "" ]
+    if len(settings) > 0:
+        lines += [ "  public void settings() { " + " ".join(settings) + " }", "" ]
+    lines += [
+        "  static public void main(String[] passedArgs) {",
+        f"    String[] appletArgs = new String[] {{ \"{sketchName}\" }};",
+        "    if (passedArgs != null) {",
+        "      PApplet.main(concat(appletArgs, passedArgs));",
+        "    } else {",
+        "      PApplet.main(appletArgs);",
+        "    }",
+        "  }",
+        "}",
+        "" ]
+    return "\n".join(lines)
+
+# Preprocess the sketch in sketchDir to outputDir/source, like processing-java
+# --build does. The main tab comes first, followed by the other tabs in sorted
+# order. Java tabs are copied as they are.
+def preprocessSketch(sketchDir: str, outputDir: str):
+    sketchName = path.basename(path.normpath(sketchDir))
+    with os.scandir(sketchDir) as it:
+        files = sorted(entry.name for entry in it if entry.is_file())
+    if sketchName + ".pde" not in files:
+        raise UnsupportedSketch(f"no main tab {sketchName}.pde")
+    tabs = [ sketchName + ".pde" ] + [ file for file in files if file.endswith(".pde") and file != sketchName + ".pde" ]
+
+    code = []
+    for tab in tabs:
+        with open(path.join(sketchDir, tab), "r", encoding = "utf-8") as f:
+            code.append(f.read())
+    source = preprocessCode(sketchName, "\n".join(code))
+
+    sourceDir = path.join(outputDir, "source")
+    os.makedirs(sourceDir, exist_ok = True)
+    with open(path.join(sourceDir, sketchName + ".java"), "w", encoding = "utf-8") as f:
+        f.write(source)
+    for file in files:
+        if file.endswith(".java"):
+            shutil.copy2(path.join(sketchDir, file), path.join(sourceDir, file))
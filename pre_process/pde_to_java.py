@@ -1,41 +1,103 @@
+import argparse
+import io
+import json
 import os
+import resource
 import shutil
 import subprocess
 import sys
+import tempfile
+import time
 
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import redirect_stderr, redirect_stdout
+from itertools import islice, repeat
 from os import path
+from typing import Iterable, Iterator, Optional, Tuple
 
+# Import the native preprocessor both when running this file as a script and
+# when importing it from the pipeline
+try:
+    from pre_process import pde_preprocessor
+except ImportError:
+    import pde_preprocessor
+
+# Manifest of a project written by pipeline/manifest.py, which already contains
+# the .pde root and main sketch of the project
+MANIFEST_FILE = "manifest.json"
+
+# Find the first folder containing a .pde file, looking at the files in a folder
+# before descending into its subfolders in sorted order
 def findPdeRoot(searchRoot):
-    items = os.listdir(searchRoot)
-    for item in items:
-        if path.isfile(path.join(searchRoot, item)) and item.endswith(".pde"):
-            return searchRoot
-    for item in items:
-        if path.isdir(path.join(searchRoot, item)):
-            result = findPdeRoot(path.join(searchRoot, item))
+    with os.scandir(searchRoot) as it:
+        entries = sorted(it, key = lambda entry: entry.name)
+    if any(entry.name.endswith(".pde") and entry.is_file() for entry in entries):
+        return searchRoot
+    for entry in entries:
+        if entry.is_dir(follow_symlinks = False):
+            result = findPdeRoot(entry.path)
             if result != None:
                 return result
     return None
 
 def isValidProcessingProject(pdeRoot):
-    return path.basename(pdeRoot) + ".pde" in os.listdir(pdeRoot)
+    return path.isfile(path.join(pdeRoot, path.basename(pdeRoot) + ".pde"))
+
+# Check whether a .pde file defines both setup() and draw(), stopping as soon
+# as both are found
+def isMainPde(file):
+    setup, draw = False, False
+    with open(file, "r") as f:
+        for line in f:
+            line = line.strip()
+            setup = setup or line.startswith("void setup()")
+            draw = draw or line.startswith("void draw()")
+            if setup and draw:
+                return True
+    return False
 
 def findMainPde(pdeRoot):
-    items = os.listdir(pdeRoot)
-    for item in items:
-        if path.isfile(path.join(pdeRoot, item)) and item.endswith(".pde"):
-            with open(path.join(pdeRoot, item), "r") as f:
-                lines = f.readlines()
-            if any([ line.strip().startswith("void setup()") for line in lines ]) and \
-               any([ line.strip().startswith("void draw()") for line in lines ]):
-                return item
-
-def buildProject(submissionsRoot, subm) -> bool:
-    pdeRoot = findPdeRoot(path.join(submissionsRoot, subm))
+    with os.scandir(pdeRoot) as it:
+        entries = sorted(it, key = lambda entry: entry.name)
+    for entry in entries:
+        if entry.name.endswith(".pde") and entry.is_file() and isMainPde(entry.path):
+            return entry.name
+
+def readManifest(projectDir):
+    manifestPath = path.join(projectDir, MANIFEST_FILE)
+    if not path.isfile(manifestPath):
+        return None
+    with open(manifestPath, "r") as manifestFile:
+        return json.load(manifestFile)
+
+# Run processing-java on a sketch, returning its exit code, what it printed on
+# stderr and its resource usage. The process is waited for with wait4, so the
+# CPU time and peak RSS are those of processing-java and the JVM it runs only.
+def runProcessingJava(pdeRoot: str, buildDir: str) -> Tuple[int, str, resource.struct_rusage]:
+    with tempfile.TemporaryFile(mode = "w+") as stderr:
+        proc = subprocess.Popen(["processing-java", "--sketch=" + path.abspath(pdeRoot), "--output=" + path.abspath(buildDir), "--force", "--build"], stdout = subprocess.DEVNULL, stderr = stderr, text = True)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        stderr.seek(0)
+        return proc.returncode, stderr.read(), usage
+
+# Build a project, returning whether it succeeded. If processing-java was run,
+# its CPU time in seconds and peak RSS in MB are added to usage as childCpu and
+# childMaxRssMB.
+def buildProject(submissionsRoot, subm, native: bool = False, usage: Optional[dict] = None) -> bool:
+    # Use the manifest of the project if the pipeline wrote one, instead of
+    # searching the project again
+    manifest = readManifest(path.join(submissionsRoot, subm))
+    if manifest is None:
+        pdeRoot = findPdeRoot(path.join(submissionsRoot, subm))
+    elif manifest["pdeRoot"] is None:
+        pdeRoot = None
+    else:
+        pdeRoot = path.normpath(path.join(submissionsRoot, subm, manifest["pdeRoot"]))
     if pdeRoot != None:
         if not isValidProcessingProject(pdeRoot):
             print("Invalid Processing project, attempting a fix", file=sys.stderr)
-            mainPde = findMainPde(pdeRoot)
+            mainPde = findMainPde(pdeRoot) if manifest is None else manifest["mainPde"]
             if mainPde != None:
                 print(f"Found main file {mainPde}", file=sys.stderr)
                 sketchName = path.splitext(mainPde)[0]
@@ -50,7 +112,7 @@ def buildProject(submissionsRoot, subm) -> bool:
                     pass # Ignore if the folder already exists
                 print(f"Moving files to {newPdeRoot}", file=sys.stderr)
                 for item in os.listdir(pdeRoot):
-                    if item != "assessment.json" and item != sketchName:
+                    if item not in [ "assessment.json", MANIFEST_FILE, sketchName ]:
                         shutil.move(path.join(pdeRoot, item), path.join(newPdeRoot, item))
                 pdeRoot = newPdeRoot
             else:
@@ -69,13 +131,30 @@ def buildProject(submissionsRoot, subm) -> bool:
                     pass # Ignore if the folder already exists
                 print(f"Moving files to {newPdeRoot}", file=sys.stderr)
                 for item in os.listdir(pdeRoot):
-                    if item != "assessment.json" and item != sketchName:
+                    if item not in [ "assessment.json", MANIFEST_FILE, sketchName ]:
                         shutil.move(path.join(pdeRoot, item), path.join(newPdeRoot, item))
                 pdeRoot = newPdeRoot
 
-        buildProc = subprocess.run(["processing-java", "--sketch=" + path.abspath(pdeRoot), "--output=" + path.abspath(path.join(submissionsRoot, subm, "build")), "--force", "--build"], capture_output = True, text = True)
-        print(buildProc.stderr, file=sys.stderr, end=None)
-        if buildProc.returncode != 0:
+        # Try the native preprocessor first, which only generates the Java
+        # source, falling back to processing-java for sketches it cannot handle
+        if native:
+            try:
+                pde_preprocessor.preprocessSketch(pdeRoot, path.join(submissionsRoot, subm, "build"))
+                print(f"Preprocessed {path.basename(pdeRoot)} natively", file=sys.stderr)
+                return True
+            except pde_preprocessor.UnsupportedSketch as err:
+                print(f"Native preprocessor does not support {err}, using processing-java", file=sys.stderr)
+                shutil.rmtree(path.join(submissionsRoot, subm, "build"), ignore_errors = True)
+            except UnicodeDecodeError:
+                print("Native preprocessor cannot decode the sketch, using processing-java", file=sys.stderr)
+
+        returncode, stderr, buildUsage = runProcessingJava(pdeRoot, path.join(submissionsRoot, subm, "build"))
+        if usage is not None:
+            usage["childCpu"] = round(buildUsage.ru_utime + buildUsage.ru_stime, 3)
+            # ru_maxrss is in kilobytes on Linux
+            usage["childMaxRssMB"] = round(buildUsage.ru_maxrss / 1024, 1)
+        print(stderr, file=sys.stderr, end=None)
+        if returncode != 0:
             print("processing-java failed.", file=sys.stderr)
             return False
         return True
@@ -83,12 +162,69 @@ def buildProject(submissionsRoot, subm) -> bool:
         print(f"Invalid Processing project {subm}, unable to find .pde root", file=sys.stderr)
         return False
 
-def main(submissionsRoot: str):
-    for subm in os.listdir(submissionsRoot):
+# Build a project while capturing everything it prints, so the output of builds
+# running in parallel does not get interleaved. Also returns the timing of the
+# build: start and end in microseconds since the Unix epoch, the process that
+# ran it, and the CPU time and peak RSS of processing-java if it was run.
+def buildProjectCaptured(submissionsRoot, subm, native: bool = False) -> Tuple[str, bool, str, dict]:
+    log = io.StringIO()
+    timing = { "start": time.time_ns() // 1000 }
+    with redirect_stdout(log), redirect_stderr(log):
+        success = buildProject(submissionsRoot, subm, native, timing)
+    timing["end"] = time.time_ns() // 1000
+    timing["pid"] = os.getpid()
+    return subm, success, log.getvalue(), timing
+
+# Build all projects in submissionsRoot (or only the given projects), using up
+# to jobs processes. Results are yielded as (project, success, log, timing) in
+# the sorted order of the projects, no matter which build finishes first. With
+# ordered set to False, results are yielded as soon as a build finishes, and a
+# new build is only started when the previous result has been consumed. With
+# native set, sketches are preprocessed in Python where possible.
+def buildProjects(submissionsRoot, jobs: int = 1, projects: Optional[Iterable[str]] = None,
+                  ordered: bool = True, native: bool = False) -> Iterator[Tuple[str, bool, str, dict]]:
+    projects = sorted(os.listdir(submissionsRoot) if projects is None else projects)
+    if jobs <= 1:
+        for subm in projects:
+            yield buildProjectCaptured(submissionsRoot, subm, native)
+    elif ordered:
+        with ProcessPoolExecutor(max_workers = jobs) as executor:
+            yield from executor.map(buildProjectCaptured, repeat(submissionsRoot), projects, repeat(native))
+    else:
+        with ProcessPoolExecutor(max_workers = jobs) as executor:
+            queued = iter(projects)
+            running = { executor.submit(buildProjectCaptured, submissionsRoot, subm, native) for subm in islice(queued, jobs) }
+            while len(running) > 0:
+                done, running = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    for subm in islice(queued, 1):
+                        running.add(executor.submit(buildProjectCaptured, submissionsRoot, subm, native))
+
+def main(submissionsRoot: str, jobs: int = 1, native: bool = False):
+    for subm, success, log, _ in buildProjects(submissionsRoot, jobs, native = native):
         print(f"\nBuilding {subm}")
-        if not buildProject(submissionsRoot, subm):
+        print(log, file=sys.stderr, end="")
+        if not success:
             print("Build failed, deleting project")
             shutil.rmtree(path.join(submissionsRoot, subm))
 
 if __name__ == "__main__":
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("submissions", help = "Directory containing a folder per submission")
+
+    parser.add_argument(
+        "-j", "--jobs",
+        type = int,
+        default = 1,
+        help = "Number of processing-java builds to run in parallel")
+
+    parser.add_argument(
+        "--native",
+        action = "store_true",
+        help = "Generate the Java source of sketches in Python instead of with processing-java where possible, without compiling them")
+
+    args = parser.parse_args()
+
+    main(args.submissions, args.jobs, args.native)
@@ -1,63 +1,213 @@
 import argparse
-import os
 import shutil
-import subprocess
 import sys
 import tempfile
 
+from contextlib import nullcontext, redirect_stdout
 from pathlib import Path
+from typing import TextIO
 
+from pipeline import cache, dedupe, graphmatcher, manifest, staging, streaming, trace, typegraph
+from pipeline import extract as extractor
 from pre_process import pde_to_java
 
-def main(lang: str, mode: str, criteria: str, target: str, output: str | None):
+def evictCache(projectCache: cache.ProjectCache | None, maxSize: float, maxAge: float):
+    if projectCache is not None:
+        evicted = projectCache.evict(maxSize, maxAge)
+        if evicted > 0:
+            print(f"Evicted {evicted} entries from the cache.")
+
+def main(lang: str, mode: str, criteria: str, target: str, output: str | None, jobs: int = 1,
+         cacheDir: str | None = None, cacheMaxSize: float = 1024, cacheMaxAge: float = 30,
+         stagingMode: str = "copy", extractWorkers: int = 1, extractChunkSize: int | None = None,
+         extractTimeout: float = 900, extractRetries: int = 1, stream: bool = False, streamQueueSize: int = 8,
+         nativePreprocessor: bool = False, traceFile: str | None = None, resultFormat: str = "markdown",
+         binaryTypeGraphs: bool = False, matchJobs: int | None = None, matchShards: int = 1,
+         dedupeMode: str | None = None, dedupeReport: str | None = None):
+    tracer = trace.Tracer(enabled = traceFile is not None)
+    # NDJSON results on stdout are meant for other tools, like
+    # pipeline/results.py, so everything else is printed to stderr
+    resultsFile = sys.stdout
+    quiet = resultFormat == "ndjson" and output is None
+    try:
+        with redirect_stdout(sys.stderr) if quiet else nullcontext():
+            return runPipeline(lang, mode, criteria, target, output, jobs, cacheDir, cacheMaxSize, cacheMaxAge,
+                               stagingMode, extractWorkers, extractChunkSize, extractTimeout, extractRetries,
+                               stream, streamQueueSize, nativePreprocessor, tracer, resultFormat, resultsFile,
+                               binaryTypeGraphs, matchJobs, matchShards, dedupeMode, dedupeReport)
+    finally:
+        if traceFile is not None:
+            tracer.write(traceFile)
+            tracer.printSummary()
+            print(f"Wrote trace to {traceFile}.", file=sys.stderr)
+
+def runPipeline(lang: str, mode: str, criteria: str, target: str, output: str | None, jobs: int,
+                cacheDir: str | None, cacheMaxSize: float, cacheMaxAge: float,
+                stagingMode: str, extractWorkers: int, extractChunkSize: int | None,
+                extractTimeout: float, extractRetries: int, stream: bool, streamQueueSize: int,
+                nativePreprocessor: bool, tracer: trace.Tracer, resultFormat: str, resultsFile: TextIO,
+                binaryTypeGraphs: bool, matchJobs: int | None, matchShards: int,
+                dedupeMode: str | None, dedupeReport: str | None) -> int:
+    typeGraphName = typegraph.BINARY_FILE if binaryTypeGraphs else typegraph.JSON_FILE
     with tempfile.TemporaryDirectory() as tmpdir:
         projects_dir = Path(tmpdir, "projects")
 
         print("Copying target to temporary directory.")
-        if mode == "single":
-            shutil.copytree(target, projects_dir / "single")
-        else:
-            shutil.copytree(target, projects_dir)
+        with tracer.span("stage", "stage", mode = stagingMode):
+            if mode == "single":
+                staging.stage(Path(target), projects_dir / "single", stagingMode)
+            else:
+                staging.stage(Path(target), projects_dir, stagingMode)
+
+        # Scan every project once and write its manifest, which the later
+        # stages use instead of searching the project again. The source files
+        # are only hashed when the cache or the dedupe stage needs the hashes.
+        with tracer.span("scan", "stage") as span:
+            manifests = manifest.scanProjects(projects_dir, lang, hashes = cacheDir is not None or dedupeMode is not None)
+            span["projects"] = len(manifests)
+
+        # Projects with the same sources are only assessed once, after which
+        # their results are copied to the duplicates
+        duplicates = {}
+        if dedupeMode is not None:
+            with tracer.span("dedupe", "stage", mode = dedupeMode) as span:
+                duplicates = dedupe.findDuplicates(projects_dir, manifests, dedupeMode)
+                dedupe.removeDuplicates(projects_dir, duplicates)
+                span["duplicates"] = sum(len(members) for members in duplicates.values())
+            dedupe.printReport(duplicates, len(manifests))
+            if dedupeReport is not None:
+                dedupe.writeReport(duplicates, dedupeReport)
+            for members in duplicates.values():
+                for member in members:
+                    del manifests[member]
+        projects = list(manifests)
+        projectCache = None
+        if cacheDir is not None:
+            projectCache = cache.ProjectCache(
+                Path(cacheDir),
+                cache.extractorVersion(Path(__file__).parent / "extractor", lang))
+            buildVersion = None
+            if lang == "processing":
+                buildVersion = cache.preprocessorVersion(nativePreprocessor, Path(__file__).parent / "pre_process" / "pde_preprocessor.py")
+            keys = { proj: cache.entryKey(manifests[proj]["hash"], buildVersion) for proj in projects }
+
+        # Projects with a cached typegraph skip both the build and the extractor
+        extract = list(projects)
+        if projectCache is not None:
+            with tracer.span("restore typegraphs", "stage"):
+                extract = [
+                    proj for proj in projects
+                    if not projectCache.restoreTypeGraph(keys[proj], projects_dir / proj / "source" / "graph" / typeGraphName)
+                ]
+            print(f"Using cached typegraphs for {len(projects) - len(extract)} of {len(projects)} projects.")
+
+        if stream:
+            print("Streaming projects through the pipeline.")
+            try:
+                with tracer.span("stream", "stage"):
+                    failed = streaming.streamProjects(
+                        lang, projects_dir, Path(tmpdir, "match"), criteria, output,
+                        extract, [ proj for proj in projects if proj not in extract ],
+                        projectCache, keys if projectCache is not None else None,
+                        jobs, extractWorkers, extractChunkSize, extractTimeout, extractRetries, streamQueueSize,
+                        nativePreprocessor, tracer, resultFormat, resultsFile, binaryTypeGraphs, matchJobs, duplicates)
+            except RuntimeError as err:
+                print(f"Graph matcher failed: {err}", file=sys.stderr)
+                return 1
+            evictCache(projectCache, cacheMaxSize, cacheMaxAge)
+            if mode == "single" and len(failed) > 0:
+                print("Assessing project failed", file=sys.stderr)
+                return 1
+            return 0
 
         if lang == "processing":
+            build = extract
+            if projectCache is not None:
+                build = [ proj for proj in extract if not projectCache.restoreBuild(keys[proj], projects_dir / proj / "source") ]
             print("Building Processing projects.")
-            for proj in os.listdir(projects_dir):
-                if not pde_to_java.buildProject(projects_dir, proj):
+            buildStart = trace.now()
+            for proj, success, log, timing in pde_to_java.buildProjects(projects_dir, jobs, build, native = nativePreprocessor):
+                tracer.add("build", "build", timing.pop("start"), timing.pop("end"), proj, tid = 0, success = success, **timing)
+                print(log, file=sys.stderr, end="")
+                if not success:
                     if mode == "single":
                         print("Building Processing project failed. Aborting.", file=sys.stderr)
                         return 1
                     else:
-                        print(f"Building Processing project {proj} failed. Ignoring project.", file=sys.stderr)
+                        for name in dedupe.failedNames(proj, duplicates):
+                            print(f"Building Processing project {name} failed. Ignoring project.", file=sys.stderr)
                         shutil.rmtree(projects_dir / proj)
+                        extract.remove(proj)
                         continue
-                shutil.copytree(projects_dir / proj / "build" / "source", projects_dir / proj / "source")
-
-        print("Running extractor.")
-        extractor_proc = subprocess.run(
-            ["rascal", "Processing" if lang == "processing" else "Java", "file://" + str(projects_dir)],
-            cwd=Path(__file__).parent / "extractor",
-            capture_output=True,
-            text=True)
-        print(extractor_proc.stderr, file=sys.stderr, end=None)
-        if extractor_proc.returncode != 0:
-            print("Extractor failed", file=sys.stderr)
-            print(extractor_proc.stdout, file=sys.stderr)
-            return 1
+                # The build output is not used anymore after this, so it can be
+                # moved instead of copied
+                (projects_dir / proj / "build" / "source").rename(projects_dir / proj / "source")
+                if projectCache is not None:
+                    projectCache.storeBuild(keys[proj], projects_dir / proj / "source")
+            tracer.add("build", "stage", buildStart, trace.now(), projects = len(build), jobs = jobs)
+
+        if len(extract) > 0:
+            print("Running extractor.")
+            with tracer.span("extract", "stage", projects = len(extract), workers = extractWorkers):
+                failed = extractor.extractProjects(
+                    lang, projects_dir, extract, extractWorkers, extractChunkSize, extractTimeout, extractRetries, tracer,
+                    binaryTypeGraphs)
+            for proj in failed:
+                if mode == "single":
+                    print("Extractor failed", file=sys.stderr)
+                    return 1
+                else:
+                    for name in dedupe.failedNames(proj, duplicates):
+                        print(f"Extracting project {name} failed. Ignoring project.", file=sys.stderr)
+                    shutil.rmtree(projects_dir / proj)
+                    extract.remove(proj)
+
+            if projectCache is not None:
+                for proj in extract:
+                    typeGraphFile = projects_dir / proj / "source" / "graph" / typeGraphName
+                    if typeGraphFile.is_file():
+                        projectCache.storeTypeGraph(keys[proj], typeGraphFile)
+
+        # The graph matcher reuses the cached indices of projects if they were
+        # built from the same typegraph and rebuilds them otherwise
+        if projectCache is not None:
+            for proj in projects:
+                graphDir = projects_dir / proj / "source" / "graph"
+                if graphDir.is_dir():
+                    projectCache.restoreTargetIndex(keys[proj], graphDir / graphmatcher.TARGET_INDEX_FILE)
+
+        evictCache(projectCache, cacheMaxSize, cacheMaxAge)
 
         print("Running graph matcher.")
-        gm_proc = subprocess.run(
-            ["dotnet", "run", "--project", str(Path(__file__).parent / "graphmatcher" / "src"),
-             "--criteria", criteria,
-             "--targets", str(projects_dir),
-             "run"] + ([] if output == None else ["--output", output]),
-            capture_output=True,
-            text=True)
-        print(gm_proc.stderr, file=sys.stderr, end=None)
-        print(gm_proc.stdout, end=None)
-        if gm_proc.returncode != 0:
+        gmTrace = str(Path(tmpdir, "graphmatcher-trace.json"))
+        with tracer.span("graph matcher", "stage", shards = matchShards):
+            returncode, stdout, stderr, gmTraces = graphmatcher.runSharded(
+                ["--criteria", criteria] + (["--index-cache"] if projectCache is not None else []),
+                ["--format", resultFormat] + ([] if output == None else ["--output", output]),
+                projects_dir, matchShards, Path(tmpdir),
+                gmTrace if tracer.enabled else None, matchJobs)
+        for shardTrace in gmTraces:
+            tracer.merge(shardTrace)
+        # With NDJSON, errors loading a project are written to stderr
+        stderr = "".join(dedupe.fanOutErrors(stderr.splitlines(keepends = True), duplicates))
+        print(stderr, file=sys.stderr, end=None)
+        if output is None:
+            stdout = dedupe.fanOutOutput(stdout, resultFormat, duplicates) if len(duplicates) > 0 else stdout
+        else:
+            for proj, members in duplicates.items():
+                dedupe.fanOutFiles(Path(output), resultFormat, proj, members)
+            stdout = "".join(dedupe.fanOutErrors(stdout.splitlines(keepends = True), duplicates))
+        print(stdout, end="", file=resultsFile)
+        if returncode != 0:
             print("Graph matcher failed", file=sys.stderr)
             return 1
-    
+
+        if projectCache is not None:
+            for proj in projects:
+                index = projects_dir / proj / "source" / "graph" / graphmatcher.TARGET_INDEX_FILE
+                if index.is_file():
+                    projectCache.storeTargetIndex(keys[proj], index)
+
     return 0
 
 if __name__ == "__main__":
@@ -89,6 +239,123 @@ if __name__ == "__main__":
         "-o", "--output",
         help="Directory to write output to, rather than stdout")
 
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of Processing projects to build in parallel")
+
+    parser.add_argument(
+        "--cache-dir",
+        default=str(cache.defaultCacheDir()),
+        help="Directory to cache build and extractor outputs in, defaults to ~/.cache/apollopp")
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use cached outputs and do not store new outputs in the cache")
+
+    parser.add_argument(
+        "--cache-max-size",
+        type=float,
+        default=1024,
+        help="Maximum size of the cache in MB, least recently used projects are evicted first")
+
+    parser.add_argument(
+        "--cache-max-age",
+        type=float,
+        default=30,
+        help="Evict projects from the cache that have not been used for this many days")
+
+    parser.add_argument(
+        "--staging",
+        choices=staging.STAGING_MODES,
+        default="copy",
+        help="How to stage the target: copy everything, copy only source files or hardlink only source files")
+
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        default=1,
+        help="Number of extractor processes to run in parallel")
+
+    parser.add_argument(
+        "--extract-chunk-size",
+        type=int,
+        help="Number of projects an extractor process handles before it is restarted, "
+             "defaults to all projects, up to 500, for a single worker and smaller chunks for multiple workers")
+
+    parser.add_argument(
+        "--extract-timeout",
+        type=float,
+        default=900,
+        help="Time in seconds after which extracting a single project is aborted")
+
+    parser.add_argument(
+        "--extract-retries",
+        type=int,
+        default=1,
+        help="Number of times to retry extracting a project that failed or timed out")
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Move every project to the next stage as soon as it is ready and write its results right away")
+
+    parser.add_argument(
+        "--stream-queue-size",
+        type=int,
+        default=8,
+        help="Maximum number of projects waiting between two stages when streaming")
+
+    parser.add_argument(
+        "--native-preprocessor",
+        action="store_true",
+        help="Generate the Java source of Processing projects in Python where possible, instead of with processing-java")
+
+    parser.add_argument(
+        "--format",
+        choices=["markdown", "ndjson"],
+        default="markdown",
+        help="Format of the results: markdown, or a JSON record per project, criterion and verdict")
+
+    parser.add_argument(
+        "--binary-typegraphs",
+        action="store_true",
+        help="Let the extractor write typegraphs in the compact binary format, which the graph matcher loads faster")
+
+    parser.add_argument(
+        "--match-jobs",
+        type=int,
+        help="Number of projects each graph matcher process matches in parallel, defaults to the number of processors divided by the number of shards")
+
+    parser.add_argument(
+        "--match-shards",
+        type=int,
+        default=1,
+        help="Number of graph matcher processes to split the projects over in batch mode, which are merged into a single output")
+
+    parser.add_argument(
+        "--dedupe",
+        choices=dedupe.DEDUPE_MODES,
+        help="Assess projects with the same source files only once and copy their results to the duplicates, "
+             "optionally ignoring comments and whitespace (normalized)")
+
+    parser.add_argument(
+        "--dedupe-report",
+        metavar="FILE",
+        help="Write the groups of duplicate projects to FILE as JSON")
+
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write the duration of every stage and project to FILE as Chrome trace events "
+             "and print the slowest projects at the end")
+
     args = parser.parse_args()
 
-    main(args.language, args.mode, args.criteria, args.target, args.output)
+    main(args.language, args.mode, args.criteria, args.target, args.output, args.jobs,
+         None if args.no_cache else args.cache_dir, args.cache_max_size, args.cache_max_age,
+         args.staging, args.extract_workers, args.extract_chunk_size, args.extract_timeout, args.extract_retries,
+         args.stream, args.stream_queue_size, args.native_preprocessor, args.trace, args.format,
+         args.binary_typegraphs, args.match_jobs, args.match_shards, args.dedupe, args.dedupe_report)
@@ -0,0 +1,145 @@
+import io
+import time
+import zipfile
+
+from openpyxl import Workbook
+from pathlib import Path
+from zipfile import ZipFile
+
+from benchmark import replace_pii
+from pre_process import anonymize
+
+# Replace names in text with the combined regex, checking that the output is
+# the same as when replacing them one after the other
+def replaceLikeLegacy(students, text: str) -> str:
+    replacements = anonymize.generatePiiReplacements(students)
+    replaced = anonymize.replaceAll(text, replacements)
+    assert replaced == replace_pii.legacyReplaceAll(text, replace_pii.legacyReplacements(replacements))
+    return replaced
+
+def testShortNamesNeedWordBoundaries():
+    replaced = replaceLikeLegacy([ ("Li, Han", "1234567") ], "class Handler { String s = \"Han\"; } // han_2 by LI, xli and 1234567th")
+    assert replaced.startswith("class Handler { String s = \"")
+    assert "Han\"" not in replaced
+    assert "han_2" not in replaced
+    assert "LI," not in replaced
+    assert " xli " in replaced
+    assert "1234567" not in replaced
+
+def testSkipNames():
+    replaced = replaceLikeLegacy([ ("Floor, Max", "1234567") ], "int m = max(a, floor(b)); // Max Floor, MAX_SIZE")
+    assert replaced == "int m = max(a, floor(b)); // Max Floor, MAX_SIZE"
+
+def testAccentVariantsShareAlias():
+    replacements = anonymize.generatePiiReplacements([ ("Müller, José", "1234567") ])
+    assert replacements.aliases[("Müller", False)] == replacements.aliases[("Muller", False)]
+    assert replacements.aliases[("José", True)] == replacements.aliases[("Jose", True)]
+    replaced = replaceLikeLegacy([ ("Müller, José", "1234567") ], "Müller Muller José Jose")
+    words = replaced.split(" ")
+    assert words[0] == words[1] != "Müller"
+    assert words[2] == words[3] != "José"
+
+def testIgnoresCase():
+    replacements = anonymize.generatePiiReplacements([ ("Müller, José", "1234567") ])
+    alias = replacements.aliases[("Müller", False)]
+    assert replaceLikeLegacy([ ("Müller, José", "1234567") ], "MÜLLER") != "MÜLLER"
+    assert anonymize.replaceAll("MÜLLER müller MULLER mullerClass", replacements) == f"{alias} {alias} {alias} {alias}Class"
+
+def testOverlappingLiterals():
+    replacements = anonymize.Replacements({ ("Ann", False): "A", ("Anne", True): "B", ("Annabel", False): "C" })
+    # Literals that may match anywhere are tried before bounded ones, and of
+    # those the longest wins
+    assert anonymize.replaceAll("Anne Annabel", replacements) == "Ae C"
+
+def testFindGradingSheets():
+    workbook = Workbook()
+    cells = [ ("1234567", None), ("s1234567", "Group 4"), (None, "12345678, 7654321"), (7654321, None), (None, None) ]
+    for i, (e3, e4) in enumerate(cells):
+        sheet = workbook.active if i == 0 else workbook.create_sheet()
+        sheet.title = f"Sheet {i}"
+        sheet["E3"], sheet["E4"] = e3, e4
+    index = anonymize.indexGradingSheets(workbook)
+    titles = lambda studentNr: [ sheet.title for sheet in anonymize.findGradingSheets(index, studentNr) ]
+    # Like the original check, any sheet with the number in its cells matches,
+    # also when it is part of a longer word
+    assert titles("1234567") == [ "Sheet 0", "Sheet 1", "Sheet 2" ]
+    assert titles("7654321") == [ "Sheet 2", "Sheet 3" ]
+    assert titles("Group 4") == [ "Sheet 1" ]
+    assert titles("1111111") == []
+
+def writeAttachments(zipPath: Path, count: int):
+    with ZipFile(zipPath, "w", compression = zipfile.ZIP_DEFLATED) as attachmentsZip:
+        for i in range(count):
+            submission = io.BytesIO()
+            with ZipFile(submission, "w", compression = zipfile.ZIP_DEFLATED) as submissionZip:
+                submissionZip.writestr(f"Sketch{i}/Sketch{i}.pde", f"// By Jane Doe\nvoid setup() {{ println({i}); }}\n" * 100)
+                submissionZip.writestr(f"Sketch{i}/code/lib.jar", bytes(range(256)) * 10)
+                submissionZip.writestr(f"Sketch{i}/data/image.png", b"png")
+            attachmentsZip.writestr(f"doejane_{1000 + i}_{2000 + i}_Sketch{i}.zip", submission.getvalue())
+
+# Copy the submissions like anonymize.main does, with an assessment per
+# submission written by the main process
+def copySubmissions(tmp_path: Path, replacements: anonymize.Replacements, jobs: int) -> Path:
+    outputPath = tmp_path / f"output{jobs}.zip"
+    shardDir = tmp_path / f"shards{jobs}"
+    shardDir.mkdir()
+    mainPath = outputPath if jobs <= 1 else shardDir / "main.zip"
+    copyAssessment = lambda userId, attachmentId, newId, outputZip, basePath: outputZip.writestr(basePath + "assessment.json", "[]")
+    with ZipFile(tmp_path / "submissions.zip") as attachmentsZip, \
+         ZipFile(mainPath, "x", compression = zipfile.ZIP_DEFLATED) as outputZip:
+        shardPaths = anonymize.copySubmissions(attachmentsZip, outputZip, copyAssessment, replacements, jobs = jobs, seed = 1, shardDir = str(shardDir))
+    if jobs > 1:
+        anonymize.mergeZips(str(outputPath), [ str(mainPath) ] + shardPaths)
+    return outputPath
+
+def testParallelCopyMergesShards(tmp_path):
+    writeAttachments(tmp_path / "submissions.zip", 10)
+    replacements = anonymize.generatePiiReplacements([ ("Doe, Jane", "s1234567") ])
+    with ZipFile(copySubmissions(tmp_path, replacements, 1)) as sequential, \
+         ZipFile(copySubmissions(tmp_path, replacements, 3)) as parallel:
+        assert parallel.testzip() is None
+        assert sorted(parallel.namelist()) == sorted(sequential.namelist())
+        assert len(parallel.namelist()) == 30
+        for info in parallel.infolist():
+            assert info.compress_type == zipfile.ZIP_DEFLATED
+            assert parallel.read(info) == sequential.read(info.filename)
+        assert b"Jane" not in parallel.read(parallel.namelist()[-1])
+
+    # The compressed data of the shards is copied as it is
+    shards = [ ZipFile(shard) for shard in sorted((tmp_path / "shards3").glob("shard*.zip")) ]
+    with ZipFile(tmp_path / "output3.zip") as parallel:
+        for shard in shards:
+            for info in shard.infolist():
+                assert parallel.getinfo(info.filename).compress_size == info.compress_size
+                assert parallel.getinfo(info.filename).CRC == info.CRC
+            shard.close()
+
+def testParallelCopyWithoutSubmissions(tmp_path):
+    writeAttachments(tmp_path / "submissions.zip", 0)
+    with ZipFile(copySubmissions(tmp_path, anonymize.generatePiiReplacements([]), 3)) as parallel:
+        assert parallel.namelist() == []
+
+def testMergeZipsWritesZip64Records(tmp_path, monkeypatch):
+    # Lower the limits, so the ZIP64 records are needed for small files
+    monkeypatch.setattr(anonymize, "ZIP64_LIMIT", 10)
+    monkeypatch.setattr(anonymize, "ZIP_FILECOUNT_LIMIT", 2)
+    for name in [ "a", "b" ]:
+        with ZipFile(tmp_path / f"{name}.zip", "w", compression = zipfile.ZIP_DEFLATED) as zip:
+            zip.writestr(f"{name}/small.txt", "x")
+            zip.writestr(f"{name}/grüße.txt", "ü" * 1000)
+    anonymize.mergeZips(str(tmp_path / "merged.zip"), [ str(tmp_path / "a.zip"), str(tmp_path / "b.zip") ])
+    with ZipFile(tmp_path / "merged.zip") as merged:
+        assert merged.testzip() is None
+        assert merged.namelist() == [ "a/small.txt", "a/grüße.txt", "b/small.txt", "b/grüße.txt" ]
+        assert merged.read("b/grüße.txt") == ("ü" * 1000).encode("utf-8")
+        assert merged.getinfo("b/grüße.txt").header_offset > 10
+
+def testWriteEntryUsesCurrentTime():
+    output = io.BytesIO()
+    with ZipFile(output, "w", compression = zipfile.ZIP_DEFLATED) as outputZip:
+        anonymize.writeEntry(outputZip, "Sketch/Sketch.pde", io.BytesIO(b"void setup() {}"), 15)
+    with ZipFile(output) as outputZip:
+        info = outputZip.getinfo("Sketch/Sketch.pde")
+        assert info.date_time[0] == time.localtime().tm_year
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert outputZip.read(info) == b"void setup() {}"
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+import run
+from pipeline import cache
+
+def writeFiles(root: Path, files: dict):
+    for name, content in files.items():
+        (root / name).parent.mkdir(parents = True, exist_ok = True)
+        (root / name).write_text(content)
+
+def testHashFilesUsesPathAndContent(tmp_path):
+    writeFiles(tmp_path / "a", { "A.java": "class A {}" })
+    writeFiles(tmp_path / "b", { "A.java": "class A { }" })
+    writeFiles(tmp_path / "c", { "B.java": "class A {}" })
+    hashes = []
+    for name in [ "a", "b", "c" ]:
+        hash = hashlib.sha256()
+        cache.hashFiles(hash, tmp_path / name, list((tmp_path / name).iterdir()))
+        hashes.append(hash.hexdigest())
+    assert len(set(hashes)) == 3
+
+def testBuildMissThenHit(tmp_path):
+    projectCache = cache.ProjectCache(tmp_path / "cache", "v1")
+    writeFiles(tmp_path / "build", { "Sketch.java": "class Sketch {}" })
+    assert not projectCache.restoreBuild("ab12", tmp_path / "restored")
+
+    projectCache.storeBuild("ab12", tmp_path / "build")
+    assert projectCache.restoreBuild("ab12", tmp_path / "restored")
+    assert (tmp_path / "restored" / "Sketch.java").read_text() == "class Sketch {}"
+    assert projectCache.entryDir("ab12") == tmp_path / "cache" / "ab" / "ab12"
+
+def testTypeGraphPerExtractorVersion(tmp_path):
+    typeGraph = tmp_path / "typegraph.json"
+    typeGraph.write_text("[]")
+    cache.ProjectCache(tmp_path / "cache", "v1").storeTypeGraph("ab12", typeGraph)
+
+    newCache = cache.ProjectCache(tmp_path / "cache", "v2")
+    assert not newCache.restoreTypeGraph("ab12", tmp_path / "restored" / "typegraph.json")
+    newCache.storeTypeGraph("ab12", typeGraph)
+    assert newCache.restoreTypeGraph("ab12", tmp_path / "restored" / "typegraph.json")
+    # The typegraph of the older extractor is removed
+    assert [ version.name for version in (tmp_path / "cache" / "ab" / "ab12" / "typegraph").iterdir() ] == [ "v2" ]
+
+def testEntryKeySeparatesPreprocessors(tmp_path):
+    (tmp_path / "pde_preprocessor.py").write_text("# version 1")
+    processingJava = cache.preprocessorVersion(False, tmp_path / "pde_preprocessor.py")
+    native = cache.preprocessorVersion(True, tmp_path / "pde_preprocessor.py")
+    (tmp_path / "pde_preprocessor.py").write_text("# version 2")
+    nativeChanged = cache.preprocessorVersion(True, tmp_path / "pde_preprocessor.py")
+
+    keys = { cache.entryKey("ab12"), cache.entryKey("ab12", processingJava), cache.entryKey("ab12", native), cache.entryKey("ab12", nativeChanged) }
+    assert len(keys) == 4
+    assert cache.entryKey("ab12") == "ab12"
+
+def storeEntry(projectCache: cache.ProjectCache, key: str, size: int, lastUsed: float):
+    (projectCache.cacheDir / "src").mkdir(exist_ok = True)
+    (projectCache.cacheDir / "src" / key).write_bytes(b"x" * size)
+    projectCache.storeTypeGraph(key, projectCache.cacheDir / "src" / key)
+    os.utime(projectCache.entryDir(key), (lastUsed, lastUsed))
+
+def testEvictOldEntries(tmp_path):
+    projectCache = cache.ProjectCache(tmp_path / "cache", "v1")
+    storeEntry(projectCache, "aa01", 10, time.time() - 40 * 24 * 60 * 60)
+    storeEntry(projectCache, "bb01", 10, time.time())
+
+    assert projectCache.evict(maxSizeMb = 1024, maxAgeDays = 30) == 1
+    assert not projectCache.entryDir("aa01").exists()
+    # Empty prefix folders are removed as well
+    assert not (tmp_path / "cache" / "aa").exists()
+    assert projectCache.entryDir("bb01").exists()
+
+def testEvictLeastRecentlyUsedFirst(tmp_path):
+    projectCache = cache.ProjectCache(tmp_path / "cache", "v1")
+    megabyte = 1024 * 1024
+    storeEntry(projectCache, "aa01", megabyte, time.time() - 30)
+    storeEntry(projectCache, "bb01", megabyte, time.time() - 20)
+    storeEntry(projectCache, "cc01", megabyte, time.time() - 10)
+
+    assert projectCache.evict(maxSizeMb = 2, maxAgeDays = 30) == 1
+    assert not projectCache.entryDir("aa01").exists()
+    assert projectCache.entryDir("bb01").exists() and projectCache.entryDir("cc01").exists()
+
+# Extractor that writes an empty typegraph for every project and records the
+# projects it was started for in the file in FAKE_RASCAL_LOG
+FAKE_RASCAL = """\
+import os, sys
+args = [ arg for arg in sys.argv[2:] if arg != "--binary" ]
+projectsDir, projects = args[0][len("file://"):], args[1:]
+with open(os.environ["FAKE_RASCAL_LOG"], "a") as log:
+    for proj in projects:
+        log.write(proj + "\\n")
+        # The pool stops the extractor as soon as the last project is done
+        log.flush()
+        os.makedirs(os.path.join(projectsDir, proj, "source", "graph"), exist_ok = True)
+        with open(os.path.join(projectsDir, proj, "source", "graph", "typegraph.json"), "w") as f:
+            f.write("[]")
+        print("Done: " + proj, flush = True)
+"""
+
+# Graph matcher that prints a header for every target
+FAKE_GRAPHMATCHER = """\
+import os, sys
+targets = sys.argv[sys.argv.index("--targets") + 1]
+for target in sorted(os.listdir(targets)):
+    print("\\n# " + target)
+"""
+
+def installFakeTools(tmp_path: Path, monkeypatch) -> Path:
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    for name, script in [ ("rascal", FAKE_RASCAL), ("graphmatcher", FAKE_GRAPHMATCHER) ]:
+        (bin / name).write_text(f"#!{sys.executable}\n" + script)
+        (bin / name).chmod(0o755)
+    log = tmp_path / "rascal.log"
+    log.touch()
+    monkeypatch.setenv("PATH", f"{bin}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("APOLLOPP_GRAPHMATCHER", str(bin / "graphmatcher"))
+    monkeypatch.setenv("FAKE_RASCAL_LOG", str(log))
+    return log
+
+def runJava(target: Path, cacheDir: Path | None) -> int:
+    return run.main("java", "batch", "criteria", str(target), None, cacheDir = None if cacheDir is None else str(cacheDir))
+
+def testRunRestoresCachedTypeGraphs(tmp_path, monkeypatch):
+    log = installFakeTools(tmp_path, monkeypatch)
+    writeFiles(tmp_path / "target", { "p1/A.java": "class A {}", "p2/B.java": "class B {}" })
+
+    assert runJava(tmp_path / "target", tmp_path / "cache") == 0
+    assert log.read_text().split() == [ "p1", "p2" ]
+
+    # Only the changed project is extracted again
+    writeFiles(tmp_path / "target", { "p2/B.java": "class B { int x; }" })
+    assert runJava(tmp_path / "target", tmp_path / "cache") == 0
+    assert log.read_text().split() == [ "p1", "p2", "p2" ]
+
+def testNoCacheBypassesCache(tmp_path, monkeypatch):
+    log = installFakeTools(tmp_path, monkeypatch)
+    writeFiles(tmp_path / "target", { "p1/A.java": "class A {}" })
+    assert runJava(tmp_path / "target", tmp_path / "cache") == 0
+    entries = sorted(path for path in (tmp_path / "cache").rglob("*"))
+
+    # Without a cache directory, as with --no-cache, the cached typegraph is
+    # not used and nothing is stored
+    writeFiles(tmp_path / "target", { "p2/B.java": "class B {}" })
+    assert runJava(tmp_path / "target", None) == 0
+    assert log.read_text().split() == [ "p1", "p1", "p2" ]
+    assert sorted(path for path in (tmp_path / "cache").rglob("*")) == entries
+
+def testNoCacheOption(tmp_path, monkeypatch):
+    installFakeTools(tmp_path, monkeypatch)
+    writeFiles(tmp_path / "target", { "p1/A.java": "class A {}" })
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    command = [ sys.executable, "run.py", "-l", "java", "-m", "b", "-c", "criteria", "-t", str(tmp_path / "target") ]
+    root = Path(run.__file__).parent
+
+    subprocess.run(command + [ "--no-cache" ], cwd = root, check = True, capture_output = True)
+    assert not (tmp_path / "xdg").exists()
+    subprocess.run(command, cwd = root, check = True, capture_output = True)
+    assert (tmp_path / "xdg" / "apollopp").is_dir()
@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+
+from pathlib import Path
+
+from pre_process import copy_assessed
+
+ASSESSED = [ { "score": 8, "rubrics": [ { "points": 8 } ] } ]
+
+def writeSubmission(root: Path, subm: str, assessment: list, source: str = "class Main {}"):
+    (root / subm / "build" / "source").mkdir(parents = True, exist_ok = True)
+    (root / subm / "assessment.json").write_text(json.dumps(assessment))
+    (root / subm / "build" / "source" / "Main.java").write_text(source)
+
+def sync(root: Path, capsys, **kwargs) -> str:
+    copy_assessed.main(str(root / "submissions"), str(root / "assessed"), jobs = 2, sync = True, **kwargs)
+    return capsys.readouterr().out.splitlines()[-1]
+
+def testSync(tmp_path, capsys):
+    submissions = tmp_path / "submissions"
+    for subm in [ "001", "002", "003", "004" ]:
+        writeSubmission(submissions, subm, ASSESSED)
+    writeSubmission(submissions, "005", [])
+    (submissions / "006").mkdir()
+    assessed = tmp_path / "assessed"
+    assert sync(tmp_path, capsys) == "Copied 4, unchanged 0, removed 0, not assessed 1, without build 1."
+    assert sorted(os.listdir(assessed)) == [ ".copy_assessed.json", "001", "002", "003", "004" ]
+    assert (assessed / "001" / "source" / "Main.java").read_text() == "class Main {}"
+    assert json.loads((assessed / "001" / "assessment.json").read_text()) == ASSESSED
+
+    # Unchanged submissions are not copied again
+    (assessed / "001" / "source" / "marker").write_text("")
+    assert sync(tmp_path, capsys) == "Copied 0, unchanged 5, removed 0, not assessed 0, without build 1."
+    assert (assessed / "001" / "source" / "marker").exists()
+
+    # A changed source, a submission that is no longer assessed, a removed one
+    # and one that is assessed now
+    writeSubmission(submissions, "001", ASSESSED, "class Main { int x; }")
+    writeSubmission(submissions, "002", [])
+    shutil.rmtree(submissions / "003")
+    writeSubmission(submissions, "005", ASSESSED)
+    assert sync(tmp_path, capsys) == "Copied 2, unchanged 1, removed 2, not assessed 1, without build 1."
+    assert sorted(os.listdir(assessed)) == [ ".copy_assessed.json", "001", "004", "005" ]
+    assert (assessed / "001" / "source" / "Main.java").read_text() == "class Main { int x; }"
+    assert not (assessed / "001" / "source" / "marker").exists()
+    state = json.loads((assessed / ".copy_assessed.json").read_text())
+    assert sorted(state) == [ "001", "002", "004", "005" ]
+    assert not state["002"]["assessed"]
+
+    # A submission that was removed from the destination is copied again
+    shutil.rmtree(assessed / "004")
+    assert sync(tmp_path, capsys) == "Copied 1, unchanged 3, removed 0, not assessed 0, without build 1."
+    assert (assessed / "004" / "source" / "Main.java").exists()
+
+def testSyncChecksum(tmp_path, capsys):
+    submissions = tmp_path / "submissions"
+    writeSubmission(submissions, "001", ASSESSED, "class A {}")
+    sync(tmp_path, capsys)
+
+    # The same size and modification time only hide a change without checksums
+    source = submissions / "001" / "build" / "source" / "Main.java"
+    stat = source.stat()
+    source.write_text("class B {}")
+    os.utime(source, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+    assert sync(tmp_path, capsys).startswith("Copied 0, unchanged 1")
+    assert sync(tmp_path, capsys, checksum = True).startswith("Copied 1, unchanged 0")
+    assert (tmp_path / "assessed" / "001" / "source" / "Main.java").read_text() == "class B {}"
+
+def testLink(tmp_path, capsys):
+    submissions = tmp_path / "submissions"
+    writeSubmission(submissions, "001", ASSESSED)
+    copy_assessed.main(str(submissions), str(tmp_path / "assessed"), link = True)
+    assert (tmp_path / "assessed" / "001" / "source" / "Main.java").samefile(submissions / "001" / "build" / "source" / "Main.java")
+    assert (tmp_path / "assessed" / "001" / "assessment.json").samefile(submissions / "001" / "assessment.json")
+
+def testLinkFallsBackToCopy(tmp_path, capsys, monkeypatch):
+    def crossDevice(src, dest):
+        raise OSError(18, "Invalid cross-device link")
+    monkeypatch.setattr(os, "link", crossDevice)
+    submissions = tmp_path / "submissions"
+    writeSubmission(submissions, "001", ASSESSED)
+    copy_assessed.main(str(submissions), str(tmp_path / "assessed"), link = True)
+    copied = tmp_path / "assessed" / "001" / "source" / "Main.java"
+    assert copied.read_text() == "class Main {}"
+    assert not copied.samefile(submissions / "001" / "build" / "source" / "Main.java")
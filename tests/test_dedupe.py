@@ -0,0 +1,70 @@
+import json
+
+from pathlib import Path
+
+from pipeline import dedupe, manifest
+
+def writeFiles(root: Path, files: dict):
+    for name, content in files.items():
+        (root / name).parent.mkdir(parents = True, exist_ok = True)
+        (root / name).write_text(content)
+
+def testNormalizeSource():
+    source = 'int x = a - -b; // comment\n/* block */ String s = "a  // b";\nchar c = \'/\';'
+    assert dedupe.normalizeSource(source) == 'int x=a- -b;String s="a  // b";char c=\'/\';'
+
+def testFindDuplicates(tmp_path):
+    writeFiles(tmp_path, {
+        "p1/src/A.java": "class A { int x; }",
+        "p2/src/A.java": "class A { int x; }",
+        "p3/src/A.java": "// Copied\nclass A {\n    int x;\n}",
+        "p4/src/A.java": "class A { int y; }",
+    })
+    manifests = { proj: manifest.scanProject(tmp_path / proj, "java") for proj in [ "p1", "p2", "p3", "p4" ] }
+    assert dedupe.findDuplicates(tmp_path, manifests, "exact") == { "p1": [ "p2" ] }
+    assert dedupe.findDuplicates(tmp_path, manifests, "normalized") == { "p1": [ "p2", "p3" ] }
+
+def testSketchInProjectRootIsNotADuplicate(tmp_path):
+    writeFiles(tmp_path, { "p1/Sketch.pde": "void setup() {}", "p2/Sketch.pde": "void setup() {}" })
+    manifests = { proj: manifest.scanProject(tmp_path / proj, "processing") for proj in [ "p1", "p2" ] }
+    assert dedupe.findDuplicates(tmp_path, manifests) == {}
+
+def testFanOutMarkdown():
+    output = "Error loading target p0: empty graph\n\n# p1\n- nr_classes\n  positive: 1\n\n# p3\n- nr_classes\n  positive: 0\n"
+    assert dedupe.fanOutOutput(output, "markdown", { "p1": [ "p2", "p4" ] }) == (
+        "Error loading target p0: empty graph\n"
+        "\n# p1\n- nr_classes\n  positive: 1\n"
+        "\n# p2\n- nr_classes\n  positive: 1\n"
+        "\n# p3\n- nr_classes\n  positive: 0\n"
+        "\n# p4\n- nr_classes\n  positive: 1\n")
+
+def testFanOutNdjson():
+    output = '{"target":"p1","criterion":"nr_classes","verdict":"positive","count":1}\n'
+    fannedOut = dedupe.fanOutOutput(output, "ndjson", { "p1": [ "p2" ] })
+    records = [ json.loads(line) for line in fannedOut.splitlines() ]
+    assert [ record["target"] for record in records ] == [ "p1", "p2" ]
+    assert records[1] == { "target": "p2", "criterion": "nr_classes", "verdict": "positive", "count": 1 }
+
+def testFanOutFiles(tmp_path):
+    (tmp_path / "p1.ndjson").write_text('{"target":"p1","count":1}\n')
+    (tmp_path / "p1.md").write_text("- nr_classes\n  positive: 1\n")
+    dedupe.fanOutFiles(tmp_path, "ndjson", "p1", [ "p2" ])
+    dedupe.fanOutFiles(tmp_path, "markdown", "p1", [ "p2" ])
+    assert json.loads((tmp_path / "p2.ndjson").read_text()) == { "target": "p2", "count": 1 }
+    assert (tmp_path / "p2.md").read_text() == "- nr_classes\n  positive: 1\n"
+
+def testRetargetRecord():
+    assert dedupe.retargetRecord('{"target": "p1", "criterion": "a\\u00e9", "count": 1}\n', "p2") == \
+        '{"target":"p2","criterion":"a\\u00e9","count":1}\n'
+    assert dedupe.retargetRecord('{ "count" : 1, "target" : "p1" }', "p2") == '{"count":1,"target":"p2"}'
+    assert dedupe.retargetRecord("Error loading target p1: empty graph\n", "p2") == "Error loading target p1: empty graph\n"
+
+def testFailuresAreReportedForDuplicates():
+    assert dedupe.failedNames("p1", { "p1": [ "p2", "p3" ] }) == [ "p1", "p2 (duplicate of p1)", "p3 (duplicate of p1)" ]
+    assert dedupe.failedNames("p4", { "p1": [ "p2" ] }) == [ "p4" ]
+    assert dedupe.failedNames("p1", None) == [ "p1" ]
+
+    output = "Error loading target p1: empty graph\n\n# p3\n- nr_classes\n  positive: 0\n"
+    assert dedupe.fanOutOutput(output, "markdown", { "p1": [ "p2" ] }) == (
+        "Error loading target p1: empty graph\nError loading target p2: empty graph\n"
+        "\n# p3\n- nr_classes\n  positive: 0\n")
@@ -0,0 +1,59 @@
+import os
+import time
+
+from pathlib import Path
+
+from pipeline import extract
+
+# A rascal command that records its arguments, reports every project as done
+# and hangs on projects named hang in a child process, like the JVM started by
+# the real wrapper
+RASCAL = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+shift 2
+for proj in "$@"; do
+    if [ "$proj" = hang ]; then
+        sh -c 'echo $$ > "$0/child"; exec sleep 60' "$(dirname "$0")" &
+        wait
+    fi
+    echo "Done: $proj"
+done
+"""
+
+def fakeRascal(tmp_path: Path, monkeypatch) -> Path:
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    (bin / "rascal").write_text(RASCAL)
+    (bin / "rascal").chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin) + os.pathsep + os.environ["PATH"])
+    return bin
+
+def isRunning(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Killed processes may linger as zombies until they are reaped
+            return f.read().split(") ")[-1][0] != "Z"
+    except FileNotFoundError:
+        return False
+
+def testRunCapsChunkSize(tmp_path, monkeypatch):
+    bin = fakeRascal(tmp_path, monkeypatch)
+    monkeypatch.setattr(extract, "MAX_CHUNK_SIZE", 2)
+    projects = [ f"p{i}" for i in range(5) ]
+    results, _ = extract.ExtractorPool("java", tmp_path, workers = 1).run(projects)
+    assert results == { proj: True for proj in projects }
+    calls = [ line.split()[2:] for line in (bin / "calls").read_text().splitlines() ]
+    assert calls == [ [ "p0", "p1" ], [ "p2", "p3" ], [ "p4" ] ]
+
+def testTimeoutKillsProcessGroup(tmp_path, monkeypatch):
+    bin = fakeRascal(tmp_path, monkeypatch)
+    start = time.monotonic()
+    results, logs = extract.ExtractorPool("java", tmp_path, timeout = 1, retries = 0).run([ "p0", "hang", "p1" ])
+    assert time.monotonic() - start < 30
+    assert results == { "p0": True, "hang": False, "p1": True }
+    assert "timed out" in logs["hang"][0]
+    child = int((bin / "child").read_text())
+    deadline = time.monotonic() + 5
+    while isRunning(child) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not isRunning(child)
@@ -0,0 +1,31 @@
+import pytest
+
+from pipeline.graphmatcher import GraphmatcherServer
+
+# A graph matcher in serve mode that answers one request, reports an error for
+# the second and exits on the third
+SERVER = """#!/bin/sh
+echo ">>> ready"
+read request
+echo "# $request"
+echo ">>> done"
+read request
+echo ">>> error: cannot load $request"
+read request
+exit 3
+"""
+
+def testServerErrors(tmp_path, monkeypatch):
+    (tmp_path / "graphmatcher").write_text(SERVER)
+    (tmp_path / "graphmatcher").chmod(0o755)
+    monkeypatch.setenv("APOLLOPP_GRAPHMATCHER", str(tmp_path / "graphmatcher"))
+    with GraphmatcherServer("criteria") as server:
+        assert server.assess(tmp_path / "p1") == [ f"# {tmp_path / 'p1'}\n" ]
+        with pytest.raises(RuntimeError, match = "cannot load"):
+            server.assess(tmp_path / "p2")
+        assert server.proc.poll() is None
+        with pytest.raises(RuntimeError, match = "exited with code 3"):
+            server.assess(tmp_path / "p3")
+        assert server.proc.poll() == 3
+        with pytest.raises(RuntimeError, match = "exited with code 3"):
+            server.assess(tmp_path / "p4")
@@ -0,0 +1,50 @@
+import json
+
+from pathlib import Path
+
+from pipeline import manifest
+
+def writeFiles(root: Path, files: dict):
+    for name, content in files.items():
+        (root / name).parent.mkdir(parents = True, exist_ok = True)
+        (root / name).write_text(content)
+
+def testScanProcessingProject(tmp_path):
+    writeFiles(tmp_path / "proj", {
+        "submission/Game/Game.pde": "void setup() {}",
+        "submission/Game/Player.pde": "class Player {}",
+        "submission/Game/code/lib.jar": "jar",
+        "submission/Game/data/sprite.png": "png",
+    })
+    scanned = manifest.scanProject(tmp_path / "proj", "processing")
+    assert scanned["pdeRoot"] == "submission/Game"
+    assert scanned["mainPde"] == "Game.pde"
+    assert [ source["path"] for source in scanned["sources"] ] == [
+        "submission/Game/Game.pde", "submission/Game/Player.pde", "submission/Game/code/lib.jar" ]
+    assert scanned["jars"] == [ "submission/Game/code/lib.jar" ]
+    assert len(scanned["hash"]) == 64
+
+def testHashesOnlyDependOnSources(tmp_path):
+    writeFiles(tmp_path / "a", { "src/A.java": "class A {}", "notes.txt": "a" })
+    writeFiles(tmp_path / "b", { "src/A.java": "class A {}", "notes.txt": "b" })
+    writeFiles(tmp_path / "c", { "src/A.java": "class A { }" })
+    a, b, c = [ manifest.scanProject(tmp_path / name, "java")["hash"] for name in [ "a", "b", "c" ] ]
+    assert a == b
+    assert a != c
+
+def testScanWithoutHashes(tmp_path):
+    writeFiles(tmp_path / "proj", { "A.java": "class A {}" })
+    scanned = manifest.scanProject(tmp_path / "proj", "java", hashes = False)
+    assert "hash" not in scanned
+    assert "sha256" not in scanned["sources"][0]
+
+def testScanProjectsWritesClassPathForJava(tmp_path):
+    writeFiles(tmp_path / "java" / "p1", { "A.java": "class A {}", "lib/b.jar": "jar" })
+    writeFiles(tmp_path / "processing" / "p1", { "p1.pde": "void setup() {}" })
+    manifests = manifest.scanProjects(tmp_path / "java", "java")
+    manifest.scanProjects(tmp_path / "processing", "processing")
+
+    assert json.loads((tmp_path / "java" / "p1" / manifest.MANIFEST_FILE).read_text()) == manifests["p1"]
+    assert json.loads((tmp_path / "java" / "p1" / manifest.CLASSPATH_FILE).read_text()) == [ "lib/b.jar" ]
+    assert (tmp_path / "processing" / "p1" / manifest.MANIFEST_FILE).is_file()
+    assert not (tmp_path / "processing" / "p1" / manifest.CLASSPATH_FILE).exists()
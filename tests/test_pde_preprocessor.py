@@ -0,0 +1,19 @@
+import pytest
+
+from benchmark import pde_preprocessor as benchmark
+from pre_process import pde_preprocessor
+
+# The native output must be the same as that of processing-java, saved with
+# `python benchmark/pde_preprocessor.py --save-expected`, apart from comments,
+# whitespace and the order of imports
+@pytest.mark.parametrize("name", [ "Balls", "Flocking", "Inventory" ])
+def testSameAsProcessingJava(tmp_path, name):
+    expectedDir = benchmark.EXPECTED_DIR / name
+    if not expectedDir.is_dir():
+        pytest.skip(f"no output of processing-java for {name} in {expectedDir}")
+    pde_preprocessor.preprocessSketch(str(benchmark.CORPUS_DIR / name), str(tmp_path / name))
+    assert benchmark.compareSources(expectedDir, tmp_path / name / "source") is None
+
+def testStaticModeIsNotSupported(tmp_path):
+    with pytest.raises(pde_preprocessor.UnsupportedSketch):
+        pde_preprocessor.preprocessSketch(str(benchmark.CORPUS_DIR / "StaticMode"), str(tmp_path / "StaticMode"))
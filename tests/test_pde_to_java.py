@@ -0,0 +1,30 @@
+import os
+
+from pre_process import pde_to_java
+
+# A processing-java command that allocates the number of MB in FAKE_MB
+PROCESSING_JAVA = """#!/usr/bin/env python3
+import os
+data = b"x" * (int(os.environ["FAKE_MB"]) << 20)
+"""
+
+def testBuildMeasuresProcessingJava(tmp_path, monkeypatch):
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    (bin / "processing-java").write_text(PROCESSING_JAVA)
+    (bin / "processing-java").chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin) + os.pathsep + os.environ["PATH"])
+    for proj in [ "large", "small" ]:
+        (tmp_path / "projects" / proj / "Sketch").mkdir(parents = True)
+        (tmp_path / "projects" / proj / "Sketch" / "Sketch.pde").write_text("void setup() {}")
+
+    # The peak is measured per build, not over all builds of the process
+    monkeypatch.setenv("FAKE_MB", "200")
+    _, success, _, large = pde_to_java.buildProjectCaptured(str(tmp_path / "projects"), "large")
+    assert success
+    monkeypatch.setenv("FAKE_MB", "1")
+    _, success, _, small = pde_to_java.buildProjectCaptured(str(tmp_path / "projects"), "small")
+    assert success
+    assert large["childMaxRssMB"] > 200
+    assert small["childMaxRssMB"] < 100
+    assert large["start"] <= large["end"] <= small["start"] <= small["end"]
@@ -0,0 +1,29 @@
+import json
+
+from pipeline import results
+
+def record(target: str, verdict: str, count: int, capped: bool = False) -> str:
+    fields = { "target": target, "criterion": "nr_classes", "verdict": verdict, "count": count }
+    if capped:
+        fields["capped"] = True
+    return json.dumps(fields, separators = (",", ":")) + "\n"
+
+def testReadRecordsFromFilesAndDirectories(tmp_path):
+    (tmp_path / "all.ndjson").write_text("Copying target to temporary directory.\n" + record("p1", "positive", 2))
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "p2.ndjson").write_text(record("p2", "positive", 0))
+    (tmp_path / "out" / "p3.ndjson").write_text(record("p3", "positive", 1))
+    (tmp_path / "out" / "p3.md").write_text("# p3\n")
+    targets = [ r["target"] for r in results.readRecords([ str(tmp_path / "all.ndjson"), str(tmp_path / "out") ]) ]
+    assert targets == [ "p1", "p2", "p3" ]
+
+def testAggregate():
+    lines = [
+        record("p1", "positive", 2), record("p1", "negative", 0),
+        record("p2", "positive", 0), record("p2", "negative", 5, capped = True),
+    ]
+    stats = results.aggregate(json.loads(line) for line in lines)
+    assert stats["nr_classes"]["positive"].toDict() == {
+        "targets": 2, "matched": 1, "mappings": 2, "average": 1.0, "max": 2, "capped": 0 }
+    assert stats["nr_classes"]["negative"].toDict() == {
+        "targets": 2, "matched": 1, "mappings": 5, "average": 2.5, "max": 5, "capped": 1 }
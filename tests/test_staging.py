@@ -0,0 +1,56 @@
+import os
+import shutil
+
+from pathlib import Path
+
+from pipeline import staging
+
+def writeProject(root: Path):
+    for name in [ "Sketch/Sketch.pde", "Sketch/Ball.java", "Sketch/code/lib.jar", "Sketch/data/ball.png",
+                  "Sketch/Sketch.class", "README.md", ".git/config.java", "__MACOSX/Sketch/._Sketch.pde" ]:
+        (root / name).parent.mkdir(parents = True, exist_ok = True)
+        (root / name).write_text(name)
+
+def stagedFiles(root: Path):
+    return sorted(path.relative_to(root).as_posix() for path in root.rglob("*") if not path.is_dir())
+
+def testStageSourcesCopiesOnlySources(tmp_path):
+    writeProject(tmp_path / "target")
+    staging.stage(tmp_path / "target", tmp_path / "staged", "sources")
+    assert stagedFiles(tmp_path / "staged") == [ "Sketch/Ball.java", "Sketch/Sketch.pde", "Sketch/code/lib.jar" ]
+    assert not any(path.is_symlink() for path in (tmp_path / "staged").rglob("*"))
+
+def testStageCopyCopiesEverything(tmp_path):
+    writeProject(tmp_path / "target")
+    staging.stage(tmp_path / "target", tmp_path / "staged", "copy")
+    assert stagedFiles(tmp_path / "staged") == stagedFiles(tmp_path / "target")
+
+def testStageLinkUsesHardlinks(tmp_path):
+    writeProject(tmp_path / "target")
+    staging.stage(tmp_path / "target", tmp_path / "staged", "link")
+    assert stagedFiles(tmp_path / "staged") == [ "Sketch/Ball.java", "Sketch/Sketch.pde", "Sketch/code/lib.jar" ]
+    assert (tmp_path / "staged" / "Sketch" / "Sketch.pde").samefile(tmp_path / "target" / "Sketch" / "Sketch.pde")
+    assert not (tmp_path / "staged" / "Sketch" / "Sketch.pde").is_symlink()
+
+def testStageLinkFallsBackToSymlinks(tmp_path, monkeypatch):
+    def crossDevice(src, dest):
+        raise OSError(18, "Invalid cross-device link")
+    monkeypatch.setattr(os, "link", crossDevice)
+    writeProject(tmp_path / "target")
+    before = { path: path.read_text() for path in (tmp_path / "target").rglob("*") if path.is_file() }
+
+    # Symlinks are absolute, so they also resolve from another working directory
+    monkeypatch.chdir(tmp_path)
+    staging.stage(Path("target"), Path("staged"), "link")
+    monkeypatch.chdir("/")
+    staged = tmp_path / "staged" / "Sketch" / "Sketch.pde"
+    assert staged.is_symlink()
+    assert Path(os.readlink(staged)).is_absolute()
+    assert staged.read_text() == "Sketch/Sketch.pde"
+
+    # Removing the staged files, like run.py does with its temporary directory,
+    # leaves the originals untouched
+    shutil.rmtree(tmp_path / "staged")
+    after = { path: path.read_text() for path in (tmp_path / "target").rglob("*") if path.is_file() }
+    assert after == before
+    assert not any(path.is_symlink() for path in (tmp_path / "target").rglob("*"))
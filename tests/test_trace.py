@@ -0,0 +1,39 @@
+import json
+
+from pipeline import trace
+
+def testDisabledTracerRecordsNothing():
+    tracer = trace.Tracer(enabled = False)
+    with tracer.span("stage", "stage") as args:
+        args["projects"] = 1
+    tracer.add("build", "build", 0, 10, "p1")
+    assert tracer.projectTotals() == {}
+
+def testSpansAndTotals():
+    tracer = trace.Tracer()
+    tracer.add("build", "build", 0, 2_000_000, "p1")
+    tracer.add("extract", "extract", 2_000_000, 3_000_000, "p1")
+    tracer.add("extract", "extract", 2_000_000, 2_500_000, "p2")
+    with tracer.span("stage", "stage", projects = 2) as args:
+        args["failed"] = 0
+
+    assert tracer.projectTotals() == { "p1": { "build": 2.0, "extract": 1.0 }, "p2": { "extract": 0.5 } }
+    stage, = [ event for event in tracer.events if event["name"] == "stage" ]
+    assert stage["ph"] == "X"
+    assert stage["args"]["projects"] == 2 and stage["args"]["failed"] == 0
+    assert "childCpu" in stage["args"]
+
+def testMergeGraphmatcherTrace(tmp_path):
+    (tmp_path / "graphmatcher.json").write_text(json.dumps({ "traceEvents": [
+        { "name": "load", "cat": "load", "ph": "X", "ts": 5, "dur": 1_000_000, "pid": 2, "tid": 1,
+          "args": { "target": "p1", "nodes": 10, "edges": 20 } },
+    ] }))
+    tracer = trace.Tracer()
+    tracer.add("extract", "extract", 1, 3_000_001, "p1")
+    tracer.merge(str(tmp_path / "graphmatcher.json"))
+    tracer.merge(str(tmp_path / "missing.json"))
+    assert tracer.projectTotals() == { "p1": { "extract": 3.0, "load": 1.0, "nodes": 10, "edges": 20 } }
+
+    tracer.write(str(tmp_path / "trace.json"))
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert [ event["name"] for event in events ] == [ "process_name", "extract", "load" ]
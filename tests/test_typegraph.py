@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from pipeline import typegraph
+
+EDGES = [
+    [ "java+class:///Sketch/Ball", "contains", "java+method:///Sketch/Ball/move()" ],
+    [ "java+class:///Sketch/Ball", { "annotation": { "scheme": "java+class" } }, "java+class:///Sketch/Ball" ],
+    [ "java+class:///Sketch/Balé", "extends", "java+class:///Sketch/球" ],
+    [ "java+class:///Sketch/Balé", { "annotation": { "modifier": "public" } }, "java+class:///Sketch/Balé" ],
+    [ "java+class:///Sketch/\U0001F3C0", "dependsOn", "java+class:///Sketch/Ball" ],
+]
+
+def roundTrip(tmp_path, edges):
+    (tmp_path / "typegraph.bin").write_bytes(typegraph.encode(edges))
+    with typegraph.BinaryTypeGraph(tmp_path / "typegraph.bin") as graph:
+        return list(graph.edges()), graph.nodeCount()
+
+def testBinaryRoundTrip(tmp_path):
+    edges, nodes = roundTrip(tmp_path, EDGES)
+    assert edges == EDGES
+    assert nodes == 5
+
+def testBinaryRoundTripEmptyGraph(tmp_path):
+    assert roundTrip(tmp_path, []) == ([], 0)
+
+def testStringsAreStoredOnce():
+    data = typegraph.encode([ [ "a", "contains", "b" ], [ "a", "contains", "c" ], [ "b", "contains", "c" ] ])
+    _, _, strings, labels, edges = typegraph.HEADER.unpack_from(data)
+    assert (strings, labels, edges) == (4, 1, 3)
+
+def testConvertBetweenFormats(tmp_path):
+    (tmp_path / "typegraph.json").write_text(json.dumps(EDGES), encoding = "utf-8")
+    typegraph.convert(tmp_path / "typegraph.json", tmp_path / "typegraph.bin")
+    typegraph.convert(tmp_path / "typegraph.bin", tmp_path / "converted.json")
+    assert typegraph.readEdges(tmp_path / "typegraph.bin") == EDGES
+    assert typegraph.readEdges(tmp_path / "converted.json") == EDGES
+
+def testRejectsInvalidFiles(tmp_path):
+    with pytest.raises(ValueError):
+        typegraph.encode([ [ "a", "calls", "b" ] ])
+    (tmp_path / "other.bin").write_bytes(b"PK\3\4" + bytes(20))
+    with pytest.raises(ValueError):
+        typegraph.BinaryTypeGraph(tmp_path / "other.bin")
+    (tmp_path / "truncated.bin").write_bytes(typegraph.encode(EDGES)[:-4])
+    with pytest.raises(ValueError):
+        typegraph.BinaryTypeGraph(tmp_path / "truncated.bin")